@@ -1,4 +1,5 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 import httpx
@@ -6,6 +7,7 @@ import os
 import logging
 from typing import Optional
 import time
+from starlette.background import BackgroundTask
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -36,7 +38,7 @@ app.add_middleware(
 SERVICES = {
     "auth": os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000"),
     "image": os.getenv("IMAGE_SERVICE_URL", "http://image-service:8000"),
-    # "neural": os.getenv("NEURAL_SERVICE_URL", "http://neural-service:8000"),  # Закомментирован
+    "neural": os.getenv("NEURAL_SERVICE_URL", "http://neural-service:8000"),
     "coordinates": os.getenv("COORDINATES_SERVICE_URL", "http://coordinates-service:8000"),
     "export": os.getenv("EXPORT_SERVICE_URL", "http://export-service:8000"),
     "notification": os.getenv("NOTIFICATION_SERVICE_URL", "http://notification-service:8000"),
@@ -86,6 +88,48 @@ async def proxy_request(service_name: str, path: str, method: str, **kwargs):
     except httpx.ConnectError:
         raise HTTPException(status_code=503, detail=f"Service {service_name} unavailable")
 
+# Заголовки ответа, передаваемые клиенту при потоковом проксировании
+STREAM_RESPONSE_HEADERS = ("content-type", "content-disposition")
+
+async def proxy_stream(service_name: str, path: str, request: Request):
+    """Потоковое проксирование: тело запроса и ответа передаются порциями
+
+    Для выгрузок, размер которых не ограничен: шлюз не держит их в памяти
+    целиком и не обрывает долгую генерацию по общему таймауту.
+    """
+    service_url = SERVICES.get(service_name)
+    if not service_url:
+        raise HTTPException(status_code=503, detail=f"Service {service_name} not available")
+    
+    client = httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None))
+    upstream_request = client.build_request(
+        request.method,
+        f"{service_url}{path}",
+        params=request.query_params,
+        headers={"content-type": request.headers.get("content-type", "application/json")},
+        content=request.stream() if request.method == "POST" else None
+    )
+    try:
+        response = await client.send(upstream_request, stream=True)
+    except httpx.TimeoutException:
+        await client.aclose()
+        raise HTTPException(status_code=504, detail="Service timeout")
+    except httpx.ConnectError:
+        await client.aclose()
+        raise HTTPException(status_code=503, detail=f"Service {service_name} unavailable")
+    
+    async def close():
+        await response.aclose()
+        await client.aclose()
+    
+    headers = {name: response.headers[name] for name in STREAM_RESPONSE_HEADERS if name in response.headers}
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        headers=headers,
+        background=BackgroundTask(close)
+    )
+
 # Health check
 @app.get("/health")
 async def health_check():
@@ -126,7 +170,9 @@ async def upload_images(request: Request):
     """Загрузка и обработка изображений"""
     form_data = await request.form()
     files = await request.form()
-    response = await proxy_request("image", "/detect-buildings", "POST", files=files)
+    response = await proxy_request(
+        "image", "/detect-buildings", "POST", files=files, params=request.query_params
+    )
     return response.json()
 
 @app.post("/api/images/preprocess")
@@ -137,14 +183,25 @@ async def preprocess_image(request: Request):
     response = await proxy_request("image", "/preprocess", "POST", files=files)
     return response.json()
 
-# Neural network routes (закомментированы - сервис не развернут)
-# @app.post("/api/neural/predict")
-# async def predict_coordinates(request: Request):
-#     """Предсказание координат через нейросеть"""
-#     form_data = await request.form()
-#     files = await request.form()
-#     response = await proxy_request("neural", "/predict", "POST", files=files)
-#     return response.json()
+# Neural network routes
+@app.post("/api/neural/predict")
+async def predict_coordinates(request: Request):
+    """Предсказание координат через нейросеть"""
+    form_data = await request.form()
+    files = await request.form()
+    response = await proxy_request("neural", "/predict", "POST", files=files)
+    return response.json()
+
+@app.post("/api/neural/predict/batch")
+async def predict_coordinates_batch(request: Request):
+    """Предсказание координат для нескольких изображений"""
+    form_data = await request.form()
+    files = [
+        ("files", (upload.filename, await upload.read(), upload.content_type))
+        for upload in form_data.getlist("files")
+    ]
+    response = await proxy_request("neural", "/predict/batch", "POST", files=files)
+    return response.json()
 
 # Coordinates routes
 @app.post("/api/coordinates/address")
@@ -158,23 +215,124 @@ async def get_address(request: Request):
 async def get_street_view(request: Request):
     """Получение Street View изображения"""
     body = await request.body()
-    response = await proxy_request("coordinates", "/get-street-view", "POST", content=body)
+    response = await proxy_request(
+        "coordinates", "/get-street-view", "POST",
+        content=body, params=request.query_params
+    )
+    return response.json()
+
+@app.get("/api/coordinates/street-view-image/{object_key}")
+async def get_street_view_image(object_key: str, request: Request):
+    """Получение закэшированного Street View изображения"""
+    headers = {}
+    if "if-none-match" in request.headers:
+        headers["If-None-Match"] = request.headers["if-none-match"]
+    response = await proxy_request(
+        "coordinates", f"/street-view-image/{object_key}", "GET", headers=headers
+    )
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type"),
+        headers={k: v for k, v in response.headers.items() if k.lower() in ("etag", "cache-control", "x-cache")}
+    )
+
+@app.post("/api/coordinates/index")
+async def index_coordinates(request: Request):
+    """Добавление координат зданий в пространственный индекс"""
+    body = await request.body()
+    response = await proxy_request("coordinates", "/spatial-index/points", "POST", content=body)
+    return response.json()
+
+@app.post("/api/coordinates/nearest")
+async def nearest_buildings(request: Request):
+    """Поиск ближайших ранее геолоцированных зданий"""
+    body = await request.body()
+    response = await proxy_request("coordinates", "/nearest", "POST", content=body)
+    return response.json()
+
+@app.post("/api/coordinates/within-radius")
+async def buildings_within_radius(request: Request):
+    """Поиск зданий в радиусе"""
+    body = await request.body()
+    response = await proxy_request("coordinates", "/within-radius", "POST", content=body)
+    return response.json()
+
+# Results catalog routes
+@app.post("/api/results/batch")
+async def ingest_results(request: Request):
+    """Пакетная загрузка результатов в каталог"""
+    body = await request.body()
+    response = await proxy_request("coordinates", "/results/batch", "POST", content=body)
+    return response.json()
+
+@app.get("/api/results")
+async def query_results(request: Request):
+    """Выборка результатов из каталога"""
+    response = await proxy_request("coordinates", "/results", "GET", params=request.query_params)
     return response.json()
 
 # Export routes
 @app.post("/api/export/xlsx")
 async def export_xlsx(request: Request):
     """Экспорт данных в XLSX"""
-    body = await request.body()
-    response = await proxy_request("export", "/export/xlsx", "POST", content=body)
-    return response
+    return await proxy_stream("export", "/export/xlsx", request)
+
+@app.post("/api/export/records")
+async def export_records(request: Request):
+    """Экспорт данных в выбранном формате (?format=xlsx|csv|parquet|geojson|ndjson)"""
+    return await proxy_stream("export", "/export/records", request)
+
+@app.get("/api/export/results")
+async def export_results(request: Request):
+    """Экспорт результатов из каталога в выбранном формате"""
+    return await proxy_stream("export", "/export/results", request)
+
+@app.get("/api/export/xlsx/results")
+async def export_results_xlsx(request: Request):
+    """Экспорт результатов из каталога в XLSX"""
+    return await proxy_stream("export", "/export/xlsx/results", request)
 
 @app.post("/api/export/images")
 async def export_images(request: Request):
     """Экспорт изображений в ZIP"""
+    return await proxy_stream("export", "/export/images", request)
+
+@app.post("/api/export/images/objects")
+async def export_image_objects(request: Request):
+    """Экспорт изображений в ZIP по ключам объектов хранилища"""
+    return await proxy_stream("export", "/export/images/objects", request)
+
+@app.get("/api/export/images/results")
+async def export_result_images(request: Request):
+    """Экспорт изображений зданий из каталога результатов в ZIP"""
+    return await proxy_stream("export", "/export/images/results", request)
+
+@app.post("/api/export/jobs")
+async def submit_export_job(request: Request):
+    """Постановка экспорта в очередь фоновых воркеров"""
     body = await request.body()
-    response = await proxy_request("export", "/export/images", "POST", content=body)
-    return response
+    response = await proxy_request("export", "/export/jobs", "POST", content=body)
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type")
+    )
+
+@app.get("/api/export/jobs/{job_id}")
+async def get_export_job(job_id: str):
+    """Состояние задания экспорта"""
+    response = await proxy_request("export", f"/export/jobs/{job_id}", "GET")
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type")
+    )
+
+@app.get("/api/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request):
+    """Скачивание готового файла экспорта"""
+    return await proxy_stream("export", f"/export/jobs/{job_id}/download", request)
 
 # Notification routes
 @app.post("/api/notifications/send")
@@ -184,6 +342,48 @@ async def send_notification(request: Request):
     response = await proxy_request("notification", "/send", "POST", content=body)
     return response.json()
 
+@app.post("/api/notifications/send/batch")
+async def send_notifications_batch(request: Request):
+    """Пакетная отправка уведомлений"""
+    body = await request.body()
+    response = await proxy_request("notification", "/send/batch", "POST", content=body)
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/json")
+    )
+
+@app.get("/api/notifications/user/{user_id}")
+async def get_user_notifications(user_id: int, request: Request):
+    """Уведомления пользователя по страницам"""
+    response = await proxy_request("notification", f"/user/{user_id}", "GET",
+                                   params=dict(request.query_params))
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/json")
+    )
+
+@app.get("/api/notifications/unread/{user_id}")
+async def get_unread_count(user_id: int):
+    """Число непрочитанных уведомлений"""
+    response = await proxy_request("notification", f"/unread/{user_id}", "GET")
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/json")
+    )
+
+@app.post("/api/notifications/mark-read/{user_id}/{notification_id}")
+async def mark_notification_read(user_id: int, notification_id: str):
+    """Отметка уведомления как прочитанного"""
+    response = await proxy_request("notification", f"/mark-read/{user_id}/{notification_id}", "POST")
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type", "application/json")
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
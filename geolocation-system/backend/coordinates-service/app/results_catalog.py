@@ -0,0 +1,358 @@
+import base64
+import json
+import logging
+import math
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+
+# Колонки таблицы results в порядке COPY
+COLUMNS = (
+    "id", "user_id", "image_filename", "building_ref", "latitude", "longitude",
+    "geohash", "confidence", "bbox", "address", "source", "created_at"
+)
+
+
+def geohash_encode(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Кодирование координат в geohash"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def geohash_cell_size(precision: int) -> Tuple[float, float]:
+    """Размер ячейки geohash (lat, lon) в градусах"""
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def geohash_cover(min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                  max_cells: int = 32) -> List[str]:
+    """Набор префиксов geohash, покрывающих bounding box (без перехода через 180°)"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lon = geohash_cell_size(precision)
+        n_lat = math.floor((max_lat + 90.0) / cell_lat) - math.floor((min_lat + 90.0) / cell_lat) + 1
+        n_lon = math.floor((max_lon + 180.0) / cell_lon) - math.floor((min_lon + 180.0) / cell_lon) + 1
+        if n_lat * n_lon <= max_cells:
+            break
+    else:
+        return [""]
+
+    start_lat = -90.0 + math.floor((min_lat + 90.0) / cell_lat) * cell_lat
+    start_lon = -180.0 + math.floor((min_lon + 180.0) / cell_lon) * cell_lon
+    prefixes = set()
+    for i in range(n_lat):
+        for j in range(n_lon):
+            lat = min(89.999999, start_lat + (i + 0.5) * cell_lat)
+            lon = min(179.999999, start_lon + (j + 0.5) * cell_lon)
+            prefixes.add(geohash_encode(lat, lon, precision))
+    return sorted(prefixes)
+
+
+def encode_cursor(created_at: datetime, result_id: str) -> str:
+    payload = json.dumps([to_utc(created_at).isoformat(timespec="microseconds"), result_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        created_at, result_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), result_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def to_utc(value: Optional[datetime]) -> datetime:
+    if value is None:
+        return datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_sqlite_timestamp(value: Optional[datetime]) -> str:
+    """Время в виде строки фиксированного формата (сортируется лексикографически)"""
+    return to_utc(value).isoformat(timespec="microseconds")
+
+
+class _Query:
+    """Построитель WHERE с плейсхолдерами конкретного драйвера"""
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.conditions: List[str] = []
+        self.params: List = []
+
+    def param(self, value) -> str:
+        self.params.append(value)
+        return self.placeholder(len(self.params))
+
+    def where(self) -> str:
+        return " WHERE " + " AND ".join(self.conditions) if self.conditions else ""
+
+
+class ResultsCatalog:
+    """Каталог результатов детекции и геолокации
+
+    Поддерживает PostgreSQL (asyncpg, пул соединений, загрузка через COPY)
+    и SQLite (aiosqlite) как локальную замену для тестов и разработки.
+    """
+
+    def __init__(self, database_url: str, batch_size: int = 10000,
+                 min_pool_size: int = 2, max_pool_size: int = 10):
+        self.database_url = database_url
+        self.batch_size = batch_size
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.is_sqlite = database_url.startswith("sqlite")
+        self.pool = None
+        self.sqlite = None
+
+    # --- Подключение и схема ---
+
+    async def connect(self):
+        if self.is_sqlite:
+            import aiosqlite
+            path = self.database_url.split("sqlite:///", 1)[-1] or ":memory:"
+            self.sqlite = await aiosqlite.connect(path)
+            await self.sqlite.execute("PRAGMA journal_mode=WAL")
+        else:
+            import asyncpg
+            self.pool = await asyncpg.create_pool(
+                self.database_url,
+                min_size=self.min_pool_size,
+                max_size=self.max_pool_size
+            )
+        await self._create_schema()
+        logger.info(f"Results catalog connected ({'sqlite' if self.is_sqlite else 'postgres'})")
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        if self.sqlite is not None:
+            await self.sqlite.close()
+            self.sqlite = None
+
+    @property
+    def connected(self) -> bool:
+        return self.pool is not None or self.sqlite is not None
+
+    async def _create_schema(self):
+        timestamp_type = "TEXT" if self.is_sqlite else "TIMESTAMPTZ"
+        float_type = "REAL" if self.is_sqlite else "DOUBLE PRECISION"
+        # Побайтовое сравнение нужно для диапазонов префиксов geohash
+        geohash_type = "TEXT" if self.is_sqlite else 'TEXT COLLATE "C"'
+        statements = [
+            f"""
+            CREATE TABLE IF NOT EXISTS results (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                image_filename TEXT,
+                building_ref TEXT,
+                latitude {float_type} NOT NULL,
+                longitude {float_type} NOT NULL,
+                geohash {geohash_type} NOT NULL,
+                confidence {float_type},
+                bbox TEXT,
+                address TEXT,
+                source TEXT,
+                created_at {timestamp_type} NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS results_geohash_idx ON results (geohash)",
+            "CREATE INDEX IF NOT EXISTS results_created_idx ON results (created_at, id)",
+            "CREATE INDEX IF NOT EXISTS results_user_created_idx ON results (user_id, created_at, id)",
+        ]
+        if self.is_sqlite:
+            for statement in statements:
+                await self.sqlite.execute(statement)
+            await self.sqlite.commit()
+        else:
+            async with self.pool.acquire() as conn:
+                for statement in statements:
+                    await conn.execute(statement)
+
+    # --- Загрузка ---
+
+    def _to_row(self, record: Dict) -> Tuple:
+        lat = float(record["latitude"])
+        lon = float(record["longitude"])
+        created_at = to_utc(record.get("created_at"))
+        bbox = record.get("bbox")
+        return (
+            record.get("id") or uuid.uuid4().hex,
+            record.get("user_id"),
+            record.get("image_filename"),
+            record.get("building_ref"),
+            lat,
+            lon,
+            geohash_encode(lat, lon),
+            record.get("confidence"),
+            json.dumps(bbox) if bbox is not None else None,
+            record.get("address"),
+            record.get("source"),
+            to_sqlite_timestamp(created_at) if self.is_sqlite else created_at,
+        )
+
+    async def ingest(self, records: Sequence[Dict]) -> List[Tuple[str, float, float]]:
+        """Пакетная загрузка результатов
+
+        Возвращает (id, latitude, longitude) загруженных записей.
+        """
+        loaded = []
+        for start in range(0, len(records), self.batch_size):
+            # Повторы id в пакете: остается последняя запись. Postgres не
+            # обновляет одну строку дважды в INSERT ... ON CONFLICT, поэтому
+            # оба хранилища получают пакет без повторов
+            rows = list({row[0]: row for row in map(self._to_row, records[start:start + self.batch_size])}.values())
+            if self.is_sqlite:
+                placeholders = ", ".join("?" for _ in COLUMNS)
+                await self.sqlite.executemany(
+                    f"INSERT OR REPLACE INTO results ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                    rows
+                )
+                await self.sqlite.commit()
+            else:
+                await self._copy_batch(rows)
+            loaded.extend((row[0], row[4], row[5]) for row in rows)
+            logger.info(f"Ingested batch of {len(rows)} results")
+        return loaded
+
+    async def _copy_batch(self, rows: List[Tuple]):
+        """COPY во временную таблицу и upsert в results одной транзакцией"""
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMNS[1:])
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "CREATE TEMP TABLE results_staging (LIKE results INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                await conn.copy_records_to_table("results_staging", records=rows, columns=list(COLUMNS))
+                await conn.execute(
+                    f"INSERT INTO results ({', '.join(COLUMNS)}) "
+                    f"SELECT {', '.join(COLUMNS)} FROM results_staging "
+                    f"ON CONFLICT (id) DO UPDATE SET {updates}"
+                )
+
+    # --- Запросы ---
+
+    def _placeholder(self, n: int) -> str:
+        return "?" if self.is_sqlite else f"${n}"
+
+    async def query(self, user_id: Optional[int] = None,
+                    date_from: Optional[datetime] = None, date_to: Optional[datetime] = None,
+                    bbox: Optional[Tuple[float, float, float, float]] = None,
+                    cursor: Optional[str] = None, limit: int = 100) -> Dict:
+        """Постраничная выборка (keyset-курсор по created_at, id)
+
+        bbox задается как (min_lat, min_lon, max_lat, max_lon); если
+        min_lon > max_lon, bbox пересекает меридиан 180°.
+        """
+        q = _Query(self._placeholder)
+        ts = to_sqlite_timestamp if self.is_sqlite else to_utc
+
+        if user_id is not None:
+            q.conditions.append(f"user_id = {q.param(user_id)}")
+        if date_from is not None:
+            q.conditions.append(f"created_at >= {q.param(ts(date_from))}")
+        if date_to is not None:
+            q.conditions.append(f"created_at < {q.param(ts(date_to))}")
+        if bbox is not None:
+            self._bbox_conditions(q, *bbox)
+        if cursor:
+            cursor_ts, cursor_id = decode_cursor(cursor)
+            q.conditions.append(
+                f"(created_at, id) < ({q.param(ts(cursor_ts))}, {q.param(cursor_id)})"
+            )
+
+        sql = (
+            f"SELECT {', '.join(COLUMNS)} FROM results{q.where()} "
+            f"ORDER BY created_at DESC, id DESC LIMIT {q.param(limit + 1)}"
+        )
+        rows = await self._fetch(sql, q.params)
+
+        items = [self._row_to_dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(datetime.fromisoformat(last["created_at"]), last["id"])
+        return {"items": items, "next_cursor": next_cursor}
+
+    def _bbox_conditions(self, q: _Query, min_lat: float, min_lon: float,
+                         max_lat: float, max_lon: float):
+        if min_lon <= max_lon:
+            spans = [(min_lon, max_lon)]
+            q.conditions.append(
+                f"longitude BETWEEN {q.param(min_lon)} AND {q.param(max_lon)}"
+            )
+        else:
+            spans = [(min_lon, 180.0), (-180.0, max_lon)]
+            q.conditions.append(
+                f"(longitude >= {q.param(min_lon)} OR longitude <= {q.param(max_lon)})"
+            )
+        q.conditions.append(f"latitude BETWEEN {q.param(min_lat)} AND {q.param(max_lat)}")
+
+        # Диапазоны geohash позволяют использовать индекс results_geohash_idx
+        ranges = []
+        for span_min, span_max in spans:
+            for prefix in geohash_cover(min_lat, span_min, max_lat, span_max):
+                if not prefix:
+                    return
+                ranges.append(f"(geohash >= {q.param(prefix)} AND geohash < {q.param(prefix + '~')})")
+        q.conditions.append("(" + " OR ".join(ranges) + ")")
+
+    async def _fetch(self, sql: str, params: List) -> List[Tuple]:
+        if self.is_sqlite:
+            async with self.sqlite.execute(sql, params) as cur:
+                return await cur.fetchall()
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(sql, *params)
+
+    def _row_to_dict(self, row) -> Dict:
+        item = dict(zip(COLUMNS, tuple(row)))
+        if item["bbox"] is not None:
+            item["bbox"] = json.loads(item["bbox"])
+        created_at = item["created_at"]
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        item["created_at"] = to_utc(created_at).isoformat()
+        return item
+
+    async def iter_points(self, batch_size: int = 50000) -> AsyncIterator[List[Tuple[str, float, float]]]:
+        """Постраничный обход координат всех результатов (для построения индекса)"""
+        last_id = ""
+        while True:
+            sql = (
+                f"SELECT id, latitude, longitude FROM results WHERE id > {self._placeholder(1)} "
+                f"ORDER BY id LIMIT {self._placeholder(2)}"
+            )
+            rows = await self._fetch(sql, [last_id, batch_size])
+            if not rows:
+                return
+            yield [tuple(row) for row in rows]
+            last_id = rows[-1][0]
@@ -0,0 +1,545 @@
+import heapq
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Размеры ячеек уровней сетки в градусах (от мелких к крупным),
+# каждый размер кратен предыдущему
+DEFAULT_CELL_SIZES = (0.005, 0.05, 0.5, 5.0, 45.0)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по большому кругу в километрах"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridLevel:
+    """Один уровень иерархической сетки"""
+
+    def __init__(self, cell_size: float):
+        self.cell_size = cell_size
+        self.n_lat = int(math.ceil(180.0 / cell_size))
+        self.n_lon = int(math.ceil(360.0 / cell_size))
+        # Самый мелкий уровень: ячейка -> номера точек,
+        # остальные уровни: ячейка -> непустые дочерние ячейки
+        self.cells: Dict[Tuple[int, int], object] = {}
+
+    def cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        i = min(int((lat + 90.0) // self.cell_size), self.n_lat - 1)
+        j = int((lon + 180.0) // self.cell_size) % self.n_lon
+        return i, j
+
+    def center(self, key: Tuple[int, int]) -> Tuple[float, float]:
+        i, j = key
+        return -90.0 + (i + 0.5) * self.cell_size, -180.0 + (j + 0.5) * self.cell_size
+
+    def ring(self, ci: int, cj: int, r: int) -> Iterable[Tuple[int, int]]:
+        """Ячейки на расстоянии ровно r (по Чебышёву) от (ci, cj)"""
+        if r == 0:
+            yield ci, cj
+            return
+        for di in range(-r, r + 1):
+            i = ci + di
+            if i < 0 or i >= self.n_lat:
+                continue
+            if abs(di) == r:
+                for dj in range(-r, r + 1):
+                    yield i, (cj + dj) % self.n_lon
+            else:
+                yield i, (cj - r) % self.n_lon
+                yield i, (cj + r) % self.n_lon
+
+    def ring_bound_km(self, lat: float, r: int) -> float:
+        """Нижняя оценка расстояния до ячеек за пределами кольца r"""
+        if r == 0:
+            return 0.0
+        phi_max = math.radians(min(90.0, abs(lat) + (r + 1) * self.cell_size))
+        half = min(math.pi, math.radians(r * self.cell_size)) / 2
+        return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(phi_max) * math.sin(half)))
+
+    def min_distance_km(self, lat: float, lon: float, key: Tuple[int, int]) -> float:
+        """Нижняя оценка расстояния от точки до любой точки ячейки"""
+        i, j = key
+        cs = self.cell_size
+        lat1 = -90.0 + i * cs
+        lat2 = min(90.0, lat1 + cs)
+        if lat < lat1:
+            dlat = lat1 - lat
+        elif lat > lat2:
+            dlat = lat - lat2
+        else:
+            dlat = 0.0
+
+        offset = (lon - (-180.0 + j * cs)) % 360.0
+        dlon = 0.0 if offset <= cs else min(offset - cs, 360.0 - offset)
+
+        bound = EARTH_RADIUS_KM * math.radians(dlat)
+        if dlon > 0.0:
+            phi_max = math.radians(min(90.0, max(abs(lat), abs(lat1), abs(lat2))))
+            lon_bound = 2 * EARTH_RADIUS_KM * math.asin(
+                min(1.0, math.cos(phi_max) * math.sin(math.radians(dlon) / 2))
+            )
+            bound = max(bound, lon_bound)
+        return bound
+
+
+class SpatialIndex:
+    """Инкрементальный иерархический grid-индекс координат зданий
+
+    Точки хранятся в компактных массивах и раскладываются по ячейкам
+    самого мелкого уровня сетки, более крупные уровни хранят только
+    непустые дочерние ячейки. Поиск k ближайших сначала просматривает
+    несколько колец соседних ячеек (быстрый путь для плотных районов),
+    а если этого недостаточно - выполняет best-first обход иерархии
+    с нижними оценками расстояния до ячеек, поэтому пустые области
+    отсекаются целиком.
+
+    Индекс сохраняется на диск снапшотом (бинарные массивы) и журналом
+    изменений (WAL), который воспроизводится при старте. Изменения снапшот
+    не пишут: когда журнал дорастает до snapshot_every записей, snapshot_due
+    становится True и вызывающий код запускает maybe_snapshot (в сервисе -
+    в пуле потоков).
+    """
+
+    SNAPSHOT_DIR = "snapshot"
+    WAL_FILE = "wal.jsonl"
+    # Журнал, уже вошедший в компактный индекс, но еще не в снапшот на диске
+    PENDING_WAL_FILE = "wal.pending.jsonl"
+
+    def __init__(self, data_dir: Optional[str] = None,
+                 cell_sizes: Tuple[float, ...] = DEFAULT_CELL_SIZES,
+                 snapshot_every: int = 100000, fast_path_rings: int = 2):
+        self.data_dir = data_dir
+        self.cell_sizes = tuple(sorted(cell_sizes))
+        self.snapshot_every = snapshot_every
+        self.fast_path_rings = fast_path_rings
+        self._lock = threading.RLock()
+        self._snapshot_lock = threading.RLock()
+        self._wal = None
+        self._wal_entries = 0
+        self._reset()
+
+    def _reset(self):
+        self.lats = array('d')
+        self.lons = array('d')
+        self.refs: List[Optional[str]] = []
+        self.positions: Dict[str, int] = {}
+        self.levels = [GridLevel(size) for size in self.cell_sizes]
+
+    def __len__(self):
+        return len(self.positions)
+
+    # --- Изменение индекса ---
+
+    def upsert(self, ref: str, lat: float, lon: float):
+        """Добавление или перемещение точки"""
+        with self._lock:
+            self._upsert(ref, lat, lon)
+            self._log({"op": "upsert", "ref": ref, "lat": lat, "lon": lon})
+
+    def upsert_many(self, points: Iterable[Tuple[str, float, float]]) -> int:
+        """Пакетное добавление точек
+
+        Пакет проверяется целиком до изменений: ошибка в одной точке
+        не оставляет индекс и журнал частично обновленными.
+        """
+        points = list(points)
+        for ref, lat, lon in points:
+            self._validate(ref, lat, lon)
+        with self._lock:
+            try:
+                for ref, lat, lon in points:
+                    self._upsert(ref, lat, lon)
+                    self._log({"op": "upsert", "ref": ref, "lat": lat, "lon": lon}, flush=False)
+            finally:
+                if self._wal is not None:
+                    self._wal.flush()
+        return len(points)
+
+    def remove(self, ref: str) -> bool:
+        """Удаление точки"""
+        with self._lock:
+            removed = self._remove(ref)
+            if removed:
+                self._log({"op": "remove", "ref": ref})
+            return removed
+
+    @staticmethod
+    def _validate(ref: str, lat: float, lon: float):
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            raise ValueError(f"Invalid coordinates: {lat}, {lon}")
+        if "\n" in ref:
+            raise ValueError("Reference must not contain newlines")
+
+    def _upsert(self, ref: str, lat: float, lon: float):
+        self._validate(ref, lat, lon)
+        self._remove(ref)
+        pos = len(self.refs)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.refs.append(ref)
+        self.positions[ref] = pos
+        self._add_to_grid(pos, lat, lon)
+
+    def _add_to_grid(self, pos: int, lat: float, lon: float):
+        finest = self.levels[0]
+        key = finest.cell_of(lat, lon)
+        bucket = finest.cells.get(key)
+        if bucket is None:
+            finest.cells[key] = array('q', (pos,))
+            self._link_cell(key)
+        else:
+            bucket.append(pos)
+
+    def _link_cell(self, key: Tuple[int, int]):
+        """Регистрация новой непустой ячейки в родительских уровнях"""
+        for child, parent in zip(self.levels, self.levels[1:]):
+            parent_key = parent.cell_of(*child.center(key))
+            children = parent.cells.get(parent_key)
+            if children is not None:
+                children.add(key)
+                return
+            parent.cells[parent_key] = {key}
+            key = parent_key
+
+    def _remove(self, ref: str) -> bool:
+        pos = self.positions.pop(ref, None)
+        if pos is None:
+            return False
+        finest = self.levels[0]
+        key = finest.cell_of(self.lats[pos], self.lons[pos])
+        bucket = finest.cells[key]
+        bucket.remove(pos)
+        if not bucket:
+            del finest.cells[key]
+            self._unlink_cell(key)
+        self.refs[pos] = None
+        return True
+
+    def _unlink_cell(self, key: Tuple[int, int]):
+        """Удаление опустевшей ячейки из родительских уровней"""
+        for child, parent in zip(self.levels, self.levels[1:]):
+            parent_key = parent.cell_of(*child.center(key))
+            children = parent.cells[parent_key]
+            children.discard(key)
+            if children:
+                return
+            del parent.cells[parent_key]
+            key = parent_key
+
+    # --- Запросы ---
+
+    def _ring_search(self, lat: float, lon: float, k: int,
+                     max_distance_km: Optional[float]) -> Tuple[bool, List[Tuple[float, int]]]:
+        """Поиск по кольцам соседних ячеек самого мелкого уровня
+
+        Возвращает (точный ли результат, найденные кандидаты).
+        """
+        lats, lons = self.lats, self.lons
+        finest = self.levels[0]
+        ci, cj = finest.cell_of(lat, lon)
+        heap: List[Tuple[float, int]] = []  # (-distance, pos)
+        visited = set()
+        for r in range(self.fast_path_rings + 1):
+            for cell in finest.ring(ci, cj, r):
+                if cell in visited:
+                    continue
+                visited.add(cell)
+                for pos in finest.cells.get(cell, ()):
+                    d = haversine_km(lat, lon, lats[pos], lons[pos])
+                    if max_distance_km is not None and d > max_distance_km:
+                        continue
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d, pos))
+                    elif d < -heap[0][0]:
+                        heapq.heapreplace(heap, (-d, pos))
+            bound = finest.ring_bound_km(lat, r)
+            exact = ((len(heap) == k and -heap[0][0] <= bound)
+                     or (max_distance_km is not None and bound > max_distance_km))
+            if exact:
+                break
+        return exact, sorted((-d, pos) for d, pos in heap)
+
+    def _search(self, lat: float, lon: float, k: Optional[int],
+                max_distance_km: Optional[float]) -> List[Tuple[float, int]]:
+        """Best-first обход иерархии ячеек"""
+        lats, lons = self.lats, self.lons
+        top = len(self.levels) - 1
+        top_level = self.levels[top]
+        heap: List[Tuple[float, int, int, object]] = []
+        seq = 0
+        for key in top_level.cells:
+            d = top_level.min_distance_km(lat, lon, key)
+            if max_distance_km is None or d <= max_distance_km:
+                heap.append((d, seq, top, key))
+                seq += 1
+        heapq.heapify(heap)
+
+        found: List[Tuple[float, int]] = []
+        while heap:
+            d, _, level_idx, item = heapq.heappop(heap)
+            if max_distance_km is not None and d > max_distance_km:
+                break
+            if level_idx < 0:
+                found.append((d, item))
+                if k is not None and len(found) >= k:
+                    break
+                continue
+
+            level = self.levels[level_idx]
+            if level_idx == 0:
+                for pos in level.cells[item]:
+                    pd = haversine_km(lat, lon, lats[pos], lons[pos])
+                    if max_distance_km is None or pd <= max_distance_km:
+                        heapq.heappush(heap, (pd, seq, -1, pos))
+                        seq += 1
+            else:
+                child_level = self.levels[level_idx - 1]
+                for child in level.cells[item]:
+                    cd = child_level.min_distance_km(lat, lon, child)
+                    if max_distance_km is None or cd <= max_distance_km:
+                        heapq.heappush(heap, (cd, seq, level_idx - 1, child))
+                        seq += 1
+        return found
+
+    def nearest(self, lat: float, lon: float, k: int = 10,
+                max_distance_km: Optional[float] = None) -> List[Dict]:
+        """k ближайших точек"""
+        with self._lock:
+            if not self.positions or k <= 0:
+                return []
+            exact, candidates = self._ring_search(lat, lon, k, max_distance_km)
+            if exact:
+                return self._format(candidates)
+            # k-е найденное расстояние ограничивает дальнейший обход
+            if len(candidates) == k:
+                bound = candidates[-1][0]
+                if max_distance_km is not None:
+                    bound = min(bound, max_distance_km)
+                max_distance_km = bound
+            return self._format(self._search(lat, lon, k, max_distance_km))
+
+    def within_radius(self, lat: float, lon: float, radius_km: float,
+                      limit: Optional[int] = None) -> List[Dict]:
+        """Точки в радиусе radius_km, отсортированные по расстоянию"""
+        with self._lock:
+            if not self.positions:
+                return []
+            return self._format(self._search(lat, lon, limit, radius_km))
+
+    def _format(self, items: List[Tuple[float, int]]) -> List[Dict]:
+        return [
+            {
+                "ref": self.refs[pos],
+                "latitude": self.lats[pos],
+                "longitude": self.lons[pos],
+                "distance_km": d
+            }
+            for d, pos in items
+        ]
+
+    # --- Персистентность ---
+
+    def _log(self, entry: Dict, flush: bool = True):
+        if self._wal is None:
+            return
+        self._wal.write(json.dumps(entry) + "\n")
+        self._wal_entries += 1
+        if flush:
+            self._wal.flush()
+
+    @property
+    def snapshot_due(self) -> bool:
+        return self._wal is not None and self._wal_entries >= self.snapshot_every
+
+    def maybe_snapshot(self) -> bool:
+        """Снапшот, если журнал дорос до snapshot_every записей и снапшот еще не идет"""
+        if not self._snapshot_lock.acquire(blocking=False):
+            return False
+        try:
+            if not self.snapshot_due:
+                return False
+            self.snapshot()
+            return True
+        finally:
+            self._snapshot_lock.release()
+
+    def load(self):
+        """Загрузка снапшота и воспроизведение журнала"""
+        if not self.data_dir:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._lock:
+            self._reset()
+            snapshot_dir = os.path.join(self.data_dir, self.SNAPSHOT_DIR)
+            if not os.path.isdir(snapshot_dir) and os.path.isdir(snapshot_dir + ".old"):
+                # Сбой во время замены снапшота
+                snapshot_dir = snapshot_dir + ".old"
+            if os.path.isdir(snapshot_dir):
+                self._load_snapshot(snapshot_dir)
+
+            # Незаписанный снапшот: его журнал воспроизводится первым.
+            # Если снапшот все же успел записаться, повтор ничего не меняет -
+            # итог каждой операции зависит только от последней записи по ref
+            wal_path = os.path.join(self.data_dir, self.WAL_FILE)
+            replayed = 0
+            for path in (os.path.join(self.data_dir, self.PENDING_WAL_FILE), wal_path):
+                if os.path.exists(path):
+                    replayed += self._replay(path)
+
+            self._wal_entries = replayed
+            self._wal = open(wal_path, "a")
+            logger.info(f"Spatial index loaded: {len(self)} points, {replayed} WAL entries replayed")
+
+    def _replay(self, wal_path: str) -> int:
+        replayed = 0
+        with open(wal_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя запись
+                    logger.warning("Skipping truncated spatial index WAL entry")
+                    continue
+                if entry["op"] == "upsert":
+                    self._upsert(entry["ref"], entry["lat"], entry["lon"])
+                elif entry["op"] == "remove":
+                    self._remove(entry["ref"])
+                replayed += 1
+        return replayed
+
+    def _load_snapshot(self, snapshot_dir: str):
+        with open(os.path.join(snapshot_dir, "meta.json"), "r") as f:
+            meta = json.load(f)
+        count = meta["count"]
+
+        with open(os.path.join(snapshot_dir, "lats.bin"), "rb") as f:
+            self.lats.fromfile(f, count)
+        with open(os.path.join(snapshot_dir, "lons.bin"), "rb") as f:
+            self.lons.fromfile(f, count)
+        with open(os.path.join(snapshot_dir, "refs.txt"), "r") as f:
+            self.refs = f.read().split("\n")[:count]
+        self.positions = {ref: pos for pos, ref in enumerate(self.refs)}
+
+        if tuple(meta["cell_sizes"]) != self.cell_sizes:
+            # Конфигурация сетки изменилась - перестраиваем уровни
+            for pos in range(count):
+                self._add_to_grid(pos, self.lats[pos], self.lons[pos])
+            return
+
+        cells = array('q')
+        ids = array('q')
+        with open(os.path.join(snapshot_dir, "cells.bin"), "rb") as f:
+            cells.frombytes(f.read())
+        with open(os.path.join(snapshot_dir, "ids.bin"), "rb") as f:
+            ids.frombytes(f.read())
+        # Записи: i, j, start, count
+        finest = self.levels[0]
+        for c in range(0, len(cells), 4):
+            i, j, start, size = cells[c:c + 4]
+            finest.cells[(i, j)] = ids[start:start + size]
+            self._link_cell((i, j))
+
+    def snapshot(self):
+        """Сохранение компактного снапшота и очистка журнала
+
+        Под блокировкой индекс только компактизируется и журнал откладывается
+        в PENDING_WAL_FILE; файлы пишутся уже без блокировки, поэтому запросы
+        и изменения не ждут диск.
+        """
+        if not self.data_dir:
+            return
+        with self._snapshot_lock:
+            with self._lock:
+                self._compact()
+                lats, lons, refs = array('d', self.lats), array('d', self.lons), list(self.refs)
+                cells = array('q')
+                ids = array('q')
+                for (i, j), bucket in self.levels[0].cells.items():
+                    cells.extend((i, j, len(ids), len(bucket)))
+                    ids.extend(bucket)
+                self._rotate_wal()
+
+            self._write_snapshot(lats, lons, refs, cells, ids)
+            pending_path = os.path.join(self.data_dir, self.PENDING_WAL_FILE)
+            if os.path.exists(pending_path):
+                os.remove(pending_path)
+            logger.info(f"Spatial index snapshot saved: {len(refs)} points")
+
+    def _compact(self):
+        """Удаленные точки выбрасываются из массивов, номера точек сдвигаются"""
+        alive = [pos for pos, ref in enumerate(self.refs) if ref is not None]
+        if len(alive) == len(self.refs):
+            return
+        remap = {old: new for new, old in enumerate(alive)}
+        self.lats = array('d', (self.lats[pos] for pos in alive))
+        self.lons = array('d', (self.lons[pos] for pos in alive))
+        self.refs = [self.refs[pos] for pos in alive]
+        self.positions = {ref: pos for pos, ref in enumerate(self.refs)}
+        finest = self.levels[0]
+        finest.cells = {key: array('q', (remap[pos] for pos in bucket))
+                        for key, bucket in finest.cells.items()}
+
+    def _rotate_wal(self):
+        """Текущий журнал откладывается до записи снапшота, новые изменения идут в пустой"""
+        wal_path = os.path.join(self.data_dir, self.WAL_FILE)
+        pending_path = os.path.join(self.data_dir, self.PENDING_WAL_FILE)
+        if self._wal is not None:
+            self._wal.close()
+        if os.path.exists(wal_path):
+            if os.path.exists(pending_path):
+                # Предыдущий снапшот не записался - журналы склеиваются по порядку
+                with open(wal_path, "r") as src, open(pending_path, "a") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(wal_path)
+            else:
+                os.replace(wal_path, pending_path)
+        self._wal = open(wal_path, "w")
+        self._wal_entries = 0
+
+    def _write_snapshot(self, lats: array, lons: array, refs: List[str], cells: array, ids: array):
+        tmp_dir = os.path.join(self.data_dir, self.SNAPSHOT_DIR + ".tmp")
+        snapshot_dir = os.path.join(self.data_dir, self.SNAPSHOT_DIR)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        with open(os.path.join(tmp_dir, "lats.bin"), "wb") as f:
+            lats.tofile(f)
+        with open(os.path.join(tmp_dir, "lons.bin"), "wb") as f:
+            lons.tofile(f)
+        with open(os.path.join(tmp_dir, "refs.txt"), "w") as f:
+            f.write("\n".join(refs))
+        with open(os.path.join(tmp_dir, "cells.bin"), "wb") as f:
+            cells.tofile(f)
+        with open(os.path.join(tmp_dir, "ids.bin"), "wb") as f:
+            ids.tofile(f)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump({"count": len(refs), "cell_sizes": list(self.cell_sizes)}, f)
+
+        old_dir = snapshot_dir + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.isdir(snapshot_dir):
+            os.replace(snapshot_dir, old_dir)
+        os.replace(tmp_dir, snapshot_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def close(self):
+        """Сохранение снапшота при остановке"""
+        if self._wal is not None:
+            self.snapshot()
+            self._wal.close()
+            self._wal = None
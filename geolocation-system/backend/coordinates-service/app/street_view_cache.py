@@ -0,0 +1,252 @@
+import hashlib
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Optional, Tuple
+
+from minio import Minio
+from minio.commonconfig import REPLACE, CopySource
+from minio.error import S3Error
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedImage:
+    """Изображение из кэша Street View"""
+    key: str
+    data: bytes
+    etag: str
+    pano_id: Optional[str] = None
+    fetched_at: float = 0.0
+    source: str = "upstream"  # memory, storage, upstream
+
+
+class HotImageCache:
+    """In-memory LRU кэш изображений с ограничением по размеру в байтах"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, item: CachedImage):
+        size = len(item.data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(item.key, None)
+            if old is not None:
+                self.current_bytes -= len(old.data)
+            self._items[item.key] = item
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted.data)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class StreetViewCache:
+    """Двухуровневый кэш Street View: память + MinIO
+
+    Ключ кэша - округленные (lat, lon, heading, size). По истечении TTL
+    запись ревалидируется через бесплатный metadata API: если панорама
+    не изменилась, изображение повторно не скачивается.
+
+    Если MinIO недоступен, кэш работает только в памяти, а bucket
+    проверяется повторно из get/put с экспоненциальной паузой
+    (от retry_min_seconds до retry_max_seconds).
+    """
+
+    def __init__(self, minio_client: Optional[Minio], bucket: str = "street-view",
+                 precision: int = 5, ttl_seconds: int = 86400 * 30,
+                 hot_cache_bytes: int = 64 * 1024 * 1024,
+                 retry_min_seconds: float = 5.0, retry_max_seconds: float = 300.0):
+        self.minio_client = minio_client
+        self.bucket = bucket
+        self.precision = precision
+        self.ttl_seconds = ttl_seconds
+        self.hot = HotImageCache(hot_cache_bytes)
+        self.stats = {"memory": 0, "storage": 0, "upstream": 0, "revalidated": 0}
+        self.retry_min_seconds = retry_min_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self._storage_ready = False
+        self._retry_delay = retry_min_seconds
+        self._retry_at = 0.0
+        self._bucket_lock = threading.Lock()
+
+    def ensure_bucket(self) -> bool:
+        """Создание bucket если не существует"""
+        if self.minio_client is None:
+            return False
+        try:
+            if not self.minio_client.bucket_exists(self.bucket):
+                self.minio_client.make_bucket(self.bucket)
+                logger.info(f"Created '{self.bucket}' bucket")
+            self._storage_ready = True
+            self._retry_delay = self.retry_min_seconds
+        except Exception as e:
+            self._retry_at = time.monotonic() + self._retry_delay
+            logger.error(f"Street View storage unavailable, retrying in {self._retry_delay:.0f}s: {e}")
+            self._retry_delay = min(self._retry_delay * 2, self.retry_max_seconds)
+        return self._storage_ready
+
+    def _storage_available(self) -> bool:
+        """Готов ли MinIO; после неудачи bucket проверяется повторно не чаще паузы"""
+        if self._storage_ready:
+            return True
+        if self.minio_client is None or time.monotonic() < self._retry_at:
+            return False
+        # Проверку делает один поток, остальные пока работают без хранилища
+        if not self._bucket_lock.acquire(blocking=False):
+            return False
+        try:
+            return self._storage_ready or self.ensure_bucket()
+        finally:
+            self._bucket_lock.release()
+
+    def make_key(self, lat: float, lon: float, heading: int, size: str) -> str:
+        """Ключ кэша по округленным координатам"""
+        p = self.precision
+        return f"{round(lat, p):.{p}f}_{round(lon, p):.{p}f}_{int(heading) % 360}_{size}.jpg"
+
+    def is_stale(self, item: CachedImage) -> bool:
+        return time.time() - item.fetched_at > self.ttl_seconds
+
+    def get_or_fetch(self, lat: float, lon: float, heading: int, size: str,
+                     fetch: Callable[[], Tuple[bytes, Optional[str]]],
+                     current_pano_id: Callable[[], Optional[str]]) -> CachedImage:
+        """Получение изображения из кэша или от Google
+
+        fetch() возвращает (image_bytes, pano_id), current_pano_id() -
+        актуальный pano_id для ревалидации.
+        """
+        key = self.make_key(lat, lon, heading, size)
+
+        item = self.hot.get(key)
+        source = "memory"
+        if item is None:
+            item = self._load_from_storage(key)
+            source = "storage"
+
+        if item is not None and self.is_stale(item):
+            item = self._revalidate(item, current_pano_id)
+
+        if item is None:
+            data, pano_id = fetch()
+            item = self._store(key, data, pano_id)
+            source = "upstream"
+
+        self.stats[source] += 1
+        self.hot.put(item)
+        return replace(item, source=source)
+
+    def get_by_key(self, key: str) -> Optional[CachedImage]:
+        """Получение закэшированного изображения по ключу"""
+        item = self.hot.get(key)
+        if item is not None:
+            return replace(item, source="memory")
+        item = self._load_from_storage(key)
+        if item is not None:
+            self.hot.put(item)
+            return replace(item, source="storage")
+        return None
+
+    def _revalidate(self, item: CachedImage,
+                    current_pano_id: Callable[[], Optional[str]]) -> Optional[CachedImage]:
+        """Условная ревалидация устаревшей записи"""
+        try:
+            pano_id = current_pano_id()
+        except Exception as e:
+            # Google недоступен - отдаем устаревшую копию
+            logger.warning(f"Street View revalidation failed for {item.key}: {e}")
+            return item
+
+        if not item.pano_id or pano_id != item.pano_id:
+            logger.info(f"Street View panorama changed for {item.key}")
+            return None
+
+        item.fetched_at = time.time()
+        self._touch_storage(item)
+        self.stats["revalidated"] += 1
+        return item
+
+    def _object_metadata(self, item: CachedImage) -> Dict[str, str]:
+        metadata = {"fetched-at": str(item.fetched_at)}
+        if item.pano_id:
+            metadata["pano-id"] = item.pano_id
+        return metadata
+
+    def _store(self, key: str, data: bytes, pano_id: Optional[str]) -> CachedImage:
+        item = CachedImage(key=key, data=data, etag="", pano_id=pano_id, fetched_at=time.time())
+        if self._storage_available():
+            try:
+                result = self.minio_client.put_object(
+                    self.bucket,
+                    key,
+                    io.BytesIO(data),
+                    length=len(data),
+                    content_type="image/jpeg",
+                    metadata=self._object_metadata(item)
+                )
+                item.etag = result.etag
+            except Exception as e:
+                logger.error(f"Error saving Street View image {key}: {e}")
+        if not item.etag:
+            item.etag = hashlib.md5(data).hexdigest()
+        return item
+
+    def _touch_storage(self, item: CachedImage):
+        """Обновление времени ревалидации без перезаписи изображения"""
+        if not self._storage_available():
+            return
+        try:
+            self.minio_client.copy_object(
+                self.bucket,
+                item.key,
+                CopySource(self.bucket, item.key),
+                metadata=self._object_metadata(item),
+                metadata_directive=REPLACE
+            )
+        except Exception as e:
+            logger.warning(f"Error refreshing Street View metadata {item.key}: {e}")
+
+    def _load_from_storage(self, key: str) -> Optional[CachedImage]:
+        if not self._storage_available():
+            return None
+        response = None
+        try:
+            response = self.minio_client.get_object(self.bucket, key)
+            data = response.read()
+            headers = response.headers
+            return CachedImage(
+                key=key,
+                data=data,
+                etag=headers.get("ETag", "").strip('"'),
+                pano_id=headers.get("x-amz-meta-pano-id"),
+                fetched_at=float(headers.get("x-amz-meta-fetched-at", 0))
+            )
+        except S3Error as e:
+            if e.code != "NoSuchKey":
+                logger.error(f"Error reading Street View image {key}: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Street View storage error for {key}: {e}")
+            return None
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
@@ -0,0 +1,322 @@
+import os
+import json
+import math
+import time
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import redis
+import urllib3
+from celery import Celery
+from minio.error import MinioException, S3Error
+from minio.commonconfig import ENABLED, Filter
+from minio.lifecycleconfig import Expiration, LifecycleConfig, Rule
+
+from app.service import RECORD_FORMATS, RESULT_COLUMNS, catalog_keys, export_service, iter_items, object_fetcher
+from app.sources import iter_catalog_records
+
+logger = logging.getLogger(__name__)
+
+# Очередь заданий и их состояние - отдельная база Redis, не уведомлений
+REDIS_URL = os.getenv("EXPORT_REDIS_URL", "redis://redis:6379/1")
+EXPORTS_BUCKET = os.getenv("EXPORTS_BUCKET", "exports")
+# Сколько хранится состояние задания; повторный запрос того же экспорта
+# в этот срок получает готовый файл
+JOB_TTL = int(os.getenv("EXPORT_JOB_TTL", str(86400)))
+# Максимальная длительность экспорта: задание, не подтвержденное за это
+# время, Redis выдаст другому воркеру
+JOB_TIMEOUT = int(os.getenv("EXPORT_JOB_TIMEOUT", str(6 * 3600)))
+# Каталог пополняется, поэтому экспорт по фильтрам переиспользуется
+# только в пределах окна: позже тот же запрос выгрузит новые строки
+FILTER_DEDUP_WINDOW = int(os.getenv("EXPORT_FILTER_DEDUP_WINDOW", "300"))
+UPLOAD_PART_SIZE = 16 * 1024 * 1024
+# Записи из тела запроса хранятся в хэше задания в Redis целиком,
+# большие наборы выгружаются потоком (/export/records) или по filters
+JOB_MAX_RECORDS = int(os.getenv("EXPORT_JOB_MAX_RECORDS", "10000"))
+NOTIFICATION_SERVICE_URL = os.getenv("NOTIFICATION_SERVICE_URL", "http://notification-service:8000")
+
+FORMATS = {name: media_type for name, (media_type, _, _) in RECORD_FORMATS.items()}
+FORMATS["zip"] = "application/zip"
+FILTER_FIELDS = {"user_id", "date_from", "date_to", "min_lat", "min_lon", "max_lat", "max_lon"}
+# Ошибки, после которых задание повторяется
+RETRYABLE_ERRORS = (MinioException, urllib3.exceptions.HTTPError, httpx.TransportError)
+
+celery_app = Celery("export", broker=REDIS_URL)
+celery_app.conf.update(
+    task_default_queue="exports",
+    task_serializer="json",
+    accept_content=["json"],
+    task_ignore_result=True,
+    # Задание подтверждается после выполнения: при падении воркера
+    # оно вернется в очередь, а не потеряется
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    worker_prefetch_multiplier=1,
+    broker_transport_options={"visibility_timeout": JOB_TIMEOUT},
+)
+
+
+def job_spec(format: str, records: Optional[List[Dict]] = None, keys: Optional[List[str]] = None,
+             filters: Optional[Dict] = None, page_size: int = 1000, now: Optional[float] = None) -> Dict:
+    """Нормализованное описание экспорта; по нему же вычисляется id задания"""
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}, expected one of {sorted(FORMATS)}")
+    sources = [name for name, value in (("records", records), ("keys", keys), ("filters", filters))
+               if value is not None]
+    if len(sources) != 1:
+        raise ValueError("Exactly one of records, keys or filters is required")
+    source = sources[0]
+    if format != "zip" and source == "keys":
+        raise ValueError(f"{format.upper()} export takes records or filters")
+    if format == "zip" and source == "records":
+        raise ValueError("ZIP export takes object keys or filters")
+
+    spec = {"format": format, "source": source}
+    if source == "records":
+        if len(records) > JOB_MAX_RECORDS:
+            raise ValueError(f"At most {JOB_MAX_RECORDS} inline records per job, "
+                             "use POST /export/records or filters for larger exports")
+        spec["records"] = records
+    elif source == "keys":
+        if not all(isinstance(key, str) and key for key in keys):
+            raise ValueError("Object keys must be non-empty strings")
+        spec["keys"] = keys
+    else:
+        unknown = set(filters) - FILTER_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown filters: {sorted(unknown)}")
+        spec["filters"] = {name: value for name, value in filters.items() if value is not None}
+        spec["page_size"] = page_size
+        spec["window"] = int((time.time() if now is None else now) // FILTER_DEDUP_WINDOW)
+    return spec
+
+
+def job_id_for(spec: Dict) -> str:
+    """Одинаковые экспорты получают один id и выполняются один раз"""
+    canonical = json.dumps(spec, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def artifact_key(job_id: str, format: str) -> str:
+    return f"{job_id}.{format}"
+
+
+class JobStore:
+    """Состояние заданий в Redis: хэш export:job:{id} и множество подписчиков"""
+
+    def __init__(self, client: redis.Redis, ttl: int = JOB_TTL,
+                 artifact_exists: Optional[Callable[[str, str], bool]] = None):
+        self.redis = client
+        self.ttl = ttl
+        self.artifact_exists = artifact_exists
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"export:job:{job_id}"
+
+    def submit(self, spec: Dict, user_id: Optional[int] = None) -> Tuple[str, bool]:
+        """Регистрация задания; (id, True) если его нужно поставить в очередь
+
+        Задание с тем же описанием в очереди, в работе или готовое
+        переиспользуется; упавшее или готовое без файла запускается заново.
+        TTL задается только при создании: файл в MinIO удаляется через
+        фиксированный срок после загрузки, и продлевать состояние нельзя.
+        """
+        job_id = job_id_for(spec)
+        key = self._key(job_id)
+        created = bool(self.redis.hsetnx(key, "status", "queued"))
+        if not created:
+            status = self.redis.hget(key, "status")
+            created = status == "failed" or (
+                status == "done" and self.artifact_exists is not None
+                and not self.artifact_exists(job_id, spec["format"])
+            )
+        ttl = self.ttl if created else self.redis.ttl(key)
+        if ttl <= 0:
+            ttl = self.ttl
+        pipe = self.redis.pipeline()
+        if created:
+            pipe.delete(key)
+            pipe.hset(key, mapping={
+                "status": "queued",
+                "format": spec["format"],
+                "spec": json.dumps(spec, ensure_ascii=False),
+                "created_at": time.time(),
+            })
+            pipe.expire(key, ttl)
+        if user_id is not None:
+            pipe.sadd(f"{key}:subscribers", user_id)
+            pipe.expire(f"{key}:subscribers", ttl)
+        pipe.execute()
+        return job_id, created
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        job = self.redis.hgetall(self._key(job_id))
+        if not job:
+            return None
+        job["spec"] = json.loads(job["spec"]) if "spec" in job else None
+        for name in ("created_at", "started_at", "finished_at"):
+            if name in job:
+                job[name] = float(job[name])
+        for name in ("size", "attempts"):
+            if name in job:
+                job[name] = int(job[name])
+        return job
+
+    def update(self, job_id: str, **fields):
+        self.redis.hset(self._key(job_id), mapping={name: value for name, value in fields.items()
+                                                    if value is not None})
+
+    def subscribers(self, job_id: str) -> List[int]:
+        return [int(user_id) for user_id in self.redis.smembers(f"{self._key(job_id)}:subscribers")]
+
+
+def artifact_exists(job_id: str, format: str) -> bool:
+    """Есть ли файл задания в MinIO; если хранилище недоступно - считается, что есть"""
+    try:
+        object_fetcher.client.stat_object(EXPORTS_BUCKET, artifact_key(job_id, format))
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchBucket"):
+            return False
+        logger.warning(f"Error checking export {job_id} in storage: {e}")
+    except (MinioException, urllib3.exceptions.HTTPError) as e:
+        logger.warning(f"Error checking export {job_id} in storage: {e}")
+    return True
+
+
+job_store = JobStore(redis.from_url(REDIS_URL, decode_responses=True), artifact_exists=artifact_exists)
+
+
+def build_stream(spec: Dict) -> AsyncIterator[bytes]:
+    """Поток байтов файла экспорта по описанию задания"""
+    source = spec["source"]
+    if spec["format"] in RECORD_FORMATS:
+        if source == "records":
+            return export_service.export_records(iter_items(spec["records"]), spec["format"])
+        return export_service.export_records(iter_catalog_records(spec["filters"], spec["page_size"]),
+                                             spec["format"], RESULT_COLUMNS)
+    if source == "keys":
+        keys = iter_items(spec["keys"])
+    else:
+        keys = catalog_keys(spec["filters"], spec["page_size"])
+    return export_service.export_images_zip(export_service.object_entries(keys))
+
+
+class _StreamReader:
+    """Синхронный read() поверх асинхронного потока байтов
+
+    put_object с length=-1 читает поток частями по part_size и загружает
+    их multipart-загрузкой, поэтому файл не собирается ни в памяти, ни на диске.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, stream: AsyncIterator[bytes]):
+        self.loop = loop
+        self.stream = stream
+        self.buffer = bytearray()
+        self.size = 0
+        self.exhausted = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.exhausted and (size < 0 or len(self.buffer) < size):
+            try:
+                self.buffer += self.loop.run_until_complete(self.stream.__anext__())
+            except StopAsyncIteration:
+                self.exhausted = True
+        length = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        self.size += length
+        return data
+
+
+_bucket_ready = False
+
+
+def ensure_exports_bucket():
+    """Бакет для файлов экспорта; файлы живут на сутки дольше состояния задания"""
+    global _bucket_ready
+    if _bucket_ready:
+        return
+    client = object_fetcher.client
+    if not client.bucket_exists(EXPORTS_BUCKET):
+        client.make_bucket(EXPORTS_BUCKET)
+    days = math.ceil(JOB_TTL / 86400) + 1
+    client.set_bucket_lifecycle(EXPORTS_BUCKET, LifecycleConfig([
+        Rule(ENABLED, rule_filter=Filter(prefix=""), rule_id="expire-exports",
+             expiration=Expiration(days=days))
+    ]))
+    _bucket_ready = True
+
+
+def upload_artifact(job_id: str, spec: Dict) -> int:
+    """Генерация файла экспорта сразу в MinIO; возвращает размер в байтах"""
+    ensure_exports_bucket()
+    loop = asyncio.new_event_loop()
+    stream = build_stream(spec)
+    try:
+        reader = _StreamReader(loop, stream)
+        object_fetcher.client.put_object(
+            EXPORTS_BUCKET,
+            artifact_key(job_id, spec["format"]),
+            reader,
+            length=-1,
+            part_size=UPLOAD_PART_SIZE,
+            content_type=FORMATS[spec["format"]]
+        )
+        return reader.size
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def notify(job_id: str, job: Dict):
+    """Уведомление подписчиков задания через notification-service"""
+    done = job["status"] == "done"
+    for user_id in job_store.subscribers(job_id):
+        payload = {
+            "user_id": user_id,
+            "title": "Экспорт готов" if done else "Ошибка экспорта",
+            "message": (f"Файл доступен по адресу /api/export/jobs/{job_id}/download" if done
+                        else f"Экспорт {job_id} не выполнен: {job.get('error', '')}"),
+            "type": "success" if done else "error",
+        }
+        try:
+            httpx.post(f"{NOTIFICATION_SERVICE_URL}/send", json=payload, timeout=10.0).raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error(f"Error notifying user {user_id} about export {job_id}: {e}")
+
+
+@celery_app.task(name="export.run", bind=True, max_retries=3)
+def run_export(self, job_id: str):
+    """Выполнение задания экспорта воркером"""
+    job = job_store.get(job_id)
+    if job is None:
+        logger.warning(f"Export job {job_id} expired before it was started")
+        return
+    if job["status"] == "done":
+        return
+
+    job_store.update(job_id, status="running", started_at=time.time(), attempts=self.request.retries + 1)
+    started = time.perf_counter()
+    try:
+        size = upload_artifact(job_id, job["spec"])
+    except RETRYABLE_ERRORS as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"Export job {job_id} failed, retrying: {e}")
+            job_store.update(job_id, status="queued", error=str(e))
+            raise self.retry(exc=e, countdown=10 * 2 ** self.request.retries)
+        job_store.update(job_id, status="failed", error=str(e), finished_at=time.time())
+        logger.error(f"Export job {job_id} failed: {e}")
+    except Exception as e:
+        job_store.update(job_id, status="failed", error=str(e) or type(e).__name__, finished_at=time.time())
+        logger.error(f"Export job {job_id} failed: {e}")
+    else:
+        job_store.update(job_id, status="done", size=size, error="", finished_at=time.time())
+        logger.info(f"Export job {job_id} done: {size} bytes in {time.perf_counter() - started:.1f}s")
+    job = job_store.get(job_id)
+    if job is not None:
+        notify(job_id, job)
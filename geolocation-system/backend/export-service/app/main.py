@@ -1,12 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Query, Depends
 from fastapi.responses import StreamingResponse
-import pandas as pd
-import io
-from typing import List, Dict
-import zipfile
-from PIL import Image
-import base64
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from datetime import datetime
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 import logging
+import httpx
+import urllib3
+from minio.error import MinioException, S3Error
+
+from app.jobs import EXPORTS_BUCKET, FORMATS, artifact_key, job_spec, job_store, run_export
+from app.service import (
+    RECORD_FORMATS, RESULT_COLUMNS, catalog_keys, export_service, object_fetcher
+)
+from app.sources import iter_body_records, iter_catalog_records
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -14,76 +21,207 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Export Service")
 
-class ExportService:
-    def export_to_xlsx(self, data: List[Dict]) -> bytes:
-        """Экспорт данных в XLSX формат"""
-        try:
-            df = pd.DataFrame(data)
-            
-            # Создание Excel файла в памяти
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Coordinates', index=False)
-            
-            output.seek(0)
-            logger.info(f"Exported {len(data)} records to XLSX")
-            return output.getvalue()
-        except Exception as e:
-            logger.error(f"Error exporting to XLSX: {e}")
-            raise HTTPException(status_code=500, detail="Failed to export to XLSX")
-    
-    def export_images_zip(self, images_data: List[Dict]) -> bytes:
-        """Экспорт изображений в ZIP архив"""
-        try:
-            zip_buffer = io.BytesIO()
-            
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for i, image_data in enumerate(images_data):
-                    # Декодирование base64 изображения
-                    image_bytes = base64.b64decode(image_data['image'])
-                    
-                    # Добавление в ZIP
-                    filename = f"building_{i+1}_{image_data.get('coordinates', 'unknown')}.jpg"
-                    zip_file.writestr(filename, image_bytes)
-            
-            zip_buffer.seek(0)
-            logger.info(f"Exported {len(images_data)} images to ZIP")
-            return zip_buffer.getvalue()
-        except Exception as e:
-            logger.error(f"Error exporting images to ZIP: {e}")
-            raise HTTPException(status_code=500, detail="Failed to export images")
-
-export_service = ExportService()
+class ExportJobRequest(BaseModel):
+    format: str  # xlsx, csv, parquet, geojson, ndjson, zip
+    records: Optional[List[Dict]] = None  # не больше EXPORT_JOB_MAX_RECORDS
+    keys: Optional[List[str]] = None
+    filters: Optional[Dict] = None
+    page_size: int = Field(1000, ge=1, le=1000)
+    user_id: Optional[int] = None  # кому отправить уведомление о готовности
 
-@app.post("/export/xlsx")
-async def export_xlsx(data: List[Dict]):
-    """Экспорт данных в XLSX"""
+
+async def _prefetch(records: AsyncIterator) -> AsyncIterator:
+    """Чтение первой записи до начала ответа, чтобы ошибки вернулись с кодом ответа
+
+    После отправки заголовков ошибку можно сообщить только обрывом потока.
+    """
     try:
-        xlsx_data = export_service.export_to_xlsx(data)
-        
-        return StreamingResponse(
-            io.BytesIO(xlsx_data),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": "attachment; filename=coordinates.xlsx"}
-        )
-    except Exception as e:
-        logger.error(f"Error in XLSX export endpoint: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        first = await records.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid records: {e}")
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code < 500:
+            raise HTTPException(status_code=400, detail=e.response.json().get("detail", str(e)))
+        logger.error(f"Error querying results catalog: {e}")
+        raise HTTPException(status_code=502, detail="Results catalog unavailable")
+    except httpx.HTTPError as e:
+        logger.error(f"Error querying results catalog: {e}")
+        raise HTTPException(status_code=502, detail="Results catalog unavailable")
+    except (MinioException, urllib3.exceptions.HTTPError) as e:
+        logger.error(f"Error reading object storage: {e}")
+        raise HTTPException(status_code=502, detail="Object storage unavailable")
+
+    async def chained():
+        if first is None:
+            return
+        yield first
+        async for record in records:
+            yield record
+
+    return chained()
+
+def catalog_filters(user_id: Optional[int] = None,
+                    date_from: Optional[datetime] = None,
+                    date_to: Optional[datetime] = None,
+                    min_lat: Optional[float] = None, min_lon: Optional[float] = None,
+                    max_lat: Optional[float] = None, max_lon: Optional[float] = None) -> Dict:
+    """Фильтры каталога результатов (те же, что у GET /results coordinates-service)"""
+    return {
+        "user_id": user_id,
+        "date_from": date_from.isoformat() if date_from else None,
+        "date_to": date_to.isoformat() if date_to else None,
+        "min_lat": min_lat, "min_lon": min_lon, "max_lat": max_lat, "max_lon": max_lon,
+    }
+
+async def _body_keys(request: Request) -> AsyncIterator[str]:
+    async for key in iter_body_records(request, key="keys"):
+        if not isinstance(key, str) or not key:
+            raise ValueError(f"Object key must be a non-empty string, got {key!r}")
+        yield key
+
+def records_response(records: AsyncIterator[Dict], format: str, name: str,
+                     columns: Optional[List[str]] = None) -> StreamingResponse:
+    media_type, extension, _ = RECORD_FORMATS[format]
+    return StreamingResponse(
+        export_service.export_records(records, format, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={name}.{extension}"}
+    )
+
+def record_format(format: str = Query("xlsx", description="xlsx, csv, parquet, geojson или ndjson")) -> str:
+    if format not in RECORD_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format!r}, expected one of {sorted(RECORD_FORMATS)}")
+    return format
+
+def zip_response(entries: AsyncIterator[Tuple[str, bytes]], filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        export_service.export_images_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.post("/export/xlsx")
+async def export_xlsx(request: Request):
+    """Экспорт данных в XLSX (JSON массив или NDJSON поток записей)"""
+    records = await _prefetch(iter_body_records(request))
+    return records_response(records, "xlsx", "coordinates")
+
+@app.post("/export/records")
+async def export_records(request: Request, format: str = Depends(record_format)):
+    """Экспорт данных в выбранном формате (JSON массив или NDJSON поток записей)"""
+    records = await _prefetch(iter_body_records(request))
+    return records_response(records, format, "coordinates")
+
+@app.get("/export/xlsx/results")
+async def export_results_xlsx(filters: Dict = Depends(catalog_filters),
+                              page_size: int = Query(1000, ge=1, le=1000)):
+    """Экспорт результатов из каталога coordinates-service в XLSX"""
+    records = await _prefetch(iter_catalog_records(filters, page_size))
+    return records_response(records, "xlsx", "results", RESULT_COLUMNS)
+
+@app.get("/export/results")
+async def export_results(filters: Dict = Depends(catalog_filters),
+                         format: str = Depends(record_format),
+                         page_size: int = Query(1000, ge=1, le=1000)):
+    """Экспорт результатов из каталога coordinates-service в выбранном формате"""
+    records = await _prefetch(iter_catalog_records(filters, page_size))
+    return records_response(records, format, "results", RESULT_COLUMNS)
 
 @app.post("/export/images")
-async def export_images(images_data: List[Dict]):
-    """Экспорт изображений в ZIP"""
+async def export_images(request: Request):
+    """Экспорт изображений в ZIP (JSON массив или NDJSON поток)"""
+    entries = await _prefetch(export_service.image_entries(iter_body_records(request, key="images")))
+    return zip_response(entries, "buildings_images.zip")
+
+@app.post("/export/images/objects")
+async def export_image_objects(request: Request):
+    """Экспорт изображений в ZIP по ключам объектов MinIO ({"keys": [...]} или NDJSON)"""
+    entries = await _prefetch(export_service.object_entries(_body_keys(request)))
+    return zip_response(entries, "buildings_images.zip")
+
+@app.get("/export/images/results")
+async def export_result_images(filters: Dict = Depends(catalog_filters),
+                               page_size: int = Query(1000, ge=1, le=1000)):
+    """Экспорт изображений зданий из результатов каталога в ZIP"""
+    entries = await _prefetch(export_service.object_entries(catalog_keys(filters, page_size)))
+    return zip_response(entries, "results_images.zip")
+
+def job_view(job_id: str, job: Dict) -> Dict:
+    view = {
+        "job_id": job_id,
+        "status": job["status"],
+        "format": job.get("format"),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "size": job.get("size"),
+        "error": job.get("error") or None,
+    }
+    if job["status"] == "done":
+        view["download_url"] = f"/api/export/jobs/{job_id}/download"
+    return view
+
+@app.post("/export/jobs", status_code=202)
+def submit_export_job(request: ExportJobRequest):
+    """Постановка экспорта в очередь; одинаковые экспорты выполняются один раз"""
     try:
-        zip_data = export_service.export_images_zip(images_data)
-        
-        return StreamingResponse(
-            io.BytesIO(zip_data),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=buildings_images.zip"}
-        )
-    except Exception as e:
-        logger.error(f"Error in images export endpoint: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        spec = job_spec(request.format, request.records, request.keys, request.filters, request.page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    job_id, created = job_store.submit(spec, request.user_id)
+    if created:
+        run_export.delay(job_id)
+        logger.info(f"Export job {job_id} queued ({spec['format']} from {spec['source']})")
+    job = job_store.get(job_id)
+    return {**job_view(job_id, job), "deduplicated": not created}
+
+@app.get("/export/jobs/{job_id}")
+def get_export_job(job_id: str):
+    """Состояние задания экспорта"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job_view(job_id, job)
+
+@app.get("/export/jobs/{job_id}/download")
+def download_export_job(job_id: str):
+    """Готовый файл задания из MinIO, потоком"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export job is {job['status']}")
+    
+    try:
+        response = object_fetcher.client.get_object(EXPORTS_BUCKET, artifact_key(job_id, job["format"]))
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            logger.error(f"Error reading export {job_id}: {e}")
+            raise HTTPException(status_code=502, detail="Object storage unavailable")
+        # Файл удален по сроку хранения - повторный POST /export/jobs сформирует его заново
+        raise HTTPException(status_code=410, detail="Export file expired, submit the job again")
+    except (MinioException, urllib3.exceptions.HTTPError) as e:
+        logger.error(f"Error reading export {job_id}: {e}")
+        raise HTTPException(status_code=502, detail="Object storage unavailable")
+    
+    def release():
+        response.close()
+        response.release_conn()
+    
+    filename = f"export_{job_id}.{job['format']}"
+    return StreamingResponse(
+        response.stream(64 * 1024),
+        media_type=FORMATS[job["format"]],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+        background=BackgroundTask(release)
+    )
+
+@app.on_event("shutdown")
+async def shutdown():
+    object_fetcher.close()
 
 @app.get("/health")
 async def health_check():
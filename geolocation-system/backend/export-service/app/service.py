@@ -0,0 +1,138 @@
+import base64
+import logging
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from app.sources import iter_catalog_records
+from app.storage import ObjectFetcher
+from app.writers import (
+    image_extension, stream_csv, stream_geojson, stream_geojson_lines, stream_parquet, stream_xlsx, stream_zip
+)
+
+logger = logging.getLogger(__name__)
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+# Колонки выгрузки результатов из каталога
+RESULT_COLUMNS = [
+    "id", "user_id", "image_filename", "building_ref", "latitude", "longitude",
+    "confidence", "address", "source", "created_at", "bbox"
+]
+# Типы колонок каталога для Parquet (created_at - ISO строка, bbox - JSON)
+RESULT_TYPES = {
+    "id": "string", "user_id": "int64", "image_filename": "string", "building_ref": "string",
+    "latitude": "float64", "longitude": "float64", "confidence": "float64", "address": "string",
+    "source": "string", "created_at": "string", "bbox": "string",
+}
+
+
+def _xlsx(records, columns=None):
+    return stream_xlsx(records, sheet_name="Coordinates", columns=columns)
+
+
+def _parquet(records, columns=None):
+    # Схема выгрузки каталога задана заранее, для прочих записей - выводится
+    return stream_parquet(records, columns=columns, types=RESULT_TYPES if columns == RESULT_COLUMNS else None)
+
+
+# Форматы выгрузки записей: (media type, расширение файла, потоковый писатель)
+RECORD_FORMATS = {
+    "xlsx": (XLSX_MEDIA_TYPE, "xlsx", _xlsx),
+    "csv": ("text/csv; charset=utf-8", "csv", stream_csv),
+    "parquet": ("application/vnd.apache.parquet", "parquet", _parquet),
+    "geojson": ("application/geo+json", "geojson", stream_geojson),
+    "ndjson": ("application/x-ndjson", "ndjson", stream_geojson_lines),
+}
+
+object_fetcher = ObjectFetcher.from_env()
+
+
+class ExportService:
+    async def export_records(self, records: AsyncIterator[Dict], format: str = "xlsx",
+                             columns: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+        """Потоковый экспорт записей в один из RECORD_FORMATS: память не зависит от числа строк"""
+        writer = RECORD_FORMATS[format][2]
+        rows = 0
+
+        async def counted():
+            nonlocal rows
+            async for record in records:
+                rows += 1
+                yield record
+
+        try:
+            async for chunk in writer(counted(), columns=columns):
+                yield chunk
+        except Exception as e:
+            # Часть файла уже отдана - остается оборвать поток
+            logger.error(f"Error exporting to {format.upper()} after {rows} records: {e}")
+            raise
+        logger.info(f"Exported {rows} records to {format.upper()}")
+
+    def export_to_xlsx(self, records: AsyncIterator[Dict],
+                       columns: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+        """Потоковый экспорт записей в XLSX"""
+        return self.export_records(records, "xlsx", columns)
+
+    async def image_entries(self, images: AsyncIterator[Dict]) -> AsyncIterator[Tuple[str, bytes]]:
+        """Записи архива из изображений в base64; расширение - по сигнатуре файла"""
+        i = 0
+        async for image_data in images:
+            i += 1
+            if 'image' not in image_data:
+                raise ValueError(f"Image {i} has no 'image' field")
+            # Декодирование base64 изображения
+            image_bytes = base64.b64decode(image_data['image'], validate=True)
+            filename = f"building_{i}_{image_data.get('coordinates', 'unknown')}{image_extension(image_bytes)}"
+            yield filename, image_bytes
+
+    async def object_entries(self, keys: AsyncIterator[str]) -> AsyncIterator[Tuple[str, bytes]]:
+        """Записи архива из объектов MinIO под их ключами
+
+        Отсутствующие объекты не прерывают выгрузку: их ключи перечисляются
+        в missing.txt в конце архива.
+        """
+        missing = []
+        async for key, data in object_fetcher.fetch_many(keys):
+            if data is None:
+                missing.append(key)
+                continue
+            yield key, data
+        if missing:
+            logger.warning(f"{len(missing)} objects not found in storage")
+            yield "missing.txt", ("\n".join(missing) + "\n").encode("utf-8")
+
+    async def export_images_zip(self, entries: AsyncIterator[Tuple[str, bytes]]) -> AsyncIterator[bytes]:
+        """Потоковый экспорт изображений в ZIP: JPEG/PNG без повторного сжатия"""
+        count = 0
+
+        async def counted():
+            nonlocal count
+            async for entry in entries:
+                count += 1
+                yield entry
+
+        try:
+            async for chunk in stream_zip(counted()):
+                yield chunk
+        except Exception as e:
+            # Часть файла уже отдана - остается оборвать поток
+            logger.error(f"Error exporting images to ZIP after {count} entries: {e}")
+            raise
+        logger.info(f"Exported {count} images to ZIP")
+
+
+export_service = ExportService()
+
+
+async def iter_items(items: Iterable) -> AsyncIterator:
+    """Асинхронный итератор по готовому списку"""
+    for item in items:
+        yield item
+
+
+async def catalog_keys(filters: Dict, page_size: int) -> AsyncIterator[str]:
+    """Ключи вырезанных зданий (building_ref) результатов каталога"""
+    async for record in iter_catalog_records(filters, page_size):
+        if record.get("building_ref"):
+            yield record["building_ref"]
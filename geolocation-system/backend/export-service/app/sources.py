@@ -0,0 +1,68 @@
+import os
+import json
+import logging
+import tempfile
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+COORDINATES_SERVICE_URL = os.getenv("COORDINATES_SERVICE_URL", "http://coordinates-service:8000")
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "1000"))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+# Тело NDJSON крупнее этого размера сбрасывается из памяти во временный файл
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+async def iter_body_records(request: Request, key: str = "data") -> AsyncIterator[Dict]:
+    """Записи из тела запроса
+
+    NDJSON (по объекту в строке) сначала копируется во временный файл и
+    читается построчно: тело нельзя дочитывать во время потокового ответа,
+    Starlette в это время сам слушает receive() для отслеживания отключения
+    клиента. JSON массив (или объект со списком в поле key) - прежний
+    формат - разбирается целиком.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in NDJSON_TYPES:
+        records = json.loads(await request.body())
+        if isinstance(records, dict):
+            records = records.get(key)
+        if not isinstance(records, list):
+            raise ValueError("Expected a JSON array of records")
+        for record in records:
+            yield record
+        return
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        for line in spool:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def iter_catalog_records(filters: Dict, page_size: int = CATALOG_PAGE_SIZE,
+                               client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[Dict]:
+    """Результаты из каталога coordinates-service постранично по курсору"""
+    params = {key: value for key, value in filters.items() if value is not None}
+    params["limit"] = page_size
+    owns_client = client is None
+    client = client or httpx.AsyncClient(base_url=COORDINATES_SERVICE_URL, timeout=30.0)
+    try:
+        while True:
+            response = await client.get("/results", params=params)
+            response.raise_for_status()
+            page = response.json()
+            for item in page["items"]:
+                yield item
+            if not page.get("next_cursor"):
+                return
+            params["cursor"] = page["next_cursor"]
+    finally:
+        if owns_client:
+            await client.aclose()
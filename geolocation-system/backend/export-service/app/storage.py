@@ -0,0 +1,90 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional, Tuple
+
+import urllib3
+from minio import Minio
+from minio.error import S3Error
+
+logger = logging.getLogger(__name__)
+
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")
+MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
+MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
+IMAGES_BUCKET = os.getenv("IMAGES_BUCKET", "images")
+# Одновременных загрузок из MinIO на одну выгрузку и на сервис в целом
+STORAGE_CONCURRENCY = int(os.getenv("STORAGE_CONCURRENCY", "16"))
+
+
+class ObjectFetcher:
+    """Параллельная загрузка объектов MinIO с ограничением числа запросов
+
+    Один клиент с пулом соединений urllib3 на весь сервис: соединения
+    переиспользуются между выгрузками, размер пула равен числу потоков,
+    поэтому запросы не ждут свободного соединения и не открывают лишних.
+    """
+
+    def __init__(self, client: Minio, bucket: str = IMAGES_BUCKET, concurrency: int = STORAGE_CONCURRENCY):
+        self.client = client
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="minio-fetch")
+
+    @classmethod
+    def from_env(cls) -> "ObjectFetcher":
+        http_client = urllib3.PoolManager(
+            maxsize=STORAGE_CONCURRENCY,
+            block=True,
+            timeout=urllib3.Timeout(connect=5.0, read=60.0),
+            retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=(500, 502, 503, 504))
+        )
+        client = Minio(
+            MINIO_ENDPOINT,
+            access_key=MINIO_ACCESS_KEY,
+            secret_key=MINIO_SECRET_KEY,
+            secure=False,
+            http_client=http_client
+        )
+        return cls(client)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Содержимое объекта или None, если его нет"""
+        response = None
+        try:
+            response = self.client.get_object(self.bucket, key)
+            return response.read()
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    async def fetch_many(self, keys: AsyncIterator[str]) -> AsyncIterator[Tuple[str, Optional[bytes]]]:
+        """Объекты в порядке ключей; в работе одновременно не больше concurrency
+
+        Следующие ключи запрашиваются, пока потребитель пишет уже полученные,
+        поэтому в памяти не больше concurrency объектов.
+        """
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        try:
+            async for key in keys:
+                if len(pending) >= self.concurrency:
+                    done_key, future = pending.popleft()
+                    yield done_key, await future
+                pending.append((key, loop.run_in_executor(self._executor, self.get, key)))
+            while pending:
+                done_key, future = pending.popleft()
+                yield done_key, await future
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
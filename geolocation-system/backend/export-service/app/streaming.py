@@ -0,0 +1,84 @@
+import time
+import zipfile
+from typing import IO, Optional
+
+
+class _ChunkSink:
+    """Несмещаемый (unseekable) приемник для zipfile: байты копятся до drain()
+
+    Без tell/seek zipfile пишет записи с data descriptor, не возвращаясь
+    к заголовкам, поэтому архив можно отдавать клиенту по мере записи.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class CountingSink(_ChunkSink):
+    """Приемник с позицией записи: нужен писателям, которые вызывают tell() (Parquet)"""
+
+    def __init__(self):
+        super().__init__()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.position += len(data)
+        return super().write(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class ZipStream:
+    """Потоковая запись ZIP архива порциями байтов"""
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, "w", allowZip64=True)
+
+    def open(self, name: str, compress: bool = True, size: Optional[int] = None,
+             force_zip64: bool = False) -> IO[bytes]:
+        """Запись одной записи архива; compress=False - ZIP_STORED
+
+        size - ожидаемый размер, если известен: по нему zipfile сам решает,
+        нужны ли заголовки ZIP64. Записи неизвестного размера больше 2 ГБ
+        требуют force_zip64=True.
+        """
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        if size is not None:
+            info.file_size = size
+        return self._zip.open(info, "w", force_zip64=force_zip64)
+
+    def write(self, name: str, data: bytes, compress: bool = True):
+        with self.open(name, compress, size=len(data)) as entry:
+            entry.write(data)
+
+    def drain(self) -> bytes:
+        """Байты, записанные с прошлого вызова"""
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Центральный каталог и остаток архива"""
+        self._zip.close()
+        return self._sink.drain()
@@ -0,0 +1,418 @@
+import io
+import os
+import re
+import csv
+import json
+import math
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from xml.sax.saxutils import escape
+
+from app.streaming import CountingSink, ZipStream
+
+# Лимит строк листа Excel (включая заголовок); дальше - следующий лист
+XLSX_MAX_ROWS = 1048576
+# Строк между отдачами байтов клиенту
+ROWS_PER_CHUNK = 1000
+# Строк в группе строк Parquet (единица записи и чтения по колонкам)
+PARQUET_ROW_GROUP_SIZE = 50000
+# Поля координат для геометрии GeoJSON (после flatten_record)
+LATITUDE_FIELDS = ("latitude", "coordinates.latitude", "lat")
+LONGITUDE_FIELDS = ("longitude", "coordinates.longitude", "lon", "lng")
+# Уже сжатые форматы пишутся в ZIP без повторного сжатия (ZIP_STORED)
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip", ".gz"}
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF8", ".gif"),
+)
+
+_ILLEGAL_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def flatten_record(record: Dict, prefix: str = "") -> Dict:
+    """Вложенные объекты - в колонки через точку: coordinates.latitude"""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def image_extension(data: bytes, default: str = ".jpg") -> str:
+    """Расширение по сигнатуре файла"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return default
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _cell(reference: str, value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{reference}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)) and not (isinstance(value, float) and not math.isfinite(value)):
+        return f'<c r="{reference}"><v>{value!r}</v></c>'
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value, ensure_ascii=False)
+    text = escape(_ILLEGAL_XML.sub("", str(value)))
+    return f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(number: int, letters: List[str], values: List) -> str:
+    cells = "".join(_cell(f"{letter}{number}", value) for letter, value in zip(letters, values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+_SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_FOOTER = "</sheetData></worksheet>"
+
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _workbook_parts(sheet_names: List[str]) -> Dict[str, str]:
+    sheets = "".join(
+        f'<sheet name="{escape(name)}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(sheet_names, start=1)
+    )
+    sheet_rels = "".join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    styles_id = len(sheet_names) + 1
+    overrides = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    return {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{overrides}</Types>'
+        ),
+        "_rels/.rels": _ROOT_RELS,
+        "xl/workbook.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets>{sheets}</sheets></workbook>'
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{sheet_rels}'
+            f'<Relationship Id="rId{styles_id}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+            'Target="styles.xml"/></Relationships>'
+        ),
+        "xl/styles.xml": _STYLES,
+    }
+
+
+async def stream_xlsx(records: AsyncIterator[Dict], sheet_name: str = "Coordinates",
+                      columns: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    """XLSX архив порциями по мере поступления записей
+
+    Листы пишутся в режиме только записи (строки со встроенными строками,
+    без sharedStrings), записи архива сжимаются и отдаются каждые
+    ROWS_PER_CHUNK строк. Колонки берутся из columns или из первой записи.
+    При превышении лимита строк Excel данные продолжаются на новом листе;
+    workbook.xml пишется в конце, когда известно число листов.
+    """
+    archive = ZipStream()
+    sheet_names: List[str] = []
+    sheet = None
+    letters: List[str] = []
+    rows_in_sheet = 0
+    pending: List[str] = []
+
+    def open_sheet():
+        nonlocal sheet, rows_in_sheet
+        if sheet is not None:
+            sheet.write(("".join(pending) + _SHEET_FOOTER).encode("utf-8"))
+            pending.clear()
+            sheet.close()
+        sheet_names.append(sheet_name if not sheet_names else f"{sheet_name} {len(sheet_names) + 1}")
+        sheet = archive.open(f"xl/worksheets/sheet{len(sheet_names)}.xml")
+        sheet.write(_SHEET_HEADER.encode("utf-8"))
+        pending.append(_row(1, letters, columns))
+        rows_in_sheet = 1
+
+    async for record in records:
+        flat = flatten_record(record)
+        if sheet is None:
+            columns = columns or list(flat)
+            letters = [_column_letter(i) for i in range(len(columns))]
+            open_sheet()
+        elif rows_in_sheet >= XLSX_MAX_ROWS:
+            open_sheet()
+        rows_in_sheet += 1
+        pending.append(_row(rows_in_sheet, letters, [flat.get(column) for column in columns]))
+        if len(pending) >= ROWS_PER_CHUNK:
+            sheet.write("".join(pending).encode("utf-8"))
+            pending.clear()
+            chunk = archive.drain()
+            if chunk:
+                yield chunk
+
+    if sheet is None:
+        # Пустая выгрузка: лист только с заголовком (если колонки заданы)
+        columns = columns or []
+        letters = [_column_letter(i) for i in range(len(columns))]
+        open_sheet()
+    sheet.write(("".join(pending) + _SHEET_FOOTER).encode("utf-8"))
+    sheet.close()
+
+    for name, content in _workbook_parts(sheet_names).items():
+        archive.write(name, content.encode("utf-8"))
+    yield archive.close()
+
+
+async def stream_zip(entries: AsyncIterator[Tuple[str, Union[bytes, AsyncIterator[bytes]]]]) -> AsyncIterator[bytes]:
+    """ZIP архив порциями: байты уходят клиенту по мере записи каждой записи
+
+    Записи - пары (имя, данные), данные - bytes или асинхронный поток
+    порций. JPEG/PNG и другие сжатые форматы пишутся как ZIP_STORED,
+    остальное - ZIP_DEFLATED. Размеры и CRC пишутся в data descriptor
+    после данных, поэтому архив не требует перемотки и памяти под него.
+    """
+    archive = ZipStream()
+    async for name, data in entries:
+        compress = os.path.splitext(name)[1].lower() not in STORED_EXTENSIONS
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            with archive.open(name, compress, size=len(data)) as entry:
+                entry.write(data)
+        else:
+            # Размер неизвестен заранее: ZIP64 на случай записей больше 2 ГБ
+            with archive.open(name, compress, force_zip64=True) as entry:
+                async for chunk in data:
+                    entry.write(chunk)
+                    output = archive.drain()
+                    if output:
+                        yield output
+        output = archive.drain()
+        if output:
+            yield output
+    yield archive.close()
+
+
+def _scalar(value):
+    """Значение ячейки для плоских форматов: списки и объекты - JSON строкой"""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+async def stream_csv(records: AsyncIterator[Dict], columns: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    """CSV (UTF-8) порциями по ROWS_PER_CHUNK строк; колонки - из columns или первой записи"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rows = 0
+    async for record in records:
+        flat = flatten_record(record)
+        if columns is None:
+            columns = list(flat)
+        if rows == 0:
+            writer.writerow(columns)
+        writer.writerow([_scalar(flat.get(column)) for column in columns])
+        rows += 1
+        if rows % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if rows == 0 and columns:
+        writer.writerow(columns)
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _parquet_array(name: str, values: List, field=None):
+    """Колонка Parquet; field - тип колонки из уже записанных групп или заданный явно
+
+    Тип выводится pyarrow; значения разных типов (1 и "x") пишутся строками.
+    Приведение к типу field только без потерь (safe=True): целые - к
+    дробным или строкам, любые - к строке; 0.5 в целой колонке - ошибка,
+    а не молча записанный 0.
+    """
+    import pyarrow as pa
+
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = pa.array([None if value is None else str(value) for value in values], type=pa.string())
+    if field is None:
+        return array.cast(pa.string()) if pa.types.is_null(array.type) else array
+    if array.type == field.type:
+        return array
+    try:
+        return array.cast(field.type, safe=True)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"Column {name!r}: {array.type} values do not fit {field.type}: {e}") from e
+
+
+async def stream_parquet(records: AsyncIterator[Dict], columns: Optional[List[str]] = None,
+                         row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+                         types: Optional[Dict[str, str]] = None) -> AsyncIterator[bytes]:
+    """Parquet группами строк: каждая группа отдается клиенту сразу после записи
+
+    types - известные типы колонок (имя -> тип pyarrow: "int64", "string");
+    остальные выводятся по первой группе, колонки пустые во всей первой
+    группе становятся строковыми. Схема файла одна, поэтому следующие группы
+    приводятся к ней только без потерь (см. _parquet_array). Метаданные
+    (footer) пишутся в конце.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = CountingSink()
+    writer = None
+    schema = None
+    batch: List[List] = []
+
+    def write_batch():
+        nonlocal writer, schema
+        if schema is None:
+            known = {name: pa.field(name, pa.type_for_alias(types[name])) for name in columns if name in (types or {})}
+            arrays = [_parquet_array(name, values, known.get(name)) for name, values in zip(columns, batch)]
+            table = pa.Table.from_arrays(arrays, names=columns)
+            schema = table.schema
+            writer = pq.ParquetWriter(sink, schema, compression="snappy")
+        else:
+            table = pa.Table.from_arrays(
+                [_parquet_array(field.name, values, field) for values, field in zip(batch, schema)],
+                schema=schema
+            )
+        writer.write_table(table, row_group_size=row_group_size)
+        for values in batch:
+            values.clear()
+
+    rows = 0
+    async for record in records:
+        flat = flatten_record(record)
+        if columns is None:
+            columns = list(flat)
+        if not batch:
+            batch = [[] for _ in columns]
+        for values, column in zip(batch, columns):
+            values.append(_scalar(flat.get(column)))
+        rows += 1
+        if rows % row_group_size == 0:
+            write_batch()
+            yield sink.drain()
+
+    if rows % row_group_size or writer is None:
+        if columns is None:
+            columns = []
+        if not batch:
+            batch = [[] for _ in columns]
+        write_batch()
+    writer.close()
+    yield sink.drain()
+
+
+def _first_number(flat: Dict, fields: Tuple[str, ...]) -> Optional[float]:
+    for field in fields:
+        value = flat.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            return float(value)
+    return None
+
+
+def _json_value(value):
+    """NaN и бесконечности - null: в JSON их нет, а json.dumps пишет голый NaN"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _json_value(item) for key, item in value.items()}
+    return value
+
+
+def geojson_feature(record: Dict, columns: Optional[List[str]] = None) -> Dict:
+    """Feature с точкой по latitude/longitude записи; остальные поля - properties"""
+    flat = flatten_record(record)
+    latitude = _first_number(flat, LATITUDE_FIELDS)
+    longitude = _first_number(flat, LONGITUDE_FIELDS)
+    geometry = None
+    if latitude is not None and longitude is not None:
+        # Порядок координат GeoJSON: долгота, широта
+        geometry = {"type": "Point", "coordinates": [longitude, latitude]}
+    names = [name for name in (columns or flat) if name not in LATITUDE_FIELDS and name not in LONGITUDE_FIELDS]
+    return {
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": {name: _json_value(flat.get(name)) for name in names},
+    }
+
+
+async def stream_geojson(records: AsyncIterator[Dict], columns: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    """GeoJSON FeatureCollection, записываемый по мере поступления записей"""
+    parts = ['{"type":"FeatureCollection","features":[']
+    rows = 0
+    async for record in records:
+        if rows:
+            parts.append(",")
+        parts.append(json.dumps(geojson_feature(record, columns), ensure_ascii=False, allow_nan=False, default=str))
+        rows += 1
+        if rows % ROWS_PER_CHUNK == 0:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+    parts.append("]}")
+    yield "".join(parts).encode("utf-8")
+
+
+async def stream_geojson_lines(records: AsyncIterator[Dict],
+                               columns: Optional[List[str]] = None) -> AsyncIterator[bytes]:
+    """Построчный GeoJSON (NDJSON): по одному Feature в строке"""
+    lines = []
+    async for record in records:
+        lines.append(json.dumps(geojson_feature(record, columns), ensure_ascii=False, allow_nan=False, default=str))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
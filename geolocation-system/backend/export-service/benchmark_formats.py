@@ -0,0 +1,124 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List
+
+from app.service import RECORD_FORMATS, RESULT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+async def synthetic_results(rows: int, seed: int = 42) -> AsyncIterator[Dict]:
+    """Записи в формате каталога результатов (GET /results coordinates-service)"""
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(rows):
+        latitude = 55.5 + rng.random() * 0.5
+        longitude = 37.3 + rng.random() * 0.6
+        yield {
+            "id": f"{i:032x}",
+            "user_id": rng.randint(1, 500),
+            "image_filename": f"upload_{i // 4}.jpg",
+            "building_ref": f"building_{i % 4}_upload_{i // 4}.jpg",
+            "latitude": latitude,
+            "longitude": longitude,
+            "confidence": rng.random(),
+            "address": f"Москва, улица {rng.randint(1, 2000)}, дом {rng.randint(1, 200)}",
+            "source": "neural",
+            "created_at": (started + timedelta(seconds=i * 7)).isoformat(),
+            "bbox": [rng.randint(0, 500), rng.randint(0, 500), rng.randint(500, 1000), rng.randint(500, 1000)],
+        }
+
+
+async def _consume(stream: AsyncIterator[bytes]) -> int:
+    size = 0
+    async for chunk in stream:
+        size += len(chunk)
+    return size
+
+
+async def _as_bytes(records: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    async for _ in records:
+        yield b""
+
+
+def benchmark_format(format: str, rows: int, columns: List[str], measure_memory: bool = True) -> Dict:
+    """Скорость записи, размер файла и пик памяти одного формата
+
+    Память меряется отдельным проходом: tracemalloc заметно замедляет запись.
+    """
+    writer = RECORD_FORMATS[format][2]
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    size = asyncio.run(_consume(writer(synthetic_results(rows), columns=columns)))
+    seconds = time.perf_counter() - started
+    cpu_seconds = time.process_time() - cpu_started
+
+    peak_memory_mb = None
+    if measure_memory:
+        tracemalloc.start()
+        asyncio.run(_consume(writer(synthetic_results(rows), columns=columns)))
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+
+    return {
+        "format": format,
+        "rows": rows,
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+        "bytes": size,
+        "bytes_per_row": size / rows if rows else 0.0,
+        "peak_memory_mb": peak_memory_mb,
+    }
+
+
+def run_benchmark(rows: int, formats: List[str], output: str, measure_memory: bool = True) -> Dict:
+    # Генерация записей входит в каждый замер одинаково; оцениваем ее отдельно
+    started = time.perf_counter()
+    asyncio.run(_consume(_as_bytes(synthetic_results(rows))))
+    source_seconds = time.perf_counter() - started
+
+    results = []
+    for format in formats:
+        logger.info(f"Benchmarking {format} on {rows} rows")
+        results.append(benchmark_format(format, rows, RESULT_COLUMNS, measure_memory))
+
+    baseline = next((r for r in results if r["format"] == "xlsx"), None)
+    for result in results:
+        if baseline:
+            result["speedup_vs_xlsx"] = baseline["seconds"] / result["seconds"]
+            result["size_vs_xlsx"] = result["bytes"] / baseline["bytes"]
+
+    report = {"rows": rows, "source_seconds": source_seconds, "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Format report saved to {output}")
+
+    for result in sorted(results, key=lambda r: r["seconds"]):
+        logger.info(
+            f"{result['format']:>8}: {result['rows_per_second']:9.0f} rows/s, "
+            f"{result['bytes'] / 1024 / 1024:7.1f} MB ({result['bytes_per_row']:5.1f} B/row)"
+            + (f", peak {result['peak_memory_mb']:5.1f} MB" if result["peak_memory_mb"] is not None else "")
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare export formats by write throughput and output size")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--formats", nargs="+", default=list(RECORD_FORMATS), choices=list(RECORD_FORMATS))
+    parser.add_argument("--output", default="format_report.json")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.formats, args.output, measure_memory=not args.no_memory)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,188 @@
+import io
+import logging
+import math
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Теги EXIF
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATETIME_ORIGINAL = 0x9003
+
+GPS_LATITUDE_REF = 0x01
+GPS_LATITUDE = 0x02
+GPS_LONGITUDE_REF = 0x03
+GPS_LONGITUDE = 0x04
+GPS_ALTITUDE = 0x06
+GPS_TIMESTAMP = 0x07
+GPS_STATUS = 0x09
+GPS_DOP = 0x0B
+GPS_IMG_DIRECTION_REF = 0x10
+GPS_IMG_DIRECTION = 0x11
+GPS_DATESTAMP = 0x1D
+GPS_H_POSITIONING_ERROR = 0x1F
+
+# EXIF в JPEG находится в APP1 и не превышает 64 КБ
+EXIF_HEADER_BYTES = 128 * 1024
+
+
+@dataclass
+class ExifGPS:
+    """GPS-данные из EXIF"""
+    latitude: float
+    longitude: float
+    altitude: Optional[float] = None
+    heading: Optional[float] = None
+    heading_ref: Optional[str] = None
+    timestamp: Optional[str] = None
+    accuracy_m: Optional[float] = None
+    dop: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def _jpeg_exif_segment(data: bytes) -> Optional[bytes]:
+    """Поиск APP1 Exif сегмента по маркерам JPEG без декодирования пикселей"""
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Заполняющие байты
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            # Конец изображения или начало данных скана - дальше EXIF нет
+            return None
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment = data[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            return segment if len(segment) == length - 2 else None
+        pos += 2 + length
+    return None
+
+
+def read_exif(header: bytes) -> Optional[Image.Exif]:
+    """Чтение EXIF из начальных байтов файла"""
+    segment = _jpeg_exif_segment(header)
+    exif = Image.Exif()
+    if segment is not None:
+        exif.load(segment)
+        return exif
+    if header.startswith(b"\xff\xd8"):
+        return None
+    try:
+        # Прочие форматы (TIFF, WebP, PNG): Image.open читает только заголовок
+        with Image.open(io.BytesIO(header)) as image:
+            return image.getexif()
+    except Exception:
+        return None
+
+
+def _rational(value) -> Optional[float]:
+    try:
+        result = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return result if math.isfinite(result) else None
+
+
+def _dms_to_degrees(dms, ref) -> Optional[float]:
+    try:
+        degrees, minutes, seconds = (_rational(part) for part in dms)
+    except (TypeError, ValueError):
+        return None
+    if degrees is None or minutes is None or seconds is None:
+        return None
+    value = degrees + minutes / 60.0 + seconds / 3600.0
+    if isinstance(ref, bytes):
+        ref = ref.decode(errors="ignore")
+    if str(ref).strip().upper() in ("S", "W"):
+        value = -value
+    return value
+
+
+def _gps_timestamp(gps: Dict, exif: Image.Exif) -> Optional[str]:
+    date = gps.get(GPS_DATESTAMP)
+    time_parts = gps.get(GPS_TIMESTAMP)
+    if date and time_parts:
+        try:
+            hours, minutes, seconds = (_rational(part) for part in time_parts)
+            day = datetime.strptime(str(date).strip("\x00 "), "%Y:%m:%d")
+            stamp = day.replace(
+                hour=int(hours), minute=int(minutes), second=int(seconds), tzinfo=timezone.utc
+            )
+            return stamp.isoformat()
+        except (TypeError, ValueError):
+            pass
+
+    # Время съемки без часового пояса
+    original = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL)
+    if original:
+        try:
+            return datetime.strptime(str(original).strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+        except ValueError:
+            pass
+    return None
+
+
+def extract_gps(header: bytes, max_position_error_m: float = 50.0,
+                max_dop: float = 10.0) -> Tuple[Optional[ExifGPS], str]:
+    """Извлечение и проверка GPS из EXIF
+
+    Возвращает (данные или None, причина), причина "ok" означает,
+    что координатам можно доверять.
+    """
+    try:
+        exif = read_exif(header)
+    except Exception as e:
+        logger.warning(f"Failed to parse EXIF: {e}")
+        return None, "invalid_exif"
+    if exif is None:
+        return None, "no_exif"
+
+    gps = exif.get_ifd(GPS_IFD)
+    if not gps:
+        return None, "no_gps"
+
+    status = gps.get(GPS_STATUS)
+    if status is not None and str(status).strip("\x00 ").upper() == "V":
+        return None, "gps_void"
+
+    if GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+        return None, "no_gps"
+    lat = _dms_to_degrees(gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF, "N"))
+    lon = _dms_to_degrees(gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF, "E"))
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None, "invalid_coordinates"
+    if lat == 0.0 and lon == 0.0:
+        return None, "null_island"
+
+    accuracy = _rational(gps.get(GPS_H_POSITIONING_ERROR))
+    if accuracy is not None and accuracy > max_position_error_m:
+        return None, "low_accuracy"
+    dop = _rational(gps.get(GPS_DOP))
+    if dop is not None and dop > max_dop:
+        return None, "low_accuracy"
+
+    heading_ref = gps.get(GPS_IMG_DIRECTION_REF)
+    result = ExifGPS(
+        latitude=lat,
+        longitude=lon,
+        altitude=_rational(gps.get(GPS_ALTITUDE)),
+        heading=_rational(gps.get(GPS_IMG_DIRECTION)),
+        heading_ref=str(heading_ref).strip("\x00 ") if heading_ref else None,
+        timestamp=_gps_timestamp(gps, exif),
+        accuracy_m=accuracy,
+        dop=dop
+    )
+    return result, "ok"
@@ -1,14 +1,21 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi.responses import Response
 import cv2
 import numpy as np
 from PIL import Image
 import io
 import base64
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import logging
 import os
+import time
+import json
+import hashlib
 from minio import Minio
 from minio.error import S3Error
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from app.exif_gps import extract_gps, EXIF_HEADER_BYTES
+from app.phash_index import NearDuplicateIndex, image_size, perceptual_hash, rescale_result
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +28,32 @@ MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "minio:9000")
 MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minioadmin")
 MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 
+# Пороги доверия к GPS из EXIF
+EXIF_MAX_POSITION_ERROR_M = float(os.getenv("EXIF_MAX_POSITION_ERROR_M", "50"))
+EXIF_MAX_DOP = float(os.getenv("EXIF_MAX_DOP", "10"))
+
+# Поиск почти-дубликатов по перцептивному хэшу
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH", "/app/data/phash-index.jsonl")
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+
+# Метрики
+PIPELINE_RUNS = Counter("image_pipeline_runs_total", "Full detection pipeline runs")
+PIPELINE_SECONDS = Histogram("image_pipeline_seconds", "Full detection pipeline duration")
+EXIF_FAST_PATH = Counter("image_exif_fast_path_total", "Uploads answered from EXIF GPS")
+EXIF_REJECTED = Counter("image_exif_rejected_total", "Uploads without trustworthy EXIF GPS", ["reason"])
+PIPELINE_SECONDS_AVOIDED = Counter(
+    "image_pipeline_seconds_avoided_total",
+    "Estimated pipeline seconds skipped by the EXIF fast path"
+)
+NEAR_DUPLICATE_HITS = Counter(
+    "image_near_duplicate_hits_total",
+    "Uploads answered with results of an earlier near-duplicate"
+)
+BYTES_NOT_DECODED = Counter(
+    "image_bytes_not_decoded_total",
+    "Upload bytes never decoded thanks to the EXIF fast path"
+)
+
 # Инициализация MinIO клиента
 minio_client = Minio(
     MINIO_ENDPOINT,
@@ -84,6 +117,19 @@ class BuildingDetector:
         return image[y1:y2, x1:x2]
 
 detector = BuildingDetector()
+near_duplicates = NearDuplicateIndex(PHASH_INDEX_PATH)
+
+@app.on_event("startup")
+async def load_near_duplicate_index():
+    """Загрузка индекса перцептивных хэшей"""
+    try:
+        near_duplicates.load()
+    except Exception as e:
+        logger.error(f"Failed to load near-duplicate index: {e}")
+
+@app.on_event("shutdown")
+async def close_near_duplicate_index():
+    near_duplicates.close()
 
 async def save_image_to_storage(image_bytes: bytes, filename: str) -> str:
     """Сохранение изображения в MinIO"""
@@ -101,14 +147,98 @@ async def save_image_to_storage(image_bytes: bytes, filename: str) -> str:
         logger.error(f"Error saving image: {e}")
         raise HTTPException(status_code=500, detail="Failed to save image")
 
+# Суммарная статистика пайплайна для оценки сэкономленного времени
+pipeline_stats = {"runs": 0, "seconds": 0.0}
+
+def average_pipeline_seconds() -> float:
+    """Средняя длительность полного пайплайна"""
+    if not pipeline_stats["runs"]:
+        return 0.0
+    return pipeline_stats["seconds"] / pipeline_stats["runs"]
+
+def save_result(key: str, result: Dict):
+    """Сохранение результата обработки для повторного использования"""
+    data = json.dumps(result).encode("utf-8")
+    minio_client.put_object(
+        "images",
+        f"results/{key}.json",
+        io.BytesIO(data),
+        length=len(data),
+        content_type="application/json"
+    )
+
+def load_result(key: str) -> Optional[Dict]:
+    """Загрузка ранее сохраненного результата"""
+    response = None
+    try:
+        response = minio_client.get_object("images", f"results/{key}.json")
+        return json.loads(response.read())
+    except S3Error as e:
+        if e.code != "NoSuchKey":
+            logger.error(f"Error loading result {key}: {e}")
+        return None
+    finally:
+        if response is not None:
+            response.close()
+            response.release_conn()
+
+def find_near_duplicate_result(phash: int, max_distance: int, size: Tuple[int, int]) -> Optional[Dict]:
+    """Результат обработки ранее загруженной почти-копии, bbox - в пикселях size"""
+    for match in near_duplicates.find(phash, max_distance):
+        result = load_result(match["key"])
+        if result is not None:
+            result = rescale_result(result, size)
+        if result is not None:
+            result["provenance"] = "near_duplicate"
+            result["duplicate_of"] = match
+            return result
+    return None
+
 @app.post("/detect-buildings")
-async def detect_buildings(file: UploadFile = File(...)):
+async def detect_buildings(file: UploadFile = File(...), use_exif: bool = True,
+                           reuse_results: bool = True,
+                           max_distance: Optional[int] = Query(None, ge=0, le=32)):
     """Детекция зданий на изображении"""
     try:
         logger.info(f"Processing image: {file.filename}")
         
+        # Быстрый путь: GPS из EXIF, читаем только заголовок файла
+        header = await file.read(EXIF_HEADER_BYTES)
+        if use_exif:
+            gps, reason = extract_gps(
+                header,
+                max_position_error_m=EXIF_MAX_POSITION_ERROR_M,
+                max_dop=EXIF_MAX_DOP
+            )
+            if gps is not None:
+                EXIF_FAST_PATH.inc()
+                PIPELINE_SECONDS_AVOIDED.inc(average_pipeline_seconds())
+                BYTES_NOT_DECODED.inc(file.size or len(header))
+                logger.info(f"EXIF GPS found for {file.filename}: {gps.latitude}, {gps.longitude}")
+                return {
+                    "buildings": [],
+                    "total_detected": 0,
+                    "coordinates": gps.to_dict(),
+                    "provenance": "exif_gps"
+                }
+            EXIF_REJECTED.labels(reason=reason).inc()
+        
         # Чтение изображения
-        image_bytes = await file.read()
+        image_bytes = header + await file.read()
+        
+        # Поиск почти-дубликата среди прежних загрузок
+        upload_key = hashlib.sha1(image_bytes).hexdigest()
+        phash = perceptual_hash(image_bytes)
+        if reuse_results:
+            distance = PHASH_MAX_DISTANCE if max_distance is None else max_distance
+            result = find_near_duplicate_result(phash, distance, image_size(image_bytes))
+            if result is not None:
+                NEAR_DUPLICATE_HITS.inc()
+                PIPELINE_SECONDS_AVOIDED.inc(average_pipeline_seconds())
+                logger.info(f"Near-duplicate of {result['duplicate_of']['key']} for {file.filename}")
+                return result
+        
+        start_time = time.perf_counter()
         image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
         
         # Детекция зданий
@@ -135,11 +265,29 @@ async def detect_buildings(file: UploadFile = File(...)):
                 "filename": filename
             })
         
+        elapsed = time.perf_counter() - start_time
+        pipeline_stats["runs"] += 1
+        pipeline_stats["seconds"] += elapsed
+        PIPELINE_RUNS.inc()
+        PIPELINE_SECONDS.observe(elapsed)
         logger.info(f"Detected {len(buildings)} buildings")
-        return {
+        result = {
             "buildings": cropped_buildings,
-            "total_detected": len(buildings)
+            "total_detected": len(buildings),
+            "provenance": "pipeline",
+            "upload_key": upload_key,
+            # Размер, к которому относятся bbox: нужен для переноса на почти-копии
+            "image_size": [image.shape[1], image.shape[0]]
         }
+        
+        # Запоминание результата для будущих почти-дубликатов
+        try:
+            save_result(upload_key, result)
+            near_duplicates.add(phash, upload_key)
+        except Exception as e:
+            logger.error(f"Error saving result for reuse: {e}")
+        
+        return result
     
     except Exception as e:
         logger.error(f"Error processing image: {e}")
@@ -173,6 +321,11 @@ async def preprocess_image(file: UploadFile = File(...)):
         logger.error(f"Error preprocessing image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/health")
 async def health_check():
     """Проверка состояния сервиса"""
@@ -182,7 +335,8 @@ async def health_check():
         return {
             "status": "healthy",
             "service": "image-service",
-            "storage": "connected"
+            "storage": "connected",
+            "near_duplicate_index": len(near_duplicates)
         }
     except Exception as e:
         return {
@@ -0,0 +1,185 @@
+import io
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+EXIF_ORIENTATION = 0x0112
+# Допустимое расхождение пропорций копии и исходника при переносе bbox
+ASPECT_TOLERANCE = 0.01
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Матрица DCT-II размера n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0, :] = np.sqrt(1.0 / n)
+    return matrix
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def perceptual_hash(image_bytes: bytes) -> int:
+    """64-битный pHash (низкие частоты DCT относительно медианы)"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # Для JPEG декодирование сразу в уменьшенном масштабе
+        image.draft("L", (DCT_SIZE * 2, DCT_SIZE * 2))
+        pixels = np.asarray(
+            image.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS),
+            dtype=np.float64
+        )
+    coefficients = _DCT @ pixels @ _DCT.T
+    low = coefficients[:HASH_SIZE, :HASH_SIZE].flatten()
+    median = np.median(low[1:])
+    bits = low > median
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def image_size(image_bytes: bytes) -> Tuple[int, int]:
+    """(ширина, высота) по заголовку с учетом EXIF-ориентации, как после cv2.imdecode"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        width, height = image.size
+        # Ориентации 5-8 - поворот на 90 градусов
+        if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def rescale_result(result: Dict, size: Tuple[int, int], tolerance: float = ASPECT_TOLERANCE) -> Optional[Dict]:
+    """Результат почти-копии в пикселях нового изображения
+
+    pHash совпадает и у уменьшенных копий, поэтому bbox масштабируются
+    к размеру size. Если пропорции отличаются (копия обрезана) или размер
+    исходника неизвестен, bbox не переносятся - возвращается None.
+    """
+    source = result.get("image_size")
+    if not source:
+        return None
+    width, height = size
+    scale_x, scale_y = width / source[0], height / source[1]
+    if abs(scale_x / scale_y - 1.0) > tolerance:
+        return None
+    result = dict(result, image_size=[width, height])
+    if (width, height) != tuple(source):
+        result["buildings"] = [
+            dict(building, bbox=[
+                round(value * (scale_x if i % 2 == 0 else scale_y)) for i, value in enumerate(building["bbox"])
+            ])
+            for building in result.get("buildings", [])
+        ]
+    return result
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """BK-дерево по расстоянию Хэмминга"""
+
+    def __init__(self):
+        # Узел: [hash, список ключей, {расстояние: дочерний узел}]
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, key: str) -> bool:
+        """Добавление ключа, False если он уже есть для этого хэша"""
+        if self.root is None:
+            self.root = [value, [key], {}]
+            self.size += 1
+            return True
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if key in node[1]:
+                    return False
+                node[1].append(key)
+                self.size += 1
+                return True
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [key], {}]
+                self.size += 1
+                return True
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int, List[str]]]:
+        """Все хэши на расстоянии не больше max_distance: (расстояние, hash, ключи)"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.append((distance, node[0], node[1]))
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in node[2].items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class NearDuplicateIndex:
+    """Индекс перцептивных хэшей загрузок с журналом на диске"""
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.log_path = log_path
+        self.tree = BKTree()
+        self._lock = threading.Lock()
+        self._log = None
+
+    def __len__(self):
+        return self.tree.size
+
+    def load(self):
+        """Восстановление индекса из журнала"""
+        if not self.log_path:
+            return
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with self._lock:
+            if os.path.exists(self.log_path):
+                with open(self.log_path, "r") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            logger.warning("Skipping truncated near-duplicate index entry")
+                            continue
+                        self.tree.add(int(entry["hash"], 16), entry["key"])
+            self._log = open(self.log_path, "a")
+        logger.info(f"Near-duplicate index loaded: {len(self)} hashes")
+
+    def add(self, value: int, key: str):
+        with self._lock:
+            if self.tree.add(value, key) and self._log is not None:
+                self._log.write(json.dumps({"hash": f"{value:016x}", "key": key}) + "\n")
+                self._log.flush()
+
+    def find(self, value: int, max_distance: int) -> List[Dict]:
+        """Ранее загруженные копии, от ближайших к дальним (новые первыми)"""
+        with self._lock:
+            matches = self.tree.search(value, max_distance)
+            return [
+                {"key": key, "distance": distance}
+                for distance, _, keys in matches
+                for key in reversed(keys)
+            ]
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
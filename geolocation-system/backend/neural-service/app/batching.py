@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = Histogram(
+    "neural_batch_size",
+    "Number of images per forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+QUEUE_SECONDS = Histogram(
+    "neural_queue_seconds",
+    "Time a request waits in the queue before its batch starts",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+INFERENCE_SECONDS = Histogram(
+    "neural_inference_seconds",
+    "Duration of one batched forward pass",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+QUEUE_DEPTH = Gauge("neural_queue_depth", "Requests waiting for a batch")
+REJECTED = Counter("neural_requests_rejected_total", "Requests rejected because the queue is full")
+
+
+class QueueFullError(Exception):
+    """Очередь предсказаний переполнена"""
+
+
+class _Pending:
+    __slots__ = ("item", "future", "enqueued_at")
+
+    def __init__(self, item: np.ndarray, future: asyncio.Future):
+        self.item = item
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Динамическое формирование батчей из одиночных запросов
+
+    Запросы копятся в очереди; батч отправляется в модель, когда набрано
+    max_batch_size элементов или с момента прихода первого прошло
+    max_wait_ms. Прямой проход выполняется в отдельном потоке, чтобы не
+    блокировать event loop, результаты раздаются ожидающим запросам.
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 1024):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self.stats = {"batches": 0, "items": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Один поток: TensorFlow сам распараллеливает операции внутри батча
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+            logger.info(
+                f"Micro-batcher started: max_batch_size={self.max_batch_size}, "
+                f"max_wait={self.max_wait * 1000:.1f}ms"
+            )
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                pending = self._queue.get_nowait()
+                if not pending.future.done():
+                    pending.future.set_exception(RuntimeError("Service is shutting down"))
+        self._executor.shutdown(wait=False)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item: np.ndarray) -> np.ndarray:
+        """Постановка одного элемента в очередь и ожидание результата"""
+        if self._queue is None:
+            raise RuntimeError("Batcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(_Pending(item, future))
+        except asyncio.QueueFull:
+            REJECTED.inc()
+            raise QueueFullError("Prediction queue is full")
+        QUEUE_DEPTH.set(self._queue.qsize())
+        return await future
+
+    async def _collect(self) -> List[_Pending]:
+        """Сбор батча: до max_batch_size элементов или до истечения max_wait"""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Сначала забираем все, что уже лежит в очереди
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            QUEUE_DEPTH.set(self._queue.qsize())
+
+            # Отмененные клиентом запросы не занимают место в батче
+            batch = [pending for pending in batch if not pending.future.done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for pending in batch:
+                QUEUE_SECONDS.observe(started - pending.enqueued_at)
+            BATCH_SIZE.observe(len(batch))
+
+            try:
+                inputs = np.stack([pending.item for pending in batch])
+                outputs = await loop.run_in_executor(self._executor, self.predict_fn, inputs)
+                # Иначе лишние запросы не получили бы ответа до таймаута клиента
+                if len(outputs) != len(batch):
+                    raise ValueError(f"predict_fn returned {len(outputs)} outputs for {len(batch)} inputs")
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(batch)} items: {e}")
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+                continue
+
+            INFERENCE_SECONDS.observe(time.perf_counter() - started)
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            for pending, output in zip(batch, outputs):
+                if not pending.future.done():
+                    pending.future.set_result(output)
@@ -0,0 +1,184 @@
+from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+from typing import List
+import asyncio
+import logging
+import os
+import sys
+import time
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from app.batching import MicroBatcher, QueueFullError
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Neural Network Service")
+
+# Код и веса CVM-Net (ml-models/cvm-net монтируется в контейнер)
+MODEL_PATH = os.getenv("MODEL_PATH", "/app/models/cvm-net")
+MODEL_WEIGHTS = os.getenv("MODEL_WEIGHTS", os.path.join(MODEL_PATH, "weights", "best_model.h5"))
+# Готовая SavedModel (export_model.py --saved-model-only): старт без сети и сборки Keras графа
+SAVED_MODEL_DIR = os.getenv("SAVED_MODEL_DIR", os.path.join(MODEL_PATH, "export", "saved_model"))
+# Квантизованная модель (export_model.py); если задана, используется вместо Keras
+TFLITE_MODEL = os.getenv("TFLITE_MODEL", "")
+# Backbone, с которым обучены веса MODEL_WEIGHTS (SavedModel и TFLite его содержат)
+MODEL_BACKBONE = os.getenv("MODEL_BACKBONE", "")
+TFLITE_THREADS = int(os.getenv("TFLITE_THREADS", "0")) or None
+
+# Динамическое формирование батчей
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT_MS = float(os.getenv("MAX_BATCH_WAIT_MS", "5"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "1024"))
+MAX_FILES_PER_REQUEST = int(os.getenv("MAX_FILES_PER_REQUEST", "64"))
+
+sys.path.insert(0, MODEL_PATH)
+# Без TensorFlow: он загружается вместе с моделью в фоне
+from preprocessing import ImagePreprocessor
+from serving import load_predictor, warmup
+
+preprocessor = ImagePreprocessor()
+model = None
+model_format = None
+batcher = None
+loader_task = None
+load_error = None
+startup_seconds = {}
+
+def load_and_warm_model():
+    """Загрузка модели и прогрев на размерах батча 1 и MAX_BATCH_SIZE"""
+    global model, model_format
+    started = time.perf_counter()
+    predictor, predictor_format = load_predictor(
+        saved_model_dir=SAVED_MODEL_DIR,
+        tflite_path=TFLITE_MODEL or None,
+        weights_path=MODEL_WEIGHTS,
+        num_threads=TFLITE_THREADS,
+        backbone=MODEL_BACKBONE or None
+    )
+    loaded = time.perf_counter()
+    model, model_format = predictor, predictor_format
+    warmup(predictor, sorted({1, MAX_BATCH_SIZE}))
+    startup_seconds.update({"load": loaded - started, "warmup": time.perf_counter() - loaded})
+
+async def load_model():
+    """Фоновая загрузка модели; до ее окончания /ready отвечает 503"""
+    global batcher, load_error
+    try:
+        await run_in_threadpool(load_and_warm_model)
+    except Exception as e:
+        load_error = str(e)
+        logger.error(f"Failed to load model: {e}")
+        return
+
+    batcher = MicroBatcher(
+        model.predict_batch,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_wait_ms=MAX_BATCH_WAIT_MS,
+        max_queue_size=MAX_QUEUE_SIZE
+    )
+    batcher.start()
+    logger.info(
+        f"CVM-Net model ready ({model_format}): load {startup_seconds['load']:.2f}s, "
+        f"warmup {startup_seconds['warmup']:.2f}s"
+    )
+
+@app.on_event("startup")
+async def start_model_loading():
+    """Сервис принимает соединения сразу, модель загружается в фоне"""
+    global loader_task
+    loader_task = asyncio.create_task(load_model())
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    if loader_task is not None and not loader_task.done():
+        loader_task.cancel()
+    if batcher is not None:
+        await batcher.stop()
+
+async def predict_image(image_bytes: bytes) -> dict:
+    """Предсказание координат одного изображения через общую очередь"""
+    try:
+        image = await run_in_threadpool(preprocessor.preprocess_from_bytes, image_bytes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        norm_lat, norm_lon = await batcher.submit(image)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    latitude, longitude = preprocessor.denormalize_coordinates(float(norm_lat), float(norm_lon))
+    return {"latitude": latitude, "longitude": longitude}
+
+@app.post("/predict")
+async def predict_coordinates(file: UploadFile = File(...)):
+    """Предсказание координат по фотографии"""
+    if batcher is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded")
+    try:
+        logger.info(f"Predicting coordinates: {file.filename}")
+        return await predict_image(await file.read())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error predicting coordinates: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict/batch")
+async def predict_coordinates_batch(files: List[UploadFile] = File(...)):
+    """Предсказание координат для нескольких фотографий"""
+    if batcher is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded")
+    if len(files) > MAX_FILES_PER_REQUEST:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_FILES_PER_REQUEST} files per request")
+    try:
+        contents = [await file.read() for file in files]
+        predictions = await asyncio.gather(*(predict_image(data) for data in contents))
+        return {
+            "predictions": [
+                {"filename": file.filename, **prediction}
+                for file, prediction in zip(files, predictions)
+            ]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error predicting coordinates batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready")
+async def readiness_check():
+    """Готовность к запросам: модель загружена и прогрета"""
+    if batcher is None:
+        raise HTTPException(status_code=503, detail=load_error or "Model is loading")
+    return {"status": "ready", "model_format": model_format}
+
+@app.get("/health")
+async def health_check():
+    """Проверка состояния сервиса"""
+    stats = batcher.stats if batcher is not None else {"batches": 0, "items": 0}
+    if batcher is not None:
+        status = "healthy"
+    else:
+        status = "failed" if load_error else "starting"
+    return {
+        "status": status,
+        "service": "neural-service",
+        "model_loaded": model is not None,
+        "model_format": model_format,
+        "startup_seconds": startup_seconds,
+        "queue_depth": batcher.queue_depth if batcher is not None else 0,
+        "batches": stats["batches"],
+        "average_batch_size": stats["items"] / stats["batches"] if stats["batches"] else 0.0
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,73 @@
+"""Нагрузочная проверка neural-service
+
+Сравнивает пропускную способность последовательных одиночных запросов
+и конкурентных запросов, которые сервис объединяет в батчи.
+
+    python benchmark.py --url http://localhost:8002 --requests 256 --concurrency 32
+"""
+import argparse
+import asyncio
+import time
+
+import cv2
+import httpx
+import numpy as np
+
+
+def make_image(seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+    _, buffer = cv2.imencode(".jpg", image)
+    return buffer.tobytes()
+
+
+async def run(url: str, images, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        async def one(image: bytes):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(f"{url}/predict", files={"file": ("image.jpg", image, "image/jpeg")})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(image) for image in images))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "throughput_rps": len(images) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="neural-service throughput benchmark")
+    parser.add_argument("--url", default="http://localhost:8002")
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    images = [make_image(i) for i in range(args.requests)]
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        health = (await client.get(f"{args.url}/health")).json()
+    print(f"Service: {health}")
+
+    single = await run(args.url, images, 1)
+    batched = await run(args.url, images, args.concurrency)
+    for result in (single, batched):
+        print(
+            f"concurrency={result['concurrency']:>4}  "
+            f"{result['throughput_rps']:8.1f} req/s  "
+            f"p50={result['p50_ms']:7.1f}ms  p95={result['p95_ms']:7.1f}ms"
+        )
+    print(f"Speedup: {batched['throughput_rps'] / single['throughput_rps']:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
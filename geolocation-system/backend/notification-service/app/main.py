@@ -1,10 +1,12 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
-import redis
+from fastapi import FastAPI, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Tuple
+import redis.asyncio as aioredis
+from redis.exceptions import NoScriptError
 import json
 import logging
 import os
+import uuid
 from datetime import datetime
 
 # Настройка логирования
@@ -15,64 +17,204 @@ app = FastAPI(title="Notification Service")
 
 # Настройка Redis
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
-redis_client = redis.from_url(REDIS_URL)
+# Соединений с Redis на процесс; при занятом пуле запрос ждет свободное
+# соединение до REDIS_POOL_TIMEOUT секунд вместо открытия нового
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "32"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+NOTIFICATION_TTL = 86400 * 7  # Хранение 7 дней
+# Сколько последних уведомлений хранится на пользователя; более старые
+# удаляются при записи новых, поэтому память на пользователя ограничена
+HISTORY_LIMIT = int(os.getenv("NOTIFICATION_HISTORY_LIMIT", "500"))
+MAX_PAGE_SIZE = 200
+# Уведомлений в одном пакетном запросе и в одном конвейере Redis
+MAX_BATCH_SIZE = int(os.getenv("NOTIFICATION_MAX_BATCH_SIZE", "10000"))
+PIPELINE_CHUNK_SIZE = 1000
+
+redis_pool = aioredis.BlockingConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_POOL_SIZE, timeout=REDIS_POOL_TIMEOUT
+)
+redis_client = aioredis.Redis(connection_pool=redis_pool)
+
+# Добавление уведомлений пользователя с обрезкой истории до лимита.
+# KEYS: индекс (zset id -> номер), данные (hash id -> JSON), непрочитанные
+# (set id), счетчик номеров. ARGV: ttl, лимит, затем пары id, JSON.
+# Скрипт выполняется атомарно: история не превышает лимит ни на миг, а
+# удаленные из индекса уведомления удаляются и из данных, и из непрочитанных.
+ADD_SCRIPT = """
+local index, data, unread, seq = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local ttl, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+for i = 3, #ARGV, 2 do
+    redis.call('ZADD', index, redis.call('INCR', seq), ARGV[i])
+    redis.call('HSET', data, ARGV[i], ARGV[i + 1])
+    redis.call('SADD', unread, ARGV[i])
+end
+local excess = redis.call('ZCARD', index) - limit
+if excess > 0 then
+    local expired = redis.call('ZRANGE', index, 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', index, 0, excess - 1)
+    redis.call('HDEL', data, unpack(expired))
+    redis.call('SREM', unread, unpack(expired))
+end
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ttl)
+end
+return excess
+"""
 
 class Notification(BaseModel):
     user_id: int
-    title: str
-    message: str
+    title: str = Field(max_length=200)
+    message: str = Field(max_length=4000)
     type: str = "info"  # info, success, warning, error
     timestamp: Optional[datetime] = None
 
 class NotificationService:
-    def __init__(self):
-        self.redis_client = redis_client
-    
-    def send_notification(self, notification: Notification) -> bool:
-        """Отправка уведомления пользователю"""
+    """Хранение уведомлений в Redis
+
+    На пользователя: индекс notifications:{id}:index (zset, id уведомления
+    со сквозным номером в качестве score), данные :data (hash id -> JSON),
+    непрочитанные :unread (set id) и счетчик номеров :seq. Номер задает
+    порядок и служит курсором страниц, отметка о прочтении - одна операция
+    над множеством, число непрочитанных - его размер.
+    """
+
+    def __init__(self, client: aioredis.Redis = redis_client):
+        self.redis_client = client
+        self._add_sha: Optional[str] = None
+
+    async def load_scripts(self):
+        """Загрузка скрипта записи в Redis (SCRIPT LOAD) один раз
+
+        Конвейер с зарегистрированным Script перед каждым выполнением
+        проверяет скрипт отдельным SCRIPT EXISTS; с EVALSHA по готовому
+        sha запись остается одним сетевым обменом.
+        """
+        self._add_sha = await self.redis_client.script_load(ADD_SCRIPT)
+
+    @staticmethod
+    def _keys(user_id: int) -> List[str]:
+        prefix = f"notifications:{user_id}"
+        return [f"{prefix}:index", f"{prefix}:data", f"{prefix}:unread", f"{prefix}:seq"]
+
+    @staticmethod
+    def _serialize(notification: Notification) -> Tuple[str, str]:
+        notification_id = uuid.uuid4().hex
+        notification.timestamp = datetime.utcnow()
+        notification_data = notification.dict()
+        notification_data['id'] = notification_id
+        notification_data['timestamp'] = notification.timestamp.isoformat()
+        return notification_id, json.dumps(notification_data)
+
+    def _queue(self, pipe, notifications: List[Notification]) -> List[str]:
+        """Команды записи в конвейер: один вызов скрипта на пользователя
+
+        Возвращает id уведомлений в порядке notifications.
+        """
+        ids = []
+        by_user: Dict[int, List[str]] = {}
+        for notification in notifications:
+            notification_id, data = self._serialize(notification)
+            ids.append(notification_id)
+            by_user.setdefault(notification.user_id, []).extend((notification_id, data))
+        for user_id, args in by_user.items():
+            keys = self._keys(user_id)
+            pipe.evalsha(self._add_sha, len(keys), *keys, NOTIFICATION_TTL, HISTORY_LIMIT, *args)
+        return ids
+
+    async def _write(self, notifications: List[Notification]) -> List[str]:
+        """Запись уведомлений одним конвейером; возвращает их id
+
+        Если Redis потерял скрипт (перезапуск, SCRIPT FLUSH), ни одна команда
+        конвейера не выполнилась: скрипт загружается заново и запись повторяется.
+        """
+        if self._add_sha is None:
+            await self.load_scripts()
+        for attempt in range(2):
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                ids = self._queue(pipe, notifications)
+                try:
+                    await pipe.execute()
+                    return ids
+                except NoScriptError:
+                    if attempt:
+                        raise
+                    logger.warning("Notification script is missing in Redis, reloading")
+            await self.load_scripts()
+
+    async def send_notification(self, notification: Notification) -> Optional[str]:
+        """Отправка уведомления пользователю; возвращает id уведомления
+
+        Запись и обрезка истории - один вызов скрипта, один сетевой обмен с Redis.
+        """
         try:
-            notification.timestamp = datetime.utcnow()
-            
-            # Сохранение уведомления в Redis
-            key = f"notifications:{notification.user_id}"
-            notification_data = notification.dict()
-            notification_data['timestamp'] = notification.timestamp.isoformat()
-            
-            self.redis_client.lpush(key, json.dumps(notification_data))
-            self.redis_client.expire(key, 86400 * 7)  # Хранение 7 дней
-            
+            notification_id, = await self._write([notification])
             logger.info(f"Notification sent to user {notification.user_id}: {notification.title}")
-            return True
+            return notification_id
         except Exception as e:
             logger.error(f"Error sending notification: {e}")
-            return False
-    
-    def get_user_notifications(self, user_id: int, limit: int = 50) -> List[Dict]:
-        """Получение уведомлений пользователя"""
-        try:
-            key = f"notifications:{user_id}"
-            notifications = self.redis_client.lrange(key, 0, limit - 1)
-            
-            result = []
-            for notification_json in notifications:
-                notification_data = json.loads(notification_json)
-                result.append(notification_data)
-            
-            logger.info(f"Retrieved {len(result)} notifications for user {user_id}")
-            return result
-        except Exception as e:
-            logger.error(f"Error getting notifications: {e}")
-            return []
-    
-    def mark_notification_read(self, user_id: int, notification_id: str) -> bool:
-        """Отметка уведомления как прочитанного"""
-        try:
-            # В реальной системе здесь была бы более сложная логика
+            return None
+
+    async def send_batch(self, notifications: List[Notification]) -> List[str]:
+        """Пакетная отправка; возвращает id сохраненных уведомлений
+
+        Уведомления пишутся конвейерами по PIPELINE_CHUNK_SIZE, чтобы ни
+        запрос, ни ответ Redis не разрастались на весь пакет.
+        """
+        ids = []
+        for start in range(0, len(notifications), PIPELINE_CHUNK_SIZE):
+            ids.extend(await self._write(notifications[start:start + PIPELINE_CHUNK_SIZE]))
+        logger.info(f"Batch of {len(ids)} notifications sent")
+        return ids
+
+    async def get_user_notifications(self, user_id: int, limit: int = 50,
+                                     cursor: Optional[int] = None) -> Dict:
+        """Страница уведомлений пользователя, новые первыми
+
+        cursor - next_cursor предыдущей страницы: выборка идет по score
+        индекса от курсора, без повторного просмотра уже отданных.
+        """
+        index, data, unread, _ = self._keys(user_id)
+        upper = f"({cursor}" if cursor is not None else "+inf"
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            # Лишний элемент показывает, есть ли следующая страница
+            pipe.zrevrangebyscore(index, upper, "-inf", start=0, num=limit + 1, withscores=True)
+            pipe.scard(unread)
+            page, unread_count = await pipe.execute()
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        notifications = []
+        if page:
+            ids = [notification_id for notification_id, _ in page]
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hmget(data, ids)
+                pipe.smismember(unread, ids)
+                payloads, unread_flags = await pipe.execute()
+            for payload, is_unread in zip(payloads, unread_flags):
+                # Уведомление могло быть вытеснено между двумя запросами
+                if payload is None:
+                    continue
+                notification_data = json.loads(payload)
+                notification_data['read'] = not is_unread
+                notifications.append(notification_data)
+
+        next_cursor = int(page[-1][1]) if has_more else None
+        logger.info(f"Retrieved {len(notifications)} notifications for user {user_id}")
+        return {"notifications": notifications, "next_cursor": next_cursor, "unread": unread_count}
+
+    async def get_unread_count(self, user_id: int) -> int:
+        return await self.redis_client.scard(self._keys(user_id)[2])
+
+    async def mark_notification_read(self, user_id: int, notification_id: str) -> bool:
+        """Отметка уведомления как прочитанного; False, если уведомления нет"""
+        _, data, unread, _ = self._keys(user_id)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.hexists(data, notification_id)
+            pipe.srem(unread, notification_id)
+            exists, _ = await pipe.execute()
+        if exists:
             logger.info(f"Notification {notification_id} marked as read for user {user_id}")
-            return True
-        except Exception as e:
-            logger.error(f"Error marking notification as read: {e}")
-            return False
+        return bool(exists)
 
 service = NotificationService()
 
@@ -80,34 +222,59 @@ service = NotificationService()
 async def send_notification(notification: Notification):
     """Отправка уведомления"""
     try:
-        success = service.send_notification(notification)
-        if success:
-            return {"message": "Notification sent successfully"}
+        notification_id = await service.send_notification(notification)
+        if notification_id:
+            return {"message": "Notification sent successfully", "id": notification_id}
         else:
             raise HTTPException(status_code=500, detail="Failed to send notification")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in send notification endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/send/batch")
+async def send_notifications_batch(notifications: List[Notification]):
+    """Пакетная отправка уведомлений"""
+    if len(notifications) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {MAX_BATCH_SIZE} notifications")
+    try:
+        ids = await service.send_batch(notifications)
+        return {"message": "Notifications sent successfully", "sent": len(ids), "ids": ids}
+    except Exception as e:
+        logger.error(f"Error in send batch endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/user/{user_id}")
-async def get_user_notifications(user_id: int, limit: int = 50):
-    """Получение уведомлений пользователя"""
+async def get_user_notifications(user_id: int, limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+                                 cursor: Optional[int] = None):
+    """Получение уведомлений пользователя по страницам"""
     try:
-        notifications = service.get_user_notifications(user_id, limit)
-        return {"notifications": notifications}
+        return await service.get_user_notifications(user_id, limit, cursor)
     except Exception as e:
         logger.error(f"Error in get notifications endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/unread/{user_id}")
+async def get_unread_count(user_id: int):
+    """Число непрочитанных уведомлений пользователя"""
+    try:
+        return {"unread": await service.get_unread_count(user_id)}
+    except Exception as e:
+        logger.error(f"Error in unread count endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/mark-read/{user_id}/{notification_id}")
 async def mark_notification_read(user_id: int, notification_id: str):
     """Отметка уведомления как прочитанного"""
     try:
-        success = service.mark_notification_read(user_id, notification_id)
+        success = await service.mark_notification_read(user_id, notification_id)
         if success:
             return {"message": "Notification marked as read"}
         else:
-            raise HTTPException(status_code=500, detail="Failed to mark notification as read")
+            raise HTTPException(status_code=404, detail="Notification not found")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in mark read endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -117,7 +284,7 @@ async def health_check():
     """Проверка состояния сервиса"""
     try:
         # Проверка подключения к Redis
-        redis_client.ping()
+        await redis_client.ping()
         return {
             "status": "healthy",
             "service": "notification-service",
@@ -131,6 +298,18 @@ async def health_check():
             "error": str(e)
         }
 
+@app.on_event("startup")
+async def startup():
+    # Без Redis сервис все равно стартует: скрипт загрузится при первой записи
+    try:
+        await service.load_scripts()
+    except Exception as e:
+        logger.warning(f"Could not load notification script at startup: {e}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await redis_pool.disconnect()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
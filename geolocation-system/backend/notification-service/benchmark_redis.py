@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+
+import redis
+import redis.asyncio as aioredis
+
+from app.main import HISTORY_LIMIT, NOTIFICATION_TTL, Notification, NotificationService
+
+logger = logging.getLogger(__name__)
+
+# Отдельная база, чтобы не смешивать замеры с уведомлениями сервиса
+REDIS_URL = os.getenv("BENCHMARK_REDIS_URL", "redis://localhost:6379/15")
+
+
+def synthetic_notifications(count: int, users: int = 500) -> List[Notification]:
+    return [
+        Notification(user_id=i % users, title=f"Экспорт {i} готов",
+                     message=f"Файл доступен по адресу /api/export/jobs/{i:032x}/download", type="success")
+        for i in range(count)
+    ]
+
+
+def sync_two_round_trips(notifications: List[Notification]) -> float:
+    """Исходная запись: синхронный клиент, lpush и expire в список отдельными запросами"""
+    client = redis.from_url(REDIS_URL)
+    started = time.perf_counter()
+    for notification in notifications:
+        key = f"notifications:{notification.user_id}"
+        data = notification.dict()
+        data["timestamp"] = datetime.utcnow().isoformat()
+        client.lpush(key, json.dumps(data))
+        client.expire(key, NOTIFICATION_TTL)
+    seconds = time.perf_counter() - started
+    client.close()
+    return seconds
+
+
+async def _async_run(notifications: List[Notification], pool_size: int, concurrency: int, batch: bool) -> float:
+    pool = aioredis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=pool_size)
+    service = NotificationService(aioredis.Redis(connection_pool=pool))
+    try:
+        started = time.perf_counter()
+        if batch:
+            await service.send_batch(notifications)
+        else:
+            # Одновременные запросы /send: по concurrency уведомлений в работе
+            queue = iter(notifications)
+
+            async def worker():
+                for notification in queue:
+                    await service.send_notification(notification)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+    finally:
+        await pool.disconnect()
+
+
+def run_benchmark(count: int, pool_size: int, concurrency: int, output: str) -> Dict:
+    flush = redis.from_url(REDIS_URL)
+    flush.ping()
+    # Логи сервиса на каждое уведомление искажают замер
+    logging.getLogger("app.main").setLevel(logging.WARNING)
+
+    results = []
+    for mode in ("sync", "async", "batch"):
+        flush.flushdb()
+        notifications = synthetic_notifications(count)
+        logger.info(f"Benchmarking {mode} on {count} notifications")
+        if mode == "sync":
+            seconds = sync_two_round_trips(notifications)
+            stored = sum(flush.llen(key) for key in flush.scan_iter("notifications:*"))
+            expected = count
+        else:
+            seconds = asyncio.run(_async_run(notifications, pool_size, concurrency, batch=mode == "batch"))
+            stored = sum(flush.zcard(key) for key in flush.scan_iter("notifications:*:index"))
+            # Сервис хранит не больше HISTORY_LIMIT уведомлений на пользователя
+            per_user = Counter(notification.user_id for notification in notifications)
+            expected = sum(min(n, HISTORY_LIMIT) for n in per_user.values())
+        if stored != expected:
+            raise RuntimeError(f"{mode}: expected {expected} notifications in Redis, found {stored}")
+        results.append({
+            "mode": mode,
+            "notifications": count,
+            "seconds": seconds,
+            "per_second": count / seconds if seconds else 0.0,
+        })
+    flush.flushdb()
+    flush.close()
+
+    baseline = results[0]
+    for result in results:
+        result["speedup_vs_sync"] = baseline["seconds"] / result["seconds"]
+
+    report = {"redis_url": REDIS_URL, "pool_size": pool_size, "concurrency": concurrency, "results": results}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Redis report saved to {output}")
+
+    for result in results:
+        logger.info(f"{result['mode']:>6}: {result['per_second']:9.0f} notifications/s "
+                    f"({result['speedup_vs_sync']:5.1f}x vs sync)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare notification write throughput against a local Redis")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--pool-size", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent /send calls in async mode")
+    parser.add_argument("--output", default="redis_report.json")
+    args = parser.parse_args()
+    run_benchmark(args.count, args.pool_size, args.concurrency, args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -10,8 +10,8 @@ echo "🔨 Сборка Docker образов для системы геолок
 echo "📦 Сборка frontend..."
 docker build -t geolocation/frontend:latest ./frontend/
 
-# Backend services (без neural-service)
-for service in api-gateway auth-service image-service coordinates-service export-service notification-service; do
+# Backend services
+for service in api-gateway auth-service image-service neural-service coordinates-service export-service notification-service; do
     echo "📦 Сборка $service..."
     docker build -t geolocation/$service:latest ./backend/$service/
 done
@@ -20,8 +20,3 @@ echo "✅ Все образы собраны успешно!"
 echo ""
 echo "📋 Список созданных образов:"
 docker images | grep geolocation
-
-echo ""
-echo "ℹ️  Примечание: Neural Service не собран - требует настройки модели"
-echo "   Для сборки neural-service выполните:"
-echo "   docker build -t geolocation/neural-service:latest ./backend/neural-service/"
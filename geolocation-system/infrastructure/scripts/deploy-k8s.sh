@@ -187,9 +187,9 @@ deploy_services() {
     kubectl apply -f infrastructure/kubernetes/auth-service.yaml
     log "✅ Auth Service развернут"
     
-    # Neural Service (закомментирован)
-    # kubectl apply -f infrastructure/kubernetes/neural-service.yaml
-    # log "✅ Neural Service развернут"
+    # Neural Service
+    kubectl apply -f infrastructure/kubernetes/neural-service.yaml
+    log "✅ Neural Service развернут"
     
     # Image Service
     kubectl apply -f infrastructure/kubernetes/image-service.yaml
@@ -0,0 +1,257 @@
+import os
+import csv
+import json
+import time
+import argparse
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from preprocessing import ImagePreprocessor
+from serving import load_predictor
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+PROGRESS_FILE = "_progress.json"
+COLUMNS = ("path", "latitude", "longitude", "error")
+
+
+def iter_directory(root: str) -> Iterator[str]:
+    """Изображения каталога рекурсивно, без построения полного списка
+
+    Записи каждого каталога сортируются: порядок обхода стабилен между
+    запусками, что нужно для продолжения после прерывания.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                yield entry.path
+        stack.extend(reversed(subdirectories))
+
+
+def iter_manifest(manifest_path: str) -> Iterator[str]:
+    """Пути из манифеста: CSV с колонкой path или по одному пути в строке"""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline="") as f:
+        if manifest_path.endswith(".csv"):
+            rows = (row["path"] for row in csv.DictReader(f))
+        else:
+            rows = (line.strip() for line in f)
+        for path in rows:
+            if path:
+                yield path if os.path.isabs(path) else os.path.join(base_dir, path)
+
+
+class PartWriter:
+    """Запись предсказаний частями part-NNNNN.{csv,parquet}
+
+    Каждая часть пишется во временный файл и переименовывается, после чего
+    обновляется _progress.json с числом обработанных входов. При повторном
+    запуске обработка продолжается с первого незаписанного входа.
+    """
+
+    def __init__(self, output_dir: str, output_format: str = "csv", rows_per_part: int = 10000):
+        if output_format not in ("csv", "parquet"):
+            raise ValueError(f"Unknown output format: {output_format}")
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.rows_per_part = rows_per_part
+        self.rows: List[Dict] = []
+        os.makedirs(output_dir, exist_ok=True)
+        self.progress = self._load_progress()
+
+    def _load_progress(self) -> Dict:
+        path = os.path.join(self.output_dir, PROGRESS_FILE)
+        if not os.path.exists(path):
+            return {"processed": 0, "parts": 0, "failed": 0}
+        with open(path) as f:
+            return json.load(f)
+
+    @property
+    def processed(self) -> int:
+        return self.progress["processed"]
+
+    def write(self, rows: List[Dict]):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        path = os.path.join(self.output_dir, f"part-{self.progress['parts']:05d}.{self.output_format}")
+        tmp_path = f"{path}.tmp"
+        if self.output_format == "csv":
+            with open(tmp_path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(self.rows)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table({column: [row[column] for row in self.rows] for column in COLUMNS})
+            pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+        self.progress["processed"] += len(self.rows)
+        self.progress["parts"] += 1
+        self.progress["failed"] += sum(1 for row in self.rows if row["error"])
+        self.rows = []
+        progress_path = os.path.join(self.output_dir, PROGRESS_FILE)
+        with open(f"{progress_path}.tmp", "w") as f:
+            json.dump(self.progress, f, indent=2)
+        os.replace(f"{progress_path}.tmp", progress_path)
+
+
+def _batches(paths: Iterator[str], batch_size: int) -> Iterator[List[str]]:
+    while True:
+        batch = list(islice(paths, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _decode(preprocessor: ImagePreprocessor, path: str):
+    try:
+        return preprocessor.preprocess_image(path), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def predict_paths(predictor, paths: Iterator[str], writer: PartWriter, batch_size: int = 64,
+                  workers: Optional[int] = None, prefetch_batches: int = 2) -> Dict:
+    """Потоковое предсказание: декодирование пулом потоков, инференс батчами
+
+    В памяти не больше prefetch_batches + 1 батчей изображений.
+    """
+    height, width = predictor.input_shape[:2]
+    preprocessor = ImagePreprocessor((width, height))
+    workers = workers or os.cpu_count()
+    pending = deque()
+    processed = 0
+    batches_done = 0
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batches = _batches(paths, batch_size)
+
+        def submit_next() -> bool:
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            pending.append((batch, [pool.submit(_decode, preprocessor, path) for path in batch]))
+            return True
+
+        for _ in range(prefetch_batches + 1):
+            if not submit_next():
+                break
+
+        while pending:
+            batch, futures = pending.popleft()
+            submit_next()
+            decoded = [future.result() for future in futures]
+            valid = [i for i, (image, _) in enumerate(decoded) if image is not None]
+            coordinates = {}
+            if valid:
+                images = np.stack([decoded[i][0] for i in valid])
+                for i, (lat, lon) in zip(valid, predictor.predict_batch(images)):
+                    coordinates[i] = preprocessor.denormalize_coordinates(float(lat), float(lon))
+
+            rows = []
+            for i, path in enumerate(batch):
+                latitude, longitude = coordinates.get(i, (None, None))
+                rows.append({"path": path, "latitude": latitude, "longitude": longitude,
+                             "error": decoded[i][1] or ""})
+            writer.write(rows)
+
+            processed += len(batch)
+            batches_done += 1
+            if batches_done % 100 == 0:
+                elapsed = time.perf_counter() - started
+                logger.info(f"Processed {writer.processed + len(writer.rows)} images ({processed / elapsed:.1f} img/s)")
+
+    writer.flush()
+    elapsed = time.perf_counter() - started
+    return {
+        "processed": processed,
+        "seconds": elapsed,
+        "images_per_second": processed / elapsed if elapsed else 0.0,
+        "total_processed": writer.processed,
+        "failed": writer.progress["failed"],
+    }
+
+
+def run(input_dir: Optional[str], manifest: Optional[str], output_dir: str, output_format: str = "csv",
+        batch_size: int = 64, workers: Optional[int] = None, rows_per_part: int = 10000,
+        saved_model_dir: Optional[str] = None, tflite_path: Optional[str] = None,
+        weights_path: Optional[str] = None, backbone: Optional[str] = None,
+        num_threads: Optional[int] = None) -> Dict:
+    writer = PartWriter(output_dir, output_format, rows_per_part)
+    paths = iter_manifest(manifest) if manifest else iter_directory(input_dir)
+    if writer.processed:
+        logger.info(f"Resuming after {writer.processed} already processed images")
+        paths = islice(paths, writer.processed, None)
+
+    predictor, predictor_format = load_predictor(
+        saved_model_dir=saved_model_dir,
+        tflite_path=tflite_path,
+        weights_path=weights_path,
+        num_threads=num_threads,
+        backbone=backbone
+    )
+    logger.info(f"Model loaded ({predictor_format})")
+    summary = predict_paths(predictor, paths, writer, batch_size, workers)
+    logger.info(
+        f"Done: {summary['processed']} images in {summary['seconds']:.1f}s "
+        f"({summary['images_per_second']:.1f} img/s), {summary['total_processed']} total, "
+        f"{summary['failed']} failed"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict coordinates for an archive of photos")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="Directory scanned recursively for images")
+    source.add_argument("--manifest", help="Text file with one path per line, or CSV with a path column")
+    parser.add_argument("--output-dir", required=True, help="Directory for part files and resume progress")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None, help="Decoding threads (default: all cores)")
+    parser.add_argument("--rows-per-part", type=int, default=10000)
+    parser.add_argument("--saved-model", default="export/saved_model")
+    parser.add_argument("--tflite", default=None)
+    parser.add_argument("--weights", default="weights/best_model.h5")
+    parser.add_argument("--backbone", default=None)
+    parser.add_argument("--threads", type=int, default=None, help="TFLite interpreter threads")
+    args = parser.parse_args()
+
+    run(
+        args.input_dir, args.manifest, args.output_dir, args.format,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        rows_per_part=args.rows_per_part,
+        saved_model_dir=args.saved_model,
+        tflite_path=args.tflite,
+        weights_path=args.weights,
+        backbone=args.backbone,
+        num_threads=args.threads
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
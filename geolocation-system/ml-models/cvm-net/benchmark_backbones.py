@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+
+from model import BACKBONES, CVMModel
+from preprocessing import ImagePreprocessor, create_tf_dataset
+from export_model import haversine_km, measure_latency
+
+logger = logging.getLogger(__name__)
+
+
+def measure_cpu_time(predict_fn, images: np.ndarray, batch_size: int = 32, iterations: int = 10) -> float:
+    """Процессорное время (все потоки) на одно изображение, мс"""
+    batch = np.repeat(images[:1], batch_size, axis=0)
+    predict_fn(batch)
+    started = time.process_time()
+    for _ in range(iterations):
+        predict_fn(batch)
+    return (time.process_time() - started) / (iterations * batch_size) * 1000
+
+
+def coordinate_errors(model: CVMModel, image_paths: List[str], coordinates: List,
+                      batch_size: int = 32) -> np.ndarray:
+    """Ошибка предсказанных координат на тестовой части, км"""
+    preprocessor = ImagePreprocessor()
+    predictions = []
+    for images, _ in create_tf_dataset(image_paths, coordinates, batch_size):
+        for lat, lon in model.predict_batch(images.numpy()):
+            predictions.append(preprocessor.denormalize_coordinates(float(lat), float(lon)))
+    return haversine_km(np.asarray(predictions), np.asarray(coordinates, dtype=np.float64))
+
+
+def benchmark_backbone(backbone: str, splits: Dict, output_dir: str, weights_path: Optional[str] = None,
+                       epochs: int = 10, batch_size: int = 32, learning_rate: float = 0.001) -> Dict:
+    """Обучение головы (или загрузка весов) и замер одного backbone"""
+    from training import CVMTrainer
+
+    save_dir = os.path.join(output_dir, backbone)
+    os.makedirs(save_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    model = CVMModel(weights=None if weights_path else 'imagenet', backbone=backbone)
+    build_seconds = time.perf_counter() - started
+    if weights_path:
+        model.load_weights(weights_path)
+    else:
+        # Одинаковое обучение головы на закэшированных признаках для всех backbone
+        model.compile_model(learning_rate=learning_rate)
+        trainer = CVMTrainer(model, {
+            'batch_size': batch_size,
+            'epochs': epochs,
+            'learning_rate': learning_rate,
+            'patience': max(3, epochs // 4),
+            'feature_cache_dir': os.path.join(save_dir, 'feature_cache')
+        })
+        trainer.train_cached(splits['train'], splits['val'], save_dir)
+
+    test = splits['test']
+    errors = coordinate_errors(model, test['images'], test['coordinates'], batch_size)
+    sample, _ = next(iter(create_tf_dataset(test['images'][:1], test['coordinates'][:1], 1)))
+    sample = sample.numpy()
+
+    return {
+        'backbone': backbone,
+        'nominal_gflops': BACKBONES[backbone]['gflops'],
+        'params': int(model.model.count_params()),
+        'build_seconds': build_seconds,
+        'weights': weights_path or 'head trained on cached features',
+        'latency': [measure_latency(model.predict_batch, sample, size) for size in (1, batch_size)],
+        'cpu_ms_per_image': measure_cpu_time(model.predict_batch, sample, batch_size),
+        'error_km': {
+            'mean': float(errors.mean()),
+            'median': float(np.median(errors)),
+            'p90': float(np.percentile(errors, 90))
+        },
+        'test_samples': len(errors)
+    }
+
+
+def run_benchmark(data_dir: str, output_dir: str, backbones: List[str], weights: Dict[str, str],
+                  epochs: int = 10, batch_size: int = 32, max_samples: Optional[int] = None,
+                  seed: int = 42) -> Dict:
+    """Сравнение backbone на одном и том же разбиении данных"""
+    from training import CVMTrainer
+
+    os.makedirs(output_dir, exist_ok=True)
+    trainer = CVMTrainer(None, {})
+    image_paths, coordinates = trainer.prepare_data(data_dir)
+    if max_samples:
+        image_paths, coordinates = image_paths[:max_samples], coordinates[:max_samples]
+    splits = dict(zip(('train', 'val', 'test'), trainer.split_data(image_paths, coordinates, seed=seed)))
+
+    results = []
+    for backbone in backbones:
+        logger.info(f"Benchmarking backbone {backbone}")
+        results.append(benchmark_backbone(
+            backbone, splits, output_dir, weights.get(backbone), epochs, batch_size
+        ))
+        # Модели разных backbone не должны делить память и граф
+        tf.keras.backend.clear_session()
+
+    report = {
+        'data_dir': data_dir,
+        'seed': seed,
+        'threads': tf.config.threading.get_intra_op_parallelism_threads() or os.cpu_count(),
+        'results': results
+    }
+    report_path = os.path.join(output_dir, 'backbone_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Backbone report saved to {report_path}")
+
+    for result in sorted(results, key=lambda r: r['cpu_ms_per_image']):
+        single, batched = result['latency']
+        logger.info(
+            f"{result['backbone']:>18}: error {result['error_km']['median']:8.1f} km (median), "
+            f"p50 {single['p50_ms']:6.1f} ms/img, {batched['images_per_second']:7.1f} img/s, "
+            f"{result['cpu_ms_per_image']:6.1f} CPU ms/img"
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CVM-Net backbones by CPU latency, throughput and error")
+    parser.add_argument("--data-dir", default="data", help="Directory with images/ and coordinates.json")
+    parser.add_argument("--output-dir", default="models/backbones")
+    parser.add_argument("--backbones", nargs="+", default=sorted(BACKBONES), choices=sorted(BACKBONES))
+    parser.add_argument("--weights", nargs="*", default=[], metavar="BACKBONE=PATH",
+                        help="Trained full-model weights; other backbones get a head trained on cached features")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-samples", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None, help="TensorFlow intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    weights = dict(item.split("=", 1) for item in args.weights)
+    run_benchmark(
+        args.data_dir, args.output_dir, args.backbones, weights,
+        epochs=args.epochs, batch_size=args.batch_size, max_samples=args.max_samples
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
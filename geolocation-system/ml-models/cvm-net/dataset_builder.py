@@ -0,0 +1,100 @@
+import os
+import json
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZE = (224, 224)
+
+
+def _serialize(image: np.ndarray, target: Tuple[float, float]) -> bytes:
+    import tensorflow as tf
+
+    feature = {
+        "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+        "coordinates": tf.train.Feature(float_list=tf.train.FloatList(value=list(target))),
+    }
+    return tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def _write_shard(args) -> Dict:
+    """Задача воркера: декодирование, ресайз и запись одного шарда"""
+    import tensorflow as tf
+    from preprocessing import ImagePreprocessor
+
+    path, image_paths, coordinates = args
+    preprocessor = ImagePreprocessor(IMAGE_SIZE)
+    written = 0
+    tmp_path = f"{path}.tmp"
+    with tf.io.TFRecordWriter(tmp_path) as writer:
+        for image_path, (lat, lon) in zip(image_paths, coordinates):
+            try:
+                # uint8 без нормализации: в 4 раза меньше места, чем float32
+                image = (preprocessor.preprocess_image(image_path) * 255.0).round().astype(np.uint8)
+            except Exception as e:
+                logger.warning(f"Skipping {image_path}: {e}")
+                continue
+            writer.write(_serialize(image, preprocessor.normalize_coordinates(lat, lon)))
+            written += 1
+    os.replace(tmp_path, path)
+    return {"file": os.path.basename(path), "samples": written}
+
+
+def build_split(image_paths: List[str], coordinates: List[Tuple[float, float]], output_dir: str,
+                split: str, samples_per_shard: int = 1000, workers: int = None) -> Dict:
+    """Запись одной части датасета в TFRecord шарды"""
+    os.makedirs(output_dir, exist_ok=True)
+    num_shards = max(1, int(np.ceil(len(image_paths) / samples_per_shard)))
+    tasks = []
+    for shard in range(num_shards):
+        start, end = shard * samples_per_shard, (shard + 1) * samples_per_shard
+        path = os.path.join(output_dir, f"{split}-{shard:05d}-of-{num_shards:05d}.tfrecord")
+        # В процесс воркера передается только своя часть, а не весь массив
+        tasks.append((path, np.asarray(image_paths[start:end]), np.asarray(coordinates[start:end])))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = list(pool.map(_write_shard, tasks))
+
+    total = sum(shard["samples"] for shard in shards)
+    logger.info(f"Split '{split}': {total} samples in {len(shards)} shards")
+    return {"samples": total, "shards": shards}
+
+
+def build_dataset(data_dir: str, output_dir: str, samples_per_shard: int = 1000,
+                  workers: int = None, seed: int = 42) -> Dict:
+    """Разбиение датасета на train/val/test и запись шардов с манифестом"""
+    from training import CVMTrainer
+
+    trainer = CVMTrainer(None, {})
+    image_paths, coordinates = trainer.prepare_data(data_dir)
+    splits = dict(zip(("train", "val", "test"), trainer.split_data(image_paths, coordinates, seed=seed)))
+
+    manifest = {"image_size": list(IMAGE_SIZE), "encoding": "raw_uint8", "seed": seed, "splits": {}}
+    for split, data in splits.items():
+        manifest["splits"][split] = build_split(
+            data["images"], data["coordinates"], output_dir, split, samples_per_shard, workers
+        )
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the CVM-Net dataset as pre-decoded TFRecord shards")
+    parser.add_argument("--data-dir", default="data", help="Directory with images/ and coordinates.json")
+    parser.add_argument("--output-dir", default="data/shards")
+    parser.add_argument("--samples-per-shard", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    build_dataset(args.data_dir, args.output_dir, args.samples_per_shard, args.workers, args.seed)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
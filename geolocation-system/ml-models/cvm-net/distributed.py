@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import logging
+from typing import Dict, List, Optional
+
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_FILE = "throughput.json"
+
+
+def cluster_spec() -> Dict:
+    """Конфигурация кластера из переменной окружения TF_CONFIG"""
+    config = json.loads(os.environ.get("TF_CONFIG", "{}") or "{}")
+    cluster = config.get("cluster", {})
+    task = config.get("task", {"type": "worker", "index": 0})
+    workers = cluster.get("worker", [])
+    return {
+        "num_workers": max(1, len(workers)),
+        "task_type": task.get("type", "worker"),
+        "task_index": int(task.get("index", 0)),
+    }
+
+
+def is_chief() -> bool:
+    """Рабочий с индексом 0 сохраняет веса, историю и отчеты"""
+    spec = cluster_spec()
+    return spec["task_type"] == "chief" or (spec["task_type"] == "worker" and spec["task_index"] == 0)
+
+
+def create_strategy() -> tf.distribute.Strategy:
+    """Стратегия распределения: MultiWorkerMirrored при нескольких рабочих"""
+    threads = int(os.environ.get("CVM_INTRA_OP_THREADS", "0"))
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 4))
+
+    spec = cluster_spec()
+    if spec["num_workers"] > 1:
+        # На CPU кольцевой all-reduce эффективнее NCCL-ориентированного AUTO
+        options = tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING
+        )
+        strategy = tf.distribute.MultiWorkerMirroredStrategy(communication_options=options)
+        logger.info(
+            f"Multi-worker training: worker {spec['task_index']} of {spec['num_workers']}, "
+            f"{strategy.num_replicas_in_sync} replicas"
+        )
+        return strategy
+    return tf.distribute.get_strategy()
+
+
+def worker_save_dir(save_dir: str) -> str:
+    """Каталог сохранения: у рабочих кроме главного - временный"""
+    if is_chief():
+        return save_dir
+    return os.path.join(tempfile.gettempdir(), f"cvm_worker_{cluster_spec()['task_index']}")
+
+
+def worker_data_dir(path: str) -> str:
+    """Свой подкаталог кэша/снимка tf.data у каждого рабочего
+
+    Рабочие читают разные части данных, а файловый кэш с общим префиксом
+    они бы перезаписывали и блокировали друг у друга.
+    """
+    spec = cluster_spec()
+    if spec["num_workers"] == 1:
+        return path
+    return os.path.join(path, f"worker_{spec['task_index']}")
+
+
+def shard_dataset(dataset: tf.data.Dataset, by_files: bool = False,
+                  num_files: Optional[int] = None) -> tf.data.Dataset:
+    """Политика разбиения датасета между рабочими
+
+    by_files=True - каждый рабочий читает свои TFRecord шарды, иначе элементы
+    делятся после чтения (датасет из списка путей). Если файлов (num_files)
+    меньше, чем рабочих, TensorFlow не может разделить их по файлам -
+    тогда тоже делятся элементы.
+    """
+    num_workers = cluster_spec()["num_workers"]
+    if by_files and num_files is not None and num_files < num_workers:
+        logger.info(f"{num_files} shard files for {num_workers} workers, sharding by elements")
+        by_files = False
+    policy = (
+        tf.data.experimental.AutoShardPolicy.FILE if by_files
+        else tf.data.experimental.AutoShardPolicy.DATA
+    )
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = policy
+    return dataset.with_options(options)
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Замер пропускной способности обучения (примеров в секунду)"""
+
+    def __init__(self, global_batch_size: int, save_dir: Optional[str] = None):
+        super().__init__()
+        self.global_batch_size = global_batch_size
+        self.save_dir = save_dir
+        self.epochs: List[Dict] = []
+        self._epoch_start = None
+        self._steps = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_start
+        samples = self._steps * self.global_batch_size
+        self.epochs.append({"epoch": epoch, "seconds": elapsed, "samples": samples,
+                            "samples_per_second": samples / elapsed if elapsed else 0.0})
+
+    def summary(self) -> Dict:
+        # Первая эпоха включает трассировку графа и прогрев - не учитываем
+        measured = self.epochs[1:] or self.epochs
+        seconds = sum(epoch["seconds"] for epoch in measured)
+        samples = sum(epoch["samples"] for epoch in measured)
+        return {
+            "num_workers": cluster_spec()["num_workers"],
+            "global_batch_size": self.global_batch_size,
+            "samples_per_second": samples / seconds if seconds else 0.0,
+            "epochs": self.epochs,
+        }
+
+    def on_train_end(self, logs=None):
+        if self.save_dir and is_chief():
+            with open(os.path.join(self.save_dir, THROUGHPUT_FILE), "w") as f:
+                json.dump(self.summary(), f, indent=2)
+
+
+def _free_ports(count: int) -> List[int]:
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def launch_local(num_workers: int, training_args: List[str], save_dir: str,
+                 threads_per_worker: Optional[int] = None) -> Dict:
+    """Запуск num_workers процессов training.py на одной машине"""
+    workers = [f"localhost:{port}" for port in _free_ports(num_workers)]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "training.py")
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = json.dumps({
+            "cluster": {"worker": workers},
+            "task": {"type": "worker", "index": index},
+        })
+        if threads_per_worker:
+            env["CVM_INTRA_OP_THREADS"] = str(threads_per_worker)
+            env["OMP_NUM_THREADS"] = str(threads_per_worker)
+        processes.append(subprocess.Popen(
+            [sys.executable, script, "--save-dir", save_dir, *training_args], env=env
+        ))
+
+    codes = [process.wait() for process in processes]
+    if any(codes):
+        raise RuntimeError(f"Worker processes failed with exit codes {codes}")
+    with open(os.path.join(save_dir, THROUGHPUT_FILE)) as f:
+        return json.load(f)
+
+
+def scaling_report(worker_counts: List[int], training_args: List[str], output_dir: str,
+                   total_threads: Optional[int] = None) -> Dict:
+    """Эффективность масштабирования относительно одного рабочего"""
+    runs = []
+    for count in worker_counts:
+        threads = max(1, total_threads // count) if total_threads else None
+        save_dir = os.path.join(output_dir, f"workers_{count}")
+        os.makedirs(save_dir, exist_ok=True)
+        logger.info(f"Training with {count} local workers")
+        runs.append(launch_local(count, training_args, save_dir, threads))
+
+    baseline = runs[0]["samples_per_second"] / worker_counts[0]
+    for run, count in zip(runs, worker_counts):
+        run["speedup"] = run["samples_per_second"] / runs[0]["samples_per_second"]
+        run["scaling_efficiency"] = run["samples_per_second"] / (baseline * count)
+
+    report = {"worker_counts": worker_counts, "runs": runs}
+    with open(os.path.join(output_dir, "scaling_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    for run in runs:
+        logger.info(
+            f"{run['num_workers']} workers: {run['samples_per_second']:.1f} samples/s, "
+            f"speedup {run['speedup']:.2f}x, efficiency {run['scaling_efficiency']:.0%}"
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run CVM-Net training with several local workers and report scaling efficiency",
+        epilog="Arguments after -- are passed to training.py"
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--output-dir", default="models/scaling")
+    parser.add_argument("--total-threads", type=int, default=os.cpu_count(),
+                        help="CPU threads split evenly between local workers")
+    args, training_args = parser.parse_known_args()
+    if training_args and training_args[0] == "--":
+        training_args = training_args[1:]
+    scaling_report(args.workers, training_args, args.output_dir, args.total_threads)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
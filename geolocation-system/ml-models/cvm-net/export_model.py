@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from manifest import eval_calibration_split
+from model import BACKBONES, DEFAULT_BACKBONE, CVMModel
+from preprocessing import ImagePreprocessor, create_tf_dataset
+from serving import TFLitePredictor
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("float32", "dynamic", "int8")
+EARTH_RADIUS_KM = 6371.0088
+
+
+def export_saved_model(model: CVMModel, export_dir: str) -> str:
+    """Экспорт модели в SavedModel с сигнатурой для любого размера батча"""
+    signature = tf.function(
+        lambda images: {"coordinates": model.model(images, training=False)},
+        input_signature=[tf.TensorSpec(shape=(None, *model.input_shape), dtype=tf.float32, name="images")]
+    )
+    tf.saved_model.save(model.model, export_dir, signatures={"serving_default": signature})
+    logger.info(f"SavedModel exported to {export_dir}")
+    return export_dir
+
+
+def representative_dataset(image_paths: List[str], coordinates: List[Tuple[float, float]],
+                           num_samples: int = 200):
+    """Калибровочная выборка для полной INT8 квантизации"""
+    dataset = create_tf_dataset(image_paths[:num_samples], coordinates[:num_samples], batch_size=1)
+
+    def generator() -> Iterator[List[np.ndarray]]:
+        for images, _ in dataset:
+            yield [images.numpy().astype(np.float32)]
+
+    return generator
+
+
+def convert_to_tflite(saved_model_dir: str, mode: str = "dynamic",
+                      representative_data=None) -> bytes:
+    """Конвертация SavedModel в TFLite
+
+    float32 - без квантизации, dynamic - веса INT8 с вычислениями во float,
+    int8 - веса и активации INT8 по калибровочной выборке (вход и выход
+    остаются float32, чтобы не менять интерфейс модели).
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+    if mode in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "int8":
+        if representative_data is None:
+            raise ValueError("INT8 quantization requires a representative dataset")
+        converter.representative_dataset = representative_data
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    tflite_model = converter.convert()
+    logger.info(f"TFLite model converted ({mode}): {len(tflite_model) / 1e6:.1f} MB")
+    return tflite_model
+
+
+def _rss_bytes() -> int:
+    """Текущий RSS процесса"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _directory_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def haversine_km(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Расстояние между массивами точек (lat, lon) в км"""
+    lat1, lon1 = np.radians(a[:, 0]), np.radians(a[:, 1])
+    lat2, lon2 = np.radians(b[:, 0]), np.radians(b[:, 1])
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _denormalize(predictions: np.ndarray) -> np.ndarray:
+    preprocessor = ImagePreprocessor()
+    return np.array([preprocessor.denormalize_coordinates(lat, lon) for lat, lon in predictions])
+
+
+def measure_latency(predict_fn, sample: np.ndarray, batch_size: int = 1,
+                    iterations: int = 50, warmup: int = 5) -> Dict[str, float]:
+    """Задержка на батч и пропускная способность"""
+    batch = np.repeat(sample[:1], batch_size, axis=0)
+    for _ in range(warmup):
+        predict_fn(batch)
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        predict_fn(batch)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        "batch_size": batch_size,
+        "p50_ms": median * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+        "images_per_second": batch_size / median
+    }
+
+
+def evaluate_variant(name: str, predict_fn, images: np.ndarray,
+                     reference: np.ndarray, targets: Optional[np.ndarray],
+                     artifact_size: int, memory_bytes: int,
+                     batch_sizes=(1, 32)) -> Dict:
+    """Метрики одного варианта модели относительно float-модели"""
+    predictions = _denormalize(predict_fn(images))
+    drift = haversine_km(predictions, reference)
+    result = {
+        "variant": name,
+        "artifact_mb": artifact_size / 1e6,
+        "memory_mb": memory_bytes / 1e6,
+        "latency": [measure_latency(predict_fn, images, size) for size in batch_sizes],
+        "drift_from_float_km": {
+            "mean": float(drift.mean()),
+            "p95": float(np.percentile(drift, 95)),
+            "max": float(drift.max())
+        }
+    }
+    if targets is not None:
+        result["error_km"] = float(haversine_km(predictions, targets).mean())
+    return result
+
+
+def load_eval_sample(image_paths: List[str], coordinates: List[Tuple[float, float]],
+                     num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+    dataset = create_tf_dataset(image_paths[:num_samples], coordinates[:num_samples], batch_size=num_samples)
+    images, _ = next(iter(dataset))
+    return images.numpy(), np.asarray(coordinates[:num_samples], dtype=np.float64)
+
+
+def run_export(weights_path: Optional[str], data_dir: str, output_dir: str,
+               modes=QUANTIZATION_MODES, calibration_samples: int = 200,
+               eval_samples: int = 64, num_threads: Optional[int] = None,
+               backbone: str = DEFAULT_BACKBONE) -> Dict:
+    """Экспорт SavedModel и TFLite вариантов с отчетом о сравнении"""
+    from training import CVMTrainer
+
+    os.makedirs(output_dir, exist_ok=True)
+    rss_before = _rss_bytes()
+    # Файл весов содержит и backbone - ImageNet веса не скачиваются
+    model = CVMModel(weights=None if weights_path else 'imagenet', backbone=backbone)
+    if weights_path:
+        model.load_weights(weights_path)
+    float_memory = _rss_bytes() - rss_before
+
+    image_paths, coordinates = CVMTrainer(model, {}).prepare_data(data_dir)
+    # Калибровка и оценка на разных изображениях
+    (eval_paths, eval_coords), (calib_paths, calib_coords) = eval_calibration_split(
+        image_paths, coordinates, eval_samples
+    )
+
+    images, targets = load_eval_sample(eval_paths, eval_coords, eval_samples)
+
+    saved_model_dir = export_saved_model(model, os.path.join(output_dir, "saved_model"))
+    reference = _denormalize(model.predict_batch(images))
+    variants = [evaluate_variant(
+        "keras_float32", model.predict_batch, images, reference, targets,
+        _directory_size(saved_model_dir), float_memory
+    )]
+
+    for mode in modes:
+        calibration = representative_dataset(calib_paths, calib_coords, calibration_samples) if mode == "int8" else None
+        tflite_path = os.path.join(output_dir, f"cvm_net_{mode}.tflite")
+        with open(tflite_path, "wb") as f:
+            f.write(convert_to_tflite(saved_model_dir, mode, calibration))
+
+        rss_before = _rss_bytes()
+        predictor = TFLitePredictor(tflite_path, num_threads=num_threads)
+        predictor.predict_batch(images[:1])
+        variants.append(evaluate_variant(
+            f"tflite_{mode}", predictor.predict_batch, images, reference, targets,
+            os.path.getsize(tflite_path), _rss_bytes() - rss_before
+        ))
+
+    report = {
+        "weights": weights_path,
+        "backbone": backbone,
+        "eval_samples": len(images),
+        "calibration_samples": min(calibration_samples, len(calib_paths)),
+        "variants": variants
+    }
+    report_path = os.path.join(output_dir, "export_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Export report saved to {report_path}")
+
+    for variant in variants:
+        single = variant["latency"][0]
+        logger.info(
+            f"{variant['variant']:>16}: {variant['artifact_mb']:7.1f} MB, "
+            f"p50 {single['p50_ms']:6.1f} ms/img, "
+            f"drift {variant['drift_from_float_km']['mean']:8.2f} km"
+        )
+    return report
+
+
+def export_for_serving(weights_path: str, output_dir: str, backbone: str = DEFAULT_BACKBONE) -> str:
+    """Только SavedModel для быстрого офлайн старта neural-service"""
+    model = CVMModel(weights=None, backbone=backbone)
+    model.load_weights(weights_path)
+    return export_saved_model(model, os.path.join(output_dir, "saved_model"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export CVM-Net for CPU serving")
+    parser.add_argument("--weights", help="Keras weights (.h5) produced by training.py")
+    parser.add_argument("--backbone", default=DEFAULT_BACKBONE, choices=sorted(BACKBONES),
+                        help="Backbone the weights were trained with")
+    parser.add_argument("--data-dir", default="data", help="Directory with images/ and coordinates.json")
+    parser.add_argument("--output-dir", default="export")
+    parser.add_argument("--modes", nargs="+", default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--eval-samples", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--saved-model-only", action="store_true",
+                        help="Only write <output-dir>/saved_model for serving, skip TFLite and the report")
+    args = parser.parse_args()
+
+    if args.saved_model_only:
+        if not args.weights:
+            parser.error("--saved-model-only requires --weights")
+        export_for_serving(args.weights, args.output_dir, args.backbone)
+        return
+
+    run_export(
+        args.weights, args.data_dir, args.output_dir,
+        modes=args.modes,
+        calibration_samples=args.calibration_samples,
+        eval_samples=args.eval_samples,
+        num_threads=args.threads,
+        backbone=args.backbone
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
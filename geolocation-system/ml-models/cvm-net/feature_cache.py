@@ -0,0 +1,192 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import inspect
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+import preprocessing
+from model import BACKBONES, CVMModel
+from preprocessing import create_tf_dataset
+
+logger = logging.getLogger(__name__)
+
+# Путей выборки в одной части при вычислении отпечатка
+FINGERPRINT_CHUNK_SIZE = 100000
+
+
+def _backbone_fingerprint(model: CVMModel) -> str:
+    """Хэш backbone, размера входа и весов замороженной части модели
+
+    Конфигурация Keras не используется: в ней автоматические имена слоев
+    (model_N, input_N), разные у двух экземпляров CVMModel в одном процессе.
+    """
+    extractor = model.feature_extractor()
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model.backbone, BACKBONES[model.backbone], list(model.input_shape)]).encode())
+    for weight in extractor.weights:
+        value = np.ascontiguousarray(weight.numpy())
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        digest.update(hashlib.sha256(value.tobytes()).digest())
+    return digest.hexdigest()
+
+
+def _preprocessing_fingerprint() -> str:
+    """Хэш кода предобработки изображений"""
+    source = inspect.getsource(preprocessing.load_image)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _dataset_fingerprint(image_paths: List[str], coordinates: List[Tuple[float, float]],
+                         manifest_path: Optional[str] = None) -> str:
+    """Хэш состава датасета: файл разметки (путь, размер, mtime), пути и координаты выборки
+
+    Файлы изображений не открываются: замена изображения без изменения
+    разметки кэш не сбрасывает. Пути и координаты хэшируются частями в
+    памяти, без копии всей выборки.
+    """
+    digest = hashlib.sha256()
+    if manifest_path is not None:
+        stat = os.stat(manifest_path)
+        digest.update(f"{os.path.abspath(manifest_path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    for start in range(0, len(image_paths), FINGERPRINT_CHUNK_SIZE):
+        stop = start + FINGERPRINT_CHUNK_SIZE
+        digest.update("\n".join(map(str, image_paths[start:stop])).encode())
+        digest.update(np.ascontiguousarray(np.asarray(coordinates[start:stop], dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+class FeatureCache:
+    """Кэш признаков замороженного backbone в memory-mapped массивах
+
+    Для каждого набора данных в cache_dir/<name>/ хранятся features.npy
+    (N x D, float32), targets.npy (N x 2, нормированные координаты) и
+    meta.json с отпечатком backbone, предобработки и датасета. Если
+    отпечаток не совпадает, признаки пересчитываются. manifest_path - файл
+    разметки, из которого взята выборка (его размер и mtime входят в отпечаток).
+    """
+
+    def __init__(self, cache_dir: str, model: CVMModel, batch_size: int = 64,
+                 manifest_path: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.model = model
+        self.batch_size = batch_size
+        self.manifest_path = manifest_path
+        self._model_fingerprint = None
+
+    def fingerprint(self, image_paths: List[str], coordinates: List[Tuple[float, float]]) -> str:
+        if self._model_fingerprint is None:
+            self._model_fingerprint = hashlib.sha256(
+                (_backbone_fingerprint(self.model) + _preprocessing_fingerprint()).encode()
+            ).hexdigest()
+        return hashlib.sha256(
+            (self._model_fingerprint + _dataset_fingerprint(image_paths, coordinates, self.manifest_path)).encode()
+        ).hexdigest()
+
+    def load_or_build(self, name: str, image_paths: List[str],
+                      coordinates: List[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Признаки и цели набора данных (из кэша или после прогона backbone)"""
+        path = os.path.join(self.cache_dir, name)
+        fingerprint = self.fingerprint(image_paths, coordinates)
+
+        cached = self._load(path, fingerprint)
+        if cached is not None:
+            logger.info(f"Feature cache hit for '{name}': {len(cached[0])} samples")
+            return cached
+
+        logger.info(f"Building feature cache for '{name}': {len(image_paths)} images")
+        self._build(path, fingerprint, image_paths, coordinates)
+        return self._load(path, fingerprint)
+
+    def _load(self, path: str, fingerprint: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != fingerprint:
+            logger.info(f"Feature cache at {path} is stale, rebuilding")
+            return None
+        features = np.load(os.path.join(path, "features.npy"), mmap_mode="r")
+        targets = np.load(os.path.join(path, "targets.npy"), mmap_mode="r")
+        return features, targets
+
+    def _build(self, path: str, fingerprint: str, image_paths: List[str],
+               coordinates: List[Tuple[float, float]]):
+        # Свой временный каталог у каждого процесса: параллельные сборки
+        # одного кэша не удаляют и не перезаписывают файлы друг друга
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}.", dir=self.cache_dir)
+        try:
+            self._write(tmp_path, fingerprint, image_paths, coordinates)
+            self._publish(tmp_path, path, fingerprint)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _publish(self, tmp_path: str, path: str, fingerprint: str):
+        """Атомарная замена каталога кэша собранным"""
+        for _ in range(3):
+            try:
+                os.replace(tmp_path, path)
+                return
+            except OSError:
+                # Каталог path занят: его успела опубликовать другая сборка
+                if self._load(path, fingerprint) is not None:
+                    return
+                shutil.rmtree(path, ignore_errors=True)
+        raise RuntimeError(f"Could not publish feature cache to {path}")
+
+    def _write(self, tmp_path: str, fingerprint: str, image_paths: List[str],
+               coordinates: List[Tuple[float, float]]):
+        extractor = self.model.feature_extractor()
+        extract = tf.function(lambda images: extractor(images, training=False))
+        num_samples = len(image_paths)
+        features = np.lib.format.open_memmap(
+            os.path.join(tmp_path, "features.npy"), mode="w+",
+            dtype=np.float32, shape=(num_samples, extractor.output_shape[-1])
+        )
+        targets = np.lib.format.open_memmap(
+            os.path.join(tmp_path, "targets.npy"), mode="w+",
+            dtype=np.float32, shape=(num_samples, 2)
+        )
+
+        position = 0
+        for images, batch_targets in create_tf_dataset(image_paths, coordinates, self.batch_size):
+            size = int(images.shape[0])
+            features[position:position + size] = extract(images).numpy()
+            targets[position:position + size] = batch_targets.numpy()
+            position += size
+        features.flush()
+        targets.flush()
+        del features, targets
+
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"fingerprint": fingerprint, "num_samples": num_samples}, f, indent=2)
+
+
+def create_feature_dataset(features: np.ndarray, targets: np.ndarray, batch_size: int = 32,
+                           shuffle: bool = False, seed: Optional[int] = None) -> tf.data.Dataset:
+    """Dataset батчей из memory-mapped признаков без загрузки массива целиком"""
+    num_samples = len(features)
+    dimension = features.shape[1]
+
+    def gather(indices):
+        # Чтение из memmap в порядке возрастания индексов
+        indices = np.sort(indices)
+        return np.asarray(features[indices]), np.asarray(targets[indices])
+
+    dataset = tf.data.Dataset.range(num_samples)
+    if shuffle:
+        dataset = dataset.shuffle(num_samples, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(
+        lambda indices: tf.numpy_function(gather, [indices], (tf.float32, tf.float32)),
+        num_parallel_calls=tf.data.AUTOTUNE
+    )
+    dataset = dataset.map(lambda x, y: (tf.ensure_shape(x, [None, dimension]), tf.ensure_shape(y, [None, 2])))
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,316 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Пространство поиска: ('log', low, high), ('uniform', low, high), ('int', low, high), ('choice', [...])
+DEFAULT_SPACE = {
+    'learning_rate': ('log', 1e-5, 1e-2),
+    'batch_size': ('choice', [16, 32, 64]),
+    'patience': ('int', 3, 10),
+}
+
+
+def sample_params(space: Dict, rng: np.random.Generator) -> Dict:
+    params = {}
+    for name, spec in space.items():
+        kind = spec[0]
+        if kind == 'log':
+            params[name] = float(math.exp(rng.uniform(math.log(spec[1]), math.log(spec[2]))))
+        elif kind == 'uniform':
+            params[name] = float(rng.uniform(spec[1], spec[2]))
+        elif kind == 'int':
+            params[name] = int(rng.integers(spec[1], spec[2] + 1))
+        elif kind == 'choice':
+            params[name] = spec[1][int(rng.integers(len(spec[1])))]
+        else:
+            raise ValueError(f"Unknown search space kind for {name}: {kind}")
+    return params
+
+
+class TrialStore:
+    """Хранилище испытаний в SQLite: параметры, итоговые метрики и val_loss по эпохам
+
+    Открывается отдельно в каждом процессе; WAL позволяет воркерам писать
+    промежуточные значения параллельно.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS trials (
+                trial_id INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                val_loss REAL,
+                epochs INTEGER,
+                metrics TEXT,
+                error TEXT,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS intermediate (
+                trial_id INTEGER NOT NULL,
+                epoch INTEGER NOT NULL,
+                val_loss REAL NOT NULL,
+                PRIMARY KEY (trial_id, epoch)
+            );
+        """)
+
+    def create_trial(self, params: Dict) -> int:
+        cursor = self.connection.execute(
+            "INSERT INTO trials (status, params) VALUES ('queued', ?)", (json.dumps(params),)
+        )
+        return cursor.lastrowid
+
+    def start_trial(self, trial_id: int):
+        self.connection.execute(
+            "UPDATE trials SET status = 'running', started_at = ? WHERE trial_id = ?", (time.time(), trial_id)
+        )
+
+    def finish_trial(self, trial_id: int, status: str, val_loss: Optional[float] = None,
+                     epochs: Optional[int] = None, metrics: Optional[Dict] = None, error: Optional[str] = None):
+        self.connection.execute(
+            "UPDATE trials SET status = ?, val_loss = ?, epochs = ?, metrics = ?, error = ?, finished_at = ? "
+            "WHERE trial_id = ?",
+            (status, val_loss, epochs, json.dumps(metrics) if metrics else None, error, time.time(), trial_id)
+        )
+
+    def report(self, trial_id: int, epoch: int, val_loss: float):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO intermediate (trial_id, epoch, val_loss) VALUES (?, ?, ?)",
+            (trial_id, epoch, val_loss)
+        )
+
+    def should_prune(self, trial_id: int, epoch: int, warmup_epochs: int = 2, min_trials: int = 3) -> bool:
+        """Медианное отсечение: лучший val_loss испытания к эпохе epoch хуже
+        медианы лучших val_loss других испытаний, доживших до этой эпохи"""
+        if epoch < warmup_epochs:
+            return False
+        rows = self.connection.execute(
+            "SELECT trial_id, MIN(val_loss) FROM intermediate WHERE epoch <= ? "
+            "GROUP BY trial_id HAVING MAX(epoch) >= ?",
+            (epoch, epoch)
+        ).fetchall()
+        own = [value for trial, value in rows if trial == trial_id]
+        others = [value for trial, value in rows if trial != trial_id]
+        if not own or len(others) < min_trials:
+            return False
+        return own[0] > float(np.median(others))
+
+    def trials(self) -> List[Dict]:
+        rows = self.connection.execute(
+            "SELECT trial_id, status, params, val_loss, epochs, metrics, error, started_at, finished_at "
+            "FROM trials ORDER BY trial_id"
+        ).fetchall()
+        columns = ("trial_id", "status", "params", "val_loss", "epochs", "metrics", "error", "started_at", "finished_at")
+        trials = []
+        for row in rows:
+            trial = dict(zip(columns, row))
+            trial["params"] = json.loads(trial["params"])
+            trial["metrics"] = json.loads(trial["metrics"]) if trial["metrics"] else None
+            trials.append(trial)
+        return trials
+
+    def best_trial(self) -> Optional[Dict]:
+        completed = [t for t in self.trials() if t["status"] == "complete" and t["val_loss"] is not None]
+        return min(completed, key=lambda t: t["val_loss"]) if completed else None
+
+
+def _pruning_callback(store: TrialStore, trial_id: int, warmup_epochs: int, min_trials: int):
+    import tensorflow as tf
+
+    class PruningCallback(tf.keras.callbacks.Callback):
+        """Запись val_loss после каждой эпохи и остановка отсеченного испытания"""
+
+        def __init__(self):
+            super().__init__()
+            self.pruned_at = None
+
+        def on_epoch_end(self, epoch, logs=None):
+            val_loss = (logs or {}).get('val_loss')
+            if val_loss is None or not math.isfinite(val_loss):
+                return
+            store.report(trial_id, epoch, float(val_loss))
+            if store.should_prune(trial_id, epoch, warmup_epochs, min_trials):
+                self.pruned_at = epoch
+                self.model.stop_training = True
+
+    return PruningCallback()
+
+
+def _init_worker(cpu_slots, threads: int):
+    """Бюджет CPU процесса-воркера: свой набор ядер и число потоков TensorFlow"""
+    cores = cpu_slots.get()
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+    logging.basicConfig(level=logging.WARNING)
+
+
+def run_trial(trial_id: int, params: Dict, base_config: Dict, store_path: str,
+              warmup_epochs: int, min_trials: int) -> Dict:
+    """Одно испытание в процессе-воркере"""
+    from model import CVMModel
+    from training import CVMTrainer
+
+    store = TrialStore(store_path)
+    store.start_trial(trial_id)
+    config = {**base_config, **params}
+    save_dir = os.path.join(config['output_dir'], f"trial_{trial_id:04d}")
+    os.makedirs(save_dir, exist_ok=True)
+    try:
+        model = CVMModel(backbone=config['backbone'])
+        model.compile_model(learning_rate=config['learning_rate'])
+        trainer = CVMTrainer(model, config)
+        image_paths, coordinates = trainer.prepare_data(config['data_dir'])
+        train_data, val_data, test_data = trainer.split_data(image_paths, coordinates, seed=config['seed'])
+
+        pruning = _pruning_callback(store, trial_id, warmup_epochs, min_trials)
+        if config['cache_features']:
+            history = trainer.train_cached(train_data, val_data, save_dir, extra_callbacks=[pruning])
+        else:
+            train_dataset, val_dataset, _ = trainer.create_datasets(train_data, val_data, test_data)
+            history = trainer.train(train_dataset, val_dataset, save_dir, extra_callbacks=[pruning])
+
+        val_losses = history.history.get('val_loss', [])
+        best_epoch = int(np.argmin(val_losses)) if val_losses else None
+        metrics = {
+            name: float(values[best_epoch]) for name, values in history.history.items()
+            if best_epoch is not None and len(values) > best_epoch
+        }
+        status = 'pruned' if pruning.pruned_at is not None else 'complete'
+        val_loss = float(val_losses[best_epoch]) if val_losses else None
+        store.finish_trial(trial_id, status, val_loss, len(val_losses), metrics)
+        return {"trial_id": trial_id, "status": status, "val_loss": val_loss}
+    except Exception as e:
+        store.finish_trial(trial_id, 'failed', error=str(e))
+        return {"trial_id": trial_id, "status": "failed", "error": str(e)}
+
+
+def warm_feature_cache(base_config: Dict):
+    """Однократный прогон backbone до запуска испытаний: кэш общий для всех"""
+    from model import CVMModel
+    from training import CVMTrainer
+    from feature_cache import FeatureCache
+    from manifest import find_manifest
+
+    trainer = CVMTrainer(None, base_config)
+    image_paths, coordinates = trainer.prepare_data(base_config['data_dir'])
+    train_data, val_data, _ = trainer.split_data(image_paths, coordinates, seed=base_config['seed'])
+    cache = FeatureCache(base_config['feature_cache_dir'], CVMModel(backbone=base_config['backbone']),
+                         manifest_path=find_manifest(base_config['data_dir']))
+    cache.load_or_build('train', train_data['images'], train_data['coordinates'])
+    cache.load_or_build('val', val_data['images'], val_data['coordinates'])
+
+
+def run_search(base_config: Dict, num_trials: int, store_path: str, space: Dict = None,
+               cpus_per_trial: int = 2, parallel: Optional[int] = None, seed: int = 0,
+               warmup_epochs: int = 2, min_trials: int = 3) -> Optional[Dict]:
+    """Параллельный случайный поиск с медианным отсечением"""
+    space = space or DEFAULT_SPACE
+    total_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    parallel = parallel or max(1, total_cpus // cpus_per_trial)
+    os.makedirs(base_config['output_dir'], exist_ok=True)
+
+    # TensorFlow не переживает fork - воркеры запускаются через spawn
+    context = multiprocessing.get_context("spawn")
+    if base_config['cache_features']:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            pool.submit(warm_feature_cache, base_config).result()
+
+    store = TrialStore(store_path)
+    rng = np.random.default_rng(seed)
+    trials = [(store.create_trial(params), params)
+              for params in (sample_params(space, rng) for _ in range(num_trials))]
+
+    logger.info(f"Running {num_trials} trials, {parallel} in parallel with {cpus_per_trial} CPUs each")
+    with context.Manager() as manager:
+        # Непересекающиеся наборы ядер для воркеров (если ядер хватает)
+        cpu_slots = manager.Queue()
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        for worker in range(parallel):
+            cores = available[worker * cpus_per_trial:(worker + 1) * cpus_per_trial]
+            cpu_slots.put(set(cores) if len(cores) == cpus_per_trial else None)
+
+        with ProcessPoolExecutor(max_workers=parallel, mp_context=context,
+                                 initializer=_init_worker, initargs=(cpu_slots, cpus_per_trial)) as pool:
+            futures = [
+                pool.submit(run_trial, trial_id, params, base_config, store_path, warmup_epochs, min_trials)
+                for trial_id, params in trials
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                logger.info(f"Trial {result['trial_id']}: {result['status']}, val_loss {result.get('val_loss')}")
+
+    best = store.best_trial()
+    if best:
+        logger.info(f"Best trial {best['trial_id']}: val_loss {best['val_loss']:.4f}, params {best['params']}")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter search for CVM-Net")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--output-dir", default="models/hparam_search")
+    parser.add_argument("--store", default=None, help="SQLite results file (default: <output-dir>/trials.db)")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--cpus-per-trial", type=int, default=2)
+    parser.add_argument("--parallel", type=int, default=None, help="Concurrent trials (default: CPUs / cpus-per-trial)")
+    parser.add_argument("--backbone", default="vgg16")
+    parser.add_argument("--no-feature-cache", action="store_true", help="Train full models instead of cached heads")
+    parser.add_argument("--warmup-epochs", type=int, default=2, help="Epochs before a trial can be pruned")
+    parser.add_argument("--min-trials", type=int, default=3, help="Trials at an epoch needed to compare against")
+    parser.add_argument("--space", default=None, help="JSON file with the search space")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    space = None
+    if args.space:
+        with open(args.space) as f:
+            space = {name: tuple(spec) for name, spec in json.load(f).items()}
+
+    base_config = {
+        'data_dir': args.data_dir,
+        'output_dir': args.output_dir,
+        'backbone': args.backbone,
+        'epochs': args.epochs,
+        'batch_size': 32,
+        'learning_rate': 0.001,
+        'patience': 15,
+        'seed': 42,
+        'cache_features': not args.no_feature_cache,
+        'feature_cache_dir': os.path.join(args.output_dir, 'feature_cache'),
+        'verbose': 0
+    }
+    run_search(
+        base_config, args.trials, args.store or os.path.join(args.output_dir, 'trials.db'),
+        space=space,
+        cpus_per_trial=args.cpus_per_trial,
+        parallel=args.parallel,
+        seed=args.seed,
+        warmup_epochs=args.warmup_epochs,
+        min_trials=args.min_trials
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,200 @@
+import os
+import csv
+import json
+import logging
+from typing import Iterator, Optional, Set, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Форматы разметки в порядке поиска в data_dir
+MANIFEST_FILES = ("coordinates.parquet", "coordinates.jsonl", "coordinates.csv", "coordinates.json")
+CHUNK_SIZE = 100000
+
+
+def scan_images(images_dir: str) -> Set[str]:
+    """Относительные пути всех файлов каталога за один рекурсивный обход"""
+    found = set()
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        with os.scandir(os.path.join(images_dir, relative)) as entries:
+            for entry in entries:
+                name = os.path.join(relative, entry.name) if relative else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(name)
+                else:
+                    found.add(name)
+    return found
+
+
+def _chunks(records: Iterator[Tuple[str, float, float]]) -> Iterator[Tuple[list, np.ndarray]]:
+    filenames, coordinates = [], []
+    for filename, lat, lon in records:
+        filenames.append(filename)
+        coordinates.append((lat, lon))
+        if len(filenames) >= CHUNK_SIZE:
+            yield filenames, np.asarray(coordinates, dtype=np.float64)
+            filenames, coordinates = [], []
+    if filenames:
+        yield filenames, np.asarray(coordinates, dtype=np.float64)
+
+
+def iter_manifest_chunks(manifest_path: str) -> Iterator[Tuple[list, np.ndarray]]:
+    """Разметка порциями (имена файлов, координаты N x 2) без чтения файла целиком"""
+    if manifest_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(manifest_path)
+        for batch in parquet.iter_batches(batch_size=CHUNK_SIZE, columns=["filename", "latitude", "longitude"]):
+            columns = batch.to_pydict()
+            coordinates = np.column_stack([
+                np.asarray(columns["latitude"], dtype=np.float64),
+                np.asarray(columns["longitude"], dtype=np.float64)
+            ])
+            yield columns["filename"], coordinates
+    elif manifest_path.endswith(".jsonl"):
+        with open(manifest_path) as f:
+            records = (json.loads(line) for line in f if line.strip())
+            yield from _chunks((r["filename"], r["latitude"], r["longitude"]) for r in records)
+    elif manifest_path.endswith(".csv"):
+        with open(manifest_path, newline="") as f:
+            rows = csv.DictReader(f)
+            yield from _chunks((r["filename"], float(r["latitude"]), float(r["longitude"])) for r in rows)
+    else:
+        # Исходный формат: JSON массив читается целиком
+        with open(manifest_path) as f:
+            items = json.load(f)
+        yield from _chunks((item["filename"], item["latitude"], item["longitude"]) for item in items)
+
+
+def find_manifest(data_dir: str) -> Optional[str]:
+    for name in MANIFEST_FILES:
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class PathArray:
+    """Пути к изображениям: общий каталог и имена файлов в UTF-8 (dtype S)
+
+    Каталог не повторяется в каждой строке, а символ имени занимает байт
+    вместо 4 у dtype str. Индексация числом возвращает полный путь (str),
+    срезом или массивом индексов - PathArray над выбранными именами.
+    """
+
+    def __init__(self, root: str, names: np.ndarray):
+        self.prefix = root.rstrip(os.sep) + os.sep
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.prefix + self.names[item].decode("utf-8")
+        return PathArray(self.prefix, self.names[item])
+
+    def __iter__(self):
+        for name in self.names:
+            yield self.prefix + name.decode("utf-8")
+
+    def __array__(self, dtype=None):
+        values = np.char.add(self.prefix, np.char.decode(self.names, "utf-8"))
+        return values.astype(dtype) if dtype is not None else values
+
+
+def load_manifest(images_dir: str, manifest_path: str) -> Tuple[PathArray, np.ndarray]:
+    """Пути к существующим изображениям (PathArray) и координаты (N x 2, float64)
+
+    Наличие файлов проверяется по одному обходу каталога, а не os.path.exists
+    на каждую запись.
+    """
+    available = scan_images(images_dir)
+    names, coordinates = [], []
+    total = 0
+    for filenames, chunk_coordinates in iter_manifest_chunks(manifest_path):
+        total += len(filenames)
+        keep = np.fromiter((name in available for name in filenames), dtype=bool, count=len(filenames))
+        names.append(np.array([name.encode("utf-8") for name, found in zip(filenames, keep) if found], dtype=bytes))
+        coordinates.append(chunk_coordinates[keep])
+    del available
+
+    if not names:
+        return PathArray(images_dir, np.empty(0, dtype=bytes)), np.empty((0, 2), dtype=np.float64)
+    image_paths = PathArray(images_dir, np.concatenate(names))
+    if total != len(image_paths):
+        logger.warning(f"{total - len(image_paths)} manifest entries have no image file")
+    return image_paths, np.concatenate(coordinates)
+
+
+def as_path_array(image_paths) -> Union[PathArray, np.ndarray]:
+    """PathArray как есть (без развертывания в полные пути), остальное - np.ndarray"""
+    return image_paths if isinstance(image_paths, PathArray) else np.asarray(image_paths)
+
+
+def encoded_paths(image_paths) -> Tuple[str, np.ndarray]:
+    """(общий префикс, имена) для tf.data: каталог присоединяется уже в графе"""
+    if isinstance(image_paths, IndexedView):
+        image_paths = image_paths.array[image_paths.indices]
+    if isinstance(image_paths, PathArray):
+        return image_paths.prefix, image_paths.names
+    return "", np.asarray(image_paths)
+
+
+class IndexedView:
+    """Последовательность элементов array[indices] без копирования array
+
+    Поддерживает len, индексацию, срезы (тоже представления) и np.asarray,
+    поэтому подходит для create_tf_dataset, DataGenerator и FeatureCache.
+    array - np.ndarray или PathArray.
+    """
+
+    def __init__(self, array: np.ndarray, indices: np.ndarray):
+        self.array = array
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return IndexedView(self.array, self.indices[item])
+        return self.array[self.indices[item]]
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.array[index]
+
+    def __array__(self, dtype=None):
+        values = np.asarray(self.array[self.indices])
+        return values.astype(dtype) if dtype is not None else values
+
+
+def split_indices(num_samples: int, train_ratio: float = 0.8, val_ratio: float = 0.1,
+                  seed: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Детерминированное разбиение индексов по seed"""
+    rng = np.random.default_rng(seed) if seed is not None else np.random
+    indices = rng.permutation(num_samples)
+    train_size = int(num_samples * train_ratio)
+    val_size = int(num_samples * val_ratio)
+    return indices[:train_size], indices[train_size:train_size + val_size], indices[train_size + val_size:]
+
+
+def eval_calibration_split(image_paths, coordinates, eval_samples: int,
+                           seed: int = 0) -> Tuple[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+    """Оценочная и калибровочная выборки из разных изображений
+
+    Если изображений не больше eval_samples, калибровка идет на оценочной выборке.
+    """
+    image_paths = as_path_array(image_paths)
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    permutation = np.random.default_rng(seed).permutation(len(image_paths))
+    image_paths, coordinates = image_paths[permutation], coordinates[permutation]
+    evaluation = (image_paths[:eval_samples], coordinates[:eval_samples])
+    calibration = (image_paths[eval_samples:], coordinates[eval_samples:])
+    if len(calibration[0]) == 0:
+        calibration = evaluation
+    return evaluation, calibration
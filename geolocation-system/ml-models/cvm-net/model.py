@@ -1,7 +1,6 @@
 import tensorflow as tf
 import numpy as np
-from tensorflow.keras.applications import VGG16
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, Rescaling
 from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
@@ -9,40 +8,126 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Выход замороженной части модели, после него начинается обучаемая голова
+POOLING_LAYER = 'global_pool'
+HEAD_LAYERS = ('fc1', 'dropout1', 'fc2', 'dropout2', 'coordinates')
+
+# Backbone: класс из tf.keras.applications, предобработка входа и
+# ориентировочная стоимость прямого прохода для 224x224.
+# На вход модели всегда подаются изображения RGB в [0, 1] (ImagePreprocessor,
+# create_tf_dataset), приведение к ожидаемому backbone диапазону встроено
+# в граф модели: 'scale' - умножение на 255 (нормализация внутри самих
+# MobileNetV3 и EfficientNet), 'caffe' - BGR с вычитанием среднего ImageNet.
+# VGG16 оставлен без предобработки: с ним обучены существующие веса.
+BACKBONES = {
+    'vgg16': {'application': 'VGG16', 'preprocessing': None, 'gflops': 15.5},
+    'resnet50': {'application': 'ResNet50', 'preprocessing': 'caffe', 'gflops': 4.1},
+    'efficientnet_b0': {'application': 'EfficientNetB0', 'preprocessing': 'scale', 'gflops': 0.39},
+    'mobilenet_v3_large': {'application': 'MobileNetV3Large', 'preprocessing': 'scale', 'gflops': 0.22},
+    'mobilenet_v3_small': {'application': 'MobileNetV3Small', 'preprocessing': 'scale', 'gflops': 0.06},
+}
+DEFAULT_BACKBONE = 'vgg16'
+
 class CVMModel:
-    def __init__(self, input_shape=(224, 224, 3)):
+    def __init__(self, input_shape=(224, 224, 3), mode='regression', embedding_dim=512, weights='imagenet',
+                 backbone=DEFAULT_BACKBONE):
+        """mode='regression' - координаты, mode='descriptor' - L2-нормированный дескриптор
+        
+        weights=None не скачивает ImageNet веса backbone: используется, когда
+        следом загружаются сохраненные веса всей модели (load_weights).
+        backbone - ключ BACKBONES.
+        """
+        if mode not in ('regression', 'descriptor'):
+            raise ValueError(f"Unknown model mode: {mode}")
+        if backbone not in BACKBONES:
+            raise ValueError(f"Unknown backbone: {backbone}, expected one of {sorted(BACKBONES)}")
         self.input_shape = input_shape
+        self.backbone = backbone
+        self.mode = mode
+        self.embedding_dim = embedding_dim
+        self.weights = weights
         self.model = self.build_model()
+        self._serving_fn = None
     
-    def build_model(self):
-        """Построение CVM-Net модели"""
-        # Базовый VGG16
-        base_model = VGG16(
-            weights='imagenet',
+    def build_backbone(self):
+        """Вход модели и карта признаков замороженного backbone"""
+        spec = BACKBONES[self.backbone]
+        application = getattr(tf.keras.applications, spec['application'])
+        
+        input_tensor = None
+        if spec['preprocessing']:
+            inputs = tf.keras.Input(shape=self.input_shape, name='image')
+            x = Rescaling(255.0, name='input_scale')(inputs)
+            if spec['preprocessing'] == 'caffe':
+                x = tf.keras.layers.Lambda(
+                    tf.keras.applications.imagenet_utils.preprocess_input, name='input_caffe'
+                )(x)
+            input_tensor = x
+        
+        base_model = application(
+            weights=self.weights,
             include_top=False,
-            input_shape=self.input_shape
+            input_shape=self.input_shape,
+            input_tensor=input_tensor
         )
         
         # Заморозка базовых слоев
         for layer in base_model.layers:
             layer.trainable = False
         
-        # Добавление NetVLAD слоя
-        x = base_model.output
-        x = GlobalAveragePooling2D()(x)
+        if input_tensor is None:
+            inputs = base_model.input
+        return inputs, base_model.output
+    
+    def build_model(self):
+        """Построение CVM-Net модели"""
+        inputs, features = self.build_backbone()
+        
+        if self.mode == 'descriptor':
+            return self.build_descriptor(inputs, features)
+        
+        x = features
+        x = GlobalAveragePooling2D(name=POOLING_LAYER)(x)
         
         # Полносвязные слои для регрессии координат
         x = Dense(512, activation='relu', name='fc1')(x)
-        x = Dropout(0.5)(x)
+        x = Dropout(0.5, name='dropout1')(x)
         x = Dense(256, activation='relu', name='fc2')(x)
-        x = Dropout(0.3)(x)
+        x = Dropout(0.3, name='dropout2')(x)
         coordinates = Dense(2, activation='linear', name='coordinates')(x)
         
         # Создание модели
-        model = Model(inputs=base_model.input, outputs=coordinates)
+        model = Model(inputs=inputs, outputs=coordinates)
         
         return model
     
+    def build_descriptor(self, inputs, features):
+        """Дескриптор для поиска по базе геопривязанных тайлов"""
+        x = NetVLAD(num_clusters=64, feature_dim=features.shape[-1], name='netvlad')(features)
+        x = Dense(self.embedding_dim, name='descriptor_fc')(x)
+        descriptor = tf.keras.layers.Lambda(
+            lambda v: tf.math.l2_normalize(v, axis=-1), name='descriptor'
+        )(x)
+        return Model(inputs=inputs, outputs=descriptor)
+    
+    def embed(self, images: np.ndarray) -> np.ndarray:
+        """L2-нормированные дескрипторы изображений"""
+        if self.mode != 'descriptor':
+            raise ValueError("Embeddings are only available in descriptor mode")
+        return self.predict_batch(images)
+    
+    def feature_extractor(self) -> Model:
+        """Замороженная часть модели: изображение -> вектор признаков"""
+        return Model(inputs=self.model.input, outputs=self.model.get_layer(POOLING_LAYER).output)
+    
+    def head_model(self) -> Model:
+        """Голова регрессии поверх признаков, слои общие с полной моделью"""
+        features = tf.keras.Input(shape=self.model.get_layer(POOLING_LAYER).output_shape[1:], name='features')
+        x = features
+        for name in HEAD_LAYERS:
+            x = self.model.get_layer(name)(x)
+        return Model(inputs=features, outputs=x)
+    
     def compile_model(self, learning_rate=0.001):
         """Компиляция модели"""
         self.model.compile(
@@ -78,6 +163,23 @@ class CVMModel:
         prediction = self.model.predict(image)
         return prediction
     
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        """Предсказание координат для батча одним прямым проходом
+        
+        В отличие от model.predict не создает на каждый вызов итератор
+        данных и callbacks, граф трассируется один раз для любого размера батча.
+        """
+        if self._serving_fn is None:
+            signature = [tf.TensorSpec(shape=(None, *self.input_shape), dtype=tf.float32)]
+            self._serving_fn = tf.function(
+                lambda x: self.model(x, training=False),
+                input_signature=signature
+            )
+        images = np.asarray(images, dtype=np.float32)
+        if images.ndim == 3:
+            images = np.expand_dims(images, axis=0)
+        return self._serving_fn(tf.constant(images)).numpy()
+    
     def train(self, train_data, val_data, epochs=100, batch_size=32):
         """Обучение модели"""
         callbacks = [
@@ -110,7 +212,7 @@ class CVMModel:
         return self.model.summary()
     
     def freeze_base_layers(self):
-        """Заморозка базовых слоев VGG16"""
+        """Заморозка базовых слоев backbone"""
         for layer in self.model.layers[:-4]:  # Замораживаем все кроме последних 4 слоев
             layer.trainable = False
         logger.info("Base layers frozen")
@@ -121,21 +223,51 @@ class CVMModel:
             layer.trainable = True
         logger.info("Base layers unfrozen for fine-tuning")
 
-class NetVLAD:
-    """NetVLAD слой для агрегации признаков"""
-    def __init__(self, num_clusters=64, feature_dim=512):
+class NetVLAD(tf.keras.layers.Layer):
+    """NetVLAD слой для агрегации признаков
+    
+    Мягкое назначение локальных признаков карты (H x W x D) кластерам
+    и сумма остатков относительно центров, с внутрикластерной и общей
+    L2-нормализацией. Выход - вектор размера num_clusters * feature_dim.
+    """
+    def __init__(self, num_clusters=64, feature_dim=512, **kwargs):
+        super().__init__(**kwargs)
         self.num_clusters = num_clusters
         self.feature_dim = feature_dim
     
-    def __call__(self, features):
+    def build(self, input_shape):
+        self.assignment = tf.keras.layers.Conv2D(self.num_clusters, 1, use_bias=True, name='assignment')
+        self.assignment.build(input_shape)
+        self.centroids = self.add_weight(
+            name='centroids',
+            shape=(self.num_clusters, self.feature_dim),
+            initializer='glorot_uniform',
+            trainable=True
+        )
+        super().build(input_shape)
+    
+    def call(self, features):
         """Применение NetVLAD к признакам"""
-        # Упрощенная реализация NetVLAD
-        # В реальной реализации здесь была бы более сложная логика
-        return tf.reduce_mean(features, axis=1)
+        soft_assignment = tf.nn.softmax(self.assignment(features), axis=-1)
+        local = tf.reshape(features, (-1, tf.shape(features)[1] * tf.shape(features)[2], self.feature_dim))
+        soft_assignment = tf.reshape(soft_assignment, (-1, tf.shape(local)[1], self.num_clusters))
+        
+        # sum_i a_ik * (x_i - c_k) = sum_i a_ik * x_i - c_k * sum_i a_ik
+        vlad = tf.matmul(soft_assignment, local, transpose_a=True)
+        vlad -= tf.expand_dims(tf.reduce_sum(soft_assignment, axis=1), -1) * self.centroids
+        
+        vlad = tf.math.l2_normalize(vlad, axis=-1)
+        vlad = tf.reshape(vlad, (-1, self.num_clusters * self.feature_dim))
+        return tf.math.l2_normalize(vlad, axis=-1)
+    
+    def get_config(self):
+        config = super().get_config()
+        config.update({'num_clusters': self.num_clusters, 'feature_dim': self.feature_dim})
+        return config
 
-def create_cvm_model(input_shape=(224, 224, 3)):
+def create_cvm_model(input_shape=(224, 224, 3), backbone=DEFAULT_BACKBONE):
     """Фабричная функция для создания CVM модели"""
-    model = CVMModel(input_shape)
+    model = CVMModel(input_shape, backbone=backbone)
     model.compile_model()
     return model
 
@@ -1,12 +1,23 @@
 import cv2
 import numpy as np
 from PIL import Image
-import tensorflow as tf
-from typing import Tuple, List
+from typing import TYPE_CHECKING, Iterator, Tuple, List, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import logging
+import os
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+# TensorFlow импортируется только в функциях tf.data: сервисы используют
+# ImagePreprocessor (OpenCV и NumPy) без загрузки TensorFlow
 
 logger = logging.getLogger(__name__)
 
+AUGMENTATION_VARIANTS = 4
+
 class ImagePreprocessor:
     def __init__(self, target_size: Tuple[int, int] = (224, 224)):
         self.target_size = target_size
@@ -59,21 +70,22 @@ class ImagePreprocessor:
     
     def augment_image(self, image: np.ndarray) -> List[np.ndarray]:
         """Аугментация изображения"""
-        augmented_images = [image]
-        
-        # Горизонтальное отражение
-        flipped = cv2.flip(image, 1)
-        augmented_images.append(flipped)
-        
-        # Поворот на 90 градусов
-        rotated = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-        augmented_images.append(rotated)
-        
-        # Поворот на 180 градусов
-        rotated180 = cv2.rotate(image, cv2.ROTATE_180)
-        augmented_images.append(rotated180)
-        
-        return augmented_images
+        return [self.augment_variant(image, variant) for variant in range(AUGMENTATION_VARIANTS)]
+    
+    def augment_variant(self, image: np.ndarray, variant: int) -> np.ndarray:
+        """Один вариант аугментации: 0 - исходное, 1 - отражение, 2 - поворот на 90, 3 - на 180"""
+        if variant == 0:
+            return image
+        if variant == 1:
+            # Горизонтальное отражение
+            return cv2.flip(image, 1)
+        if variant == 2:
+            # Поворот на 90 градусов
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+        if variant == 3:
+            # Поворот на 180 градусов
+            return cv2.rotate(image, cv2.ROTATE_180)
+        raise ValueError(f"Unknown augmentation variant: {variant}")
     
     def normalize_coordinates(self, lat: float, lon: float) -> Tuple[float, float]:
         """Нормализация координат для обучения"""
@@ -89,85 +101,244 @@ class ImagePreprocessor:
         return lat, lon
 
 class DataGenerator:
+    """Параллельный источник батчей с предвыделенными буферами
+    
+    Изображения декодируются пулом потоков (OpenCV отпускает GIL) прямо
+    в заранее выделенные буферы батчей; при shuffle=True порядок примеров
+    перемешивается каждую эпоху. При augment=True датасет расширяется виртуально: пример
+    с номером i соответствует изображению i // augmentation_factor и
+    варианту аугментации i % augmentation_factor, который применяется
+    при загрузке батча (augmentation_factor ограничен числом вариантов
+    AUGMENTATION_VARIANTS). Память не зависит от размера датасета.
+    
+    Возвращаемые массивы - представления кольца из num_buffers буферов и
+    остаются валидными, пока не загружено еще num_buffers - 1 батчей.
+    """
     def __init__(self, image_paths: List[str], coordinates: List[Tuple[float, float]], 
-                 batch_size: int = 32, preprocessor: ImagePreprocessor = None):
+                 batch_size: int = 32, preprocessor: ImagePreprocessor = None,
+                 shuffle: bool = False, augment: bool = False, augmentation_factor: int = AUGMENTATION_VARIANTS,
+                 num_workers: int = 8, prefetch_batches: int = 2, seed: Optional[int] = None):
         self.image_paths = image_paths
         self.coordinates = coordinates
         self.batch_size = batch_size
         self.preprocessor = preprocessor or ImagePreprocessor()
         self.num_samples = len(image_paths)
+        self.shuffle = shuffle
+        self.augmentation_factor = max(1, min(augmentation_factor, AUGMENTATION_VARIANTS)) if augment else 1
+        self.prefetch_batches = prefetch_batches
+        self.rng = np.random.default_rng(seed)
+        
+        self.num_items = self.num_samples * self.augmentation_factor
+        self.indices = np.arange(self.num_items)
+        if self.shuffle:
+            self.rng.shuffle(self.indices)
+        
+        # Нормализованные координаты считаются один раз
+        self.targets = np.array(
+            [self.preprocessor.normalize_coordinates(lat, lon) for lat, lon in coordinates],
+            dtype=np.float32
+        ).reshape(-1, 2)
+        
+        height, width = self.preprocessor.target_size[1], self.preprocessor.target_size[0]
+        self.num_buffers = prefetch_batches + 2
+        self._image_buffers = np.empty((self.num_buffers, batch_size, height, width, 3), dtype=np.float32)
+        self._target_buffers = np.empty((self.num_buffers, batch_size, 2), dtype=np.float32)
+        self._next_buffer = 0
+        self._buffer_lock = threading.Lock()
+        
+        self._workers = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="data-worker")
+        self._batches = ThreadPoolExecutor(max_workers=max(1, prefetch_batches), thread_name_prefix="data-batch")
     
     def __len__(self):
-        return int(np.ceil(self.num_samples / self.batch_size))
+        return int(np.ceil(self.num_items / self.batch_size))
+    
+    def on_epoch_end(self):
+        """Перемешивание порядка примеров перед новой эпохой"""
+        if self.shuffle:
+            self.rng.shuffle(self.indices)
+    
+    def _acquire_buffer(self) -> int:
+        with self._buffer_lock:
+            slot = self._next_buffer
+            self._next_buffer = (slot + 1) % self.num_buffers
+            return slot
+    
+    def _load_item(self, slot: int, row: int, item: int) -> bool:
+        sample, variant = divmod(item, self.augmentation_factor)
+        try:
+            image = self.preprocessor.preprocess_image(self.image_paths[sample])
+            self._image_buffers[slot, row] = self.preprocessor.augment_variant(image, variant)
+        except Exception as e:
+            logger.warning(f"Error processing image {sample}: {e}")
+            return False
+        self._target_buffers[slot, row] = self.targets[sample]
+        return True
     
     def __getitem__(self, idx):
         """Получение батча данных"""
-        start_idx = idx * self.batch_size
-        end_idx = min(start_idx + self.batch_size, self.num_samples)
+        items = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
+        slot = self._acquire_buffer()
+        loaded = list(self._workers.map(
+            lambda args: self._load_item(slot, *args), enumerate(items)
+        ))
         
-        batch_images = []
-        batch_coordinates = []
+        images = self._image_buffers[slot]
+        targets = self._target_buffers[slot]
+        if all(loaded):
+            return images[:len(items)], targets[:len(items)]
         
-        for i in range(start_idx, end_idx):
-            try:
-                # Предобработка изображения
-                image = self.preprocessor.preprocess_image(self.image_paths[i])
-                batch_images.append(image)
-                
-                # Нормализация координат
-                lat, lon = self.coordinates[i]
-                norm_lat, norm_lon = self.preprocessor.normalize_coordinates(lat, lon)
-                batch_coordinates.append([norm_lat, norm_lon])
-                
-            except Exception as e:
-                logger.warning(f"Error processing image {i}: {e}")
-                continue
+        # Сдвиг успешно загруженных примеров к началу буфера
+        valid = np.flatnonzero(loaded)
+        images[:len(valid)] = images[valid]
+        targets[:len(valid)] = targets[valid]
+        return images[:len(valid)], targets[:len(valid)]
+    
+    def __iter__(self):
+        """Одна эпоха с загрузкой следующих батчей в фоне"""
+        pending = deque()
+        next_batch = 0
+        for _ in range(len(self)):
+            while next_batch < len(self) and len(pending) <= self.prefetch_batches:
+                pending.append(self._batches.submit(self.__getitem__, next_batch))
+                next_batch += 1
+            yield pending.popleft().result()
+        self.on_epoch_end()
+    
+    def as_dataset(self) -> "tf.data.Dataset":
+        """tf.data.Dataset поверх генератора (эпоха на каждый проход)"""
+        import tensorflow as tf
         
-        return np.array(batch_images), np.array(batch_coordinates)
+        height, width = self.preprocessor.target_size[1], self.preprocessor.target_size[0]
+        return tf.data.Dataset.from_generator(
+            lambda: iter(self),
+            output_signature=(
+                tf.TensorSpec(shape=(None, height, width, 3), dtype=tf.float32),
+                tf.TensorSpec(shape=(None, 2), dtype=tf.float32)
+            )
+        )
     
-    def get_augmented_data(self, augmentation_factor: int = 4):
-        """Получение аугментированных данных"""
+    def get_augmented_data(self, augmentation_factor: int = AUGMENTATION_VARIANTS) -> Tuple[List[np.ndarray], List]:
+        """Получение аугментированных данных (списки изображений и координат)
+        
+        Весь набор держится в памяти, для больших датасетов - iter_augmented_data.
+        """
         augmented_images = []
         augmented_coordinates = []
-        
+        for image, coordinates in self.iter_augmented_data(augmentation_factor):
+            augmented_images.append(image)
+            augmented_coordinates.append(coordinates)
+        return augmented_images, augmented_coordinates
+    
+    def iter_augmented_data(self, augmentation_factor: int = AUGMENTATION_VARIANTS) -> Iterator[Tuple[np.ndarray, Tuple[float, float]]]:
+        """Аугментированные примеры по одному, без материализации всего набора"""
         for i in range(len(self.image_paths)):
             try:
                 image = self.preprocessor.preprocess_image(self.image_paths[i])
-                augmented = self.preprocessor.augment_image(image)
-                
-                for aug_image in augmented[:augmentation_factor]:
-                    augmented_images.append(aug_image)
-                    augmented_coordinates.append(self.coordinates[i])
-                    
             except Exception as e:
                 logger.warning(f"Error augmenting image {i}: {e}")
                 continue
-        
-        return augmented_images, augmented_coordinates
+            # Как и раньше, копий не больше, чем вариантов аугментации
+            for variant in range(min(augmentation_factor, AUGMENTATION_VARIANTS)):
+                yield self.preprocessor.augment_variant(image, variant), self.coordinates[i]
+    
+    def close(self):
+        self._workers.shutdown(wait=True)
+        self._batches.shutdown(wait=True)
+
+def load_image(image_path: "tf.Tensor") -> "tf.Tensor":
+    """Загрузка и предобработка изображения в графе tf.data"""
+    import tensorflow as tf
+    
+    image = tf.io.read_file(image_path)
+    image = tf.image.decode_jpeg(image, channels=3)
+    image = tf.image.resize(image, [224, 224])
+    image = tf.cast(image, tf.float32) / 255.0
+    return image
 
 def create_tf_dataset(image_paths: List[str], coordinates: List[Tuple[float, float]], 
-                     batch_size: int = 32) -> tf.data.Dataset:
+                     batch_size: int = 32, shuffle: bool = False,
+                     seed: Optional[int] = None) -> "tf.data.Dataset":
     """Создание TensorFlow Dataset"""
-    def load_and_preprocess(image_path, lat, lon):
-        # Загрузка и предобработка изображения
-        image = tf.io.read_file(image_path)
-        image = tf.image.decode_jpeg(image, channels=3)
-        image = tf.image.resize(image, [224, 224])
-        image = tf.cast(image, tf.float32) / 255.0
+    import tensorflow as tf
+    
+    from manifest import encoded_paths
+    
+    # Пути PathArray: каталог присоединяется к имени файла в графе
+    prefix, names = encoded_paths(image_paths)
+    
+    def load_and_preprocess(image_path, coords):
+        image = load_image(tf.strings.join([prefix, image_path]) if prefix else image_path)
         
         # Нормализация координат
-        norm_lat = (lat - 90.0) / 90.0
-        norm_lon = (lon - 180.0) / 180.0
+        norm_lat = (coords[0] - 90.0) / 90.0
+        norm_lon = (coords[1] - 180.0) / 180.0
         
-        return image, [norm_lat, norm_lon]
+        return image, tf.stack([norm_lat, norm_lon])
     
-    dataset = tf.data.Dataset.from_tensor_slices((image_paths, coordinates))
+    dataset = tf.data.Dataset.from_tensor_slices(
+        (names, np.asarray(coordinates, dtype=np.float32))
+    )
+    if shuffle:
+        # Перемешиваются пути, до декодирования - буфер на весь датасет дешев
+        dataset = dataset.shuffle(len(image_paths), seed=seed, reshuffle_each_iteration=True)
     dataset = dataset.map(load_and_preprocess, num_parallel_calls=tf.data.AUTOTUNE)
     dataset = dataset.batch(batch_size)
     dataset = dataset.prefetch(tf.data.AUTOTUNE)
     
     return dataset
 
+def create_sharded_dataset(shards_dir: str, split: str, batch_size: int = 32,
+                           shuffle: bool = False, shuffle_buffer: int = 4096,
+                           cache: Optional[str] = None, snapshot_dir: Optional[str] = None,
+                           seed: Optional[int] = None,
+                           image_size: Tuple[int, int] = (224, 224)) -> "tf.data.Dataset":
+    """Dataset из TFRecord шардов dataset_builder.py
+    
+    Шарды читаются параллельно с чередованием (interleave), изображения уже
+    декодированы и уменьшены. cache="memory" - кэш в памяти, cache=<путь> -
+    кэш в файле, snapshot_dir - снимок tf.data, переиспользуемый между
+    запусками обучения.
+    """
+    import tensorflow as tf
+    
+    pattern = os.path.join(shards_dir, f"{split}-*.tfrecord")
+    height, width = image_size
+    feature_spec = {
+        "image": tf.io.FixedLenFeature([], tf.string),
+        "coordinates": tf.io.FixedLenFeature([2], tf.float32),
+    }
+    
+    def parse(record):
+        example = tf.io.parse_single_example(record, feature_spec)
+        image = tf.reshape(tf.io.decode_raw(example["image"], tf.uint8), [height, width, 3])
+        return image, example["coordinates"]
+    
+    files = tf.data.Dataset.list_files(pattern, shuffle=shuffle, seed=seed)
+    dataset = files.interleave(
+        lambda path: tf.data.TFRecordDataset(path, buffer_size=8 * 1024 * 1024),
+        cycle_length=tf.data.AUTOTUNE,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle
+    )
+    dataset = dataset.map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+    
+    # Кэшируются uint8 изображения: в 4 раза компактнее float32
+    if snapshot_dir:
+        dataset = dataset.snapshot(snapshot_dir)
+    if cache == "memory":
+        dataset = dataset.cache()
+    elif cache:
+        dataset = dataset.cache(cache)
+    
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(
+        lambda images, targets: (tf.cast(images, tf.float32) / 255.0, targets),
+        num_parallel_calls=tf.data.AUTOTUNE
+    )
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
 if __name__ == "__main__":
     # Тестирование предобработки
     preprocessor = ImagePreprocessor()
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+
+from distributed import ThroughputCallback, is_chief
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = "training_profile.json"
+# Доля ожидания данных, начиная с которой эпоха считается упертой во ввод
+INPUT_BOUND_THRESHOLD = 0.2
+
+
+def benchmark_input_pipeline(dataset: tf.data.Dataset, steps: int = 50, warmup: int = 5) -> Dict:
+    """Скорость входного конвейера без модели: батчей и примеров в секунду"""
+    iterator = iter(dataset)
+    for _ in range(warmup):
+        next(iterator)
+    samples = 0
+    started = time.perf_counter()
+    for _ in range(steps):
+        images, _ = next(iterator)
+        samples += int(images.shape[0])
+    elapsed = time.perf_counter() - started
+    return {
+        "steps": steps,
+        "seconds_per_step": elapsed / steps,
+        "samples_per_second": samples / elapsed,
+    }
+
+
+def benchmark_compute(model: tf.keras.Model, dataset: tf.data.Dataset,
+                      steps: int = 20, warmup: int = 3) -> Dict:
+    """Время шага обучения без ввода: прямой и обратный проход по одному батчу из памяти
+
+    Веса не обновляются, поэтому замер можно делать перед обучением.
+    """
+    images, targets = next(iter(dataset))
+
+    @tf.function
+    def step(x, y):
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_mean(tf.square(y - model(x, training=True)))
+        return tape.gradient(loss, model.trainable_variables)
+
+    for _ in range(warmup):
+        tf.nest.map_structure(lambda g: g.numpy() if g is not None else None, step(images, targets))
+    started = time.perf_counter()
+    for _ in range(steps):
+        gradients = step(images, targets)
+    # Синхронизация с последним шагом
+    tf.nest.map_structure(lambda g: g.numpy() if g is not None else None, gradients)
+    elapsed = time.perf_counter() - started
+    return {
+        "steps": steps,
+        "batch_size": int(images.shape[0]),
+        "seconds_per_step": elapsed / steps,
+        "samples_per_second": steps * int(images.shape[0]) / elapsed,
+    }
+
+
+class TrainingProfiler(ThroughputCallback):
+    """Профилирование обучения: скорость шагов и ожидание входного конвейера
+
+    Время шага считается от on_train_batch_begin до on_train_batch_end и
+    включает получение батча из tf.data. Ожидание данных в шаге - превышение
+    над временем чистого вычисления (compute_step_seconds из benchmark_compute,
+    иначе 10-й перцентиль времени шага, когда данные уже готовы).
+    trace_steps=(start, stop) включает трассировку профайлера TensorFlow
+    для глобальных шагов [start, stop) в trace_dir.
+    """
+
+    def __init__(self, global_batch_size: int, save_dir: Optional[str] = None,
+                 compute_step_seconds: Optional[float] = None,
+                 trace_steps: Optional[Sequence[int]] = None, trace_dir: Optional[str] = None,
+                 benchmarks: Optional[Dict] = None):
+        super().__init__(global_batch_size, save_dir)
+        self.compute_step_seconds = compute_step_seconds
+        self.trace_steps = tuple(trace_steps) if trace_steps else None
+        self.trace_dir = trace_dir or (os.path.join(save_dir, "profile") if save_dir else None)
+        self.benchmarks = benchmarks or {}
+        self._step_times: List[np.ndarray] = []
+        self._current: List[float] = []
+        self._batch_start = None
+        self._train_end = None
+        self._global_step = 0
+        self._tracing = False
+
+    def on_epoch_begin(self, epoch, logs=None):
+        super().on_epoch_begin(epoch, logs)
+        self._current = []
+        self._train_end = self._epoch_start
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and self._global_step == self.trace_steps[0] and not self._tracing:
+            tf.profiler.experimental.start(self.trace_dir)
+            self._tracing = True
+            logger.info(f"Profiler trace started at step {self._global_step}")
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        super().on_train_batch_end(batch, logs)
+        self._train_end = time.perf_counter()
+        self._current.append(self._train_end - self._batch_start)
+        self._global_step += 1
+        if self._tracing and self._global_step >= self.trace_steps[1]:
+            self._stop_trace()
+
+    def on_epoch_end(self, epoch, logs=None):
+        super().on_epoch_end(epoch, logs)
+        self._step_times.append(np.asarray(self._current))
+        # Без валидации и колбэков конца эпохи
+        self.epochs[-1]["train_seconds"] = self._train_end - self._epoch_start
+
+    def _stop_trace(self):
+        tf.profiler.experimental.stop()
+        self._tracing = False
+        logger.info(f"Profiler trace saved to {self.trace_dir}")
+
+    def _compute_estimate(self) -> float:
+        if self.compute_step_seconds:
+            return self.compute_step_seconds
+        measured = self._step_times[1:] or self._step_times
+        times = np.concatenate(measured) if measured else np.zeros(0)
+        return float(np.percentile(times, 10)) if len(times) else 0.0
+
+    def profile(self) -> Dict:
+        compute_step = self._compute_estimate()
+        epochs = []
+        for epoch, times in zip(self.epochs, self._step_times):
+            steps = len(times)
+            if not steps:
+                continue
+            wait = np.clip(times - compute_step, 0.0, None)
+            step_seconds = float(times.sum())
+            train_seconds = epoch.get("train_seconds", epoch["seconds"])
+            epochs.append({
+                "epoch": epoch["epoch"],
+                "steps": steps,
+                "train_seconds": train_seconds,
+                "steps_per_second": steps / train_seconds if train_seconds else 0.0,
+                "samples_per_second": steps * self.global_batch_size / train_seconds if train_seconds else 0.0,
+                "step_ms": {
+                    "p50": float(np.percentile(times, 50)) * 1000,
+                    "p95": float(np.percentile(times, 95)) * 1000,
+                    "max": float(times.max()) * 1000,
+                },
+                "input_wait_seconds": float(wait.sum()),
+                "compute_seconds": step_seconds - float(wait.sum()),
+                # Время между шагами: колбэки и накладные расходы Keras
+                "overhead_seconds": max(0.0, train_seconds - step_seconds),
+                "input_wait_fraction": float(wait.sum()) / train_seconds if train_seconds else 0.0,
+            })
+
+        # Первая эпоха включает трассировку графа и заполнение буферов
+        measured = epochs[1:] or epochs
+        train_seconds = sum(epoch["train_seconds"] for epoch in measured)
+        input_wait = sum(epoch["input_wait_seconds"] for epoch in measured)
+        fraction = input_wait / train_seconds if train_seconds else 0.0
+        steps_per_second = sum(epoch["steps"] for epoch in measured) / train_seconds if train_seconds else 0.0
+        return {
+            "global_batch_size": self.global_batch_size,
+            "compute_step_ms": compute_step * 1000,
+            "compute_step_source": "benchmark" if self.compute_step_seconds else "p10_step_time",
+            "steps_per_second": steps_per_second,
+            "samples_per_second": steps_per_second * self.global_batch_size,
+            "input_wait_fraction": fraction,
+            "bottleneck": "input" if fraction >= INPUT_BOUND_THRESHOLD else "compute",
+            "benchmarks": self.benchmarks,
+            "trace_dir": self.trace_dir if self.trace_steps else None,
+            "epochs": epochs,
+        }
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            self._stop_trace()
+        super().on_train_end(logs)
+        if not (self.save_dir and is_chief()):
+            return
+        report = self.profile()
+        with open(os.path.join(self.save_dir, PROFILE_FILE), "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(
+            f"Training profile: {report['steps_per_second']:.2f} steps/s, "
+            f"{report['samples_per_second']:.1f} samples/s, "
+            f"input wait {report['input_wait_fraction']:.0%} ({report['bottleneck']}-bound)"
+        )
@@ -0,0 +1,433 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PQ_CENTROIDS = 256  # коды PQ хранятся в uint8
+
+
+def _squared_distances(x: np.ndarray, centroids: np.ndarray,
+                       centroid_norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """Квадраты L2 расстояний от строк x до центров"""
+    if centroid_norms is None:
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    return np.einsum("ij,ij->i", x, x)[:, None] - 2.0 * x @ centroids.T + centroid_norms[None, :]
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+    """Ближайший центр для каждой строки (блоками, чтобы ограничить память)"""
+    norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), chunk_size):
+        block = x[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmin(_squared_distances(block, centroids, norms), axis=1)
+    return labels
+
+
+def kmeans(x: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Алгоритм Ллойда с k-means++ инициализацией по подвыборке"""
+    rng = np.random.default_rng(seed)
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    if len(x) < k:
+        raise ValueError(f"Need at least {k} training vectors, got {len(x)}")
+
+    # k-means++ на ограниченной подвыборке
+    seed_pool = x[rng.choice(len(x), size=min(len(x), 20 * k), replace=False)]
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = seed_pool[rng.integers(len(seed_pool))]
+    closest = _squared_distances(seed_pool, centroids[:1])[:, 0]
+    for i in range(1, k):
+        probabilities = np.maximum(closest, 0)
+        total = probabilities.sum()
+        index = rng.choice(len(seed_pool), p=probabilities / total) if total > 0 else rng.integers(len(seed_pool))
+        centroids[i] = seed_pool[index]
+        closest = np.minimum(closest, _squared_distances(seed_pool, centroids[i:i + 1])[:, 0])
+
+    for _ in range(iterations):
+        labels = assign(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # Пустые кластеры переносим в случайные точки
+            centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFPQQuantizer:
+    """Грубый квантователь (IVF) + произведение квантователей остатков (PQ)"""
+
+    def __init__(self, coarse: np.ndarray, codebooks: np.ndarray):
+        self.coarse = coarse.astype(np.float32)
+        self.codebooks = codebooks.astype(np.float32)  # (m, 256, dsub)
+        self.nlist = len(coarse)
+        self.m, _, self.dsub = codebooks.shape
+        self.dim = self.m * self.dsub
+        self._codebook_norms = np.einsum("mkd,mkd->mk", self.codebooks, self.codebooks)
+
+    @classmethod
+    def train(cls, sample: np.ndarray, nlist: int, m: int,
+              iterations: int = 20, seed: int = 0) -> "IVFPQQuantizer":
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        dim = sample.shape[1]
+        if dim % m:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by m={m}")
+        logger.info(f"Training coarse quantizer: {nlist} lists on {len(sample)} vectors")
+        coarse = kmeans(sample, nlist, iterations, seed)
+        residuals = sample - coarse[assign(sample, coarse)]
+        dsub = dim // m
+        codebooks = np.empty((m, PQ_CENTROIDS, dsub), dtype=np.float32)
+        logger.info(f"Training product quantizer: {m} x {PQ_CENTROIDS} codewords")
+        for j in range(m):
+            codebooks[j] = kmeans(residuals[:, j * dsub:(j + 1) * dsub], PQ_CENTROIDS, iterations, seed + j + 1)
+        return cls(coarse, codebooks)
+
+    def encode(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Номер списка и PQ-коды остатков"""
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        lists = assign(x, self.coarse)
+        residuals = x - self.coarse[lists]
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign(residuals[:, j * self.dsub:(j + 1) * self.dsub], self.codebooks[j])
+        return lists, codes
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        distances = _squared_distances(query[None, :], self.coarse)[0]
+        nprobe = min(nprobe, self.nlist)
+        return np.argpartition(distances, nprobe - 1)[:nprobe]
+
+    def lookup_tables(self, query: np.ndarray, lists: np.ndarray) -> np.ndarray:
+        """Таблицы расстояний ||(q - c_l)_j - codeword_jk||^2, форма (nprobe, m * 256)"""
+        residuals = (query[None, :] - self.coarse[lists]).reshape(len(lists), self.m, self.dsub)
+        tables = (
+            np.einsum("pmd,pmd->pm", residuals, residuals)[:, :, None]
+            - 2.0 * np.einsum("pmd,mkd->pmk", residuals, self.codebooks)
+            + self._codebook_norms[None, :, :]
+        )
+        return tables.reshape(len(lists), self.m * PQ_CENTROIDS)
+
+    def save(self, index_dir: str):
+        np.save(os.path.join(index_dir, "coarse.npy"), self.coarse)
+        np.save(os.path.join(index_dir, "codebooks.npy"), self.codebooks)
+
+    @classmethod
+    def load(cls, index_dir: str) -> "IVFPQQuantizer":
+        return cls(np.load(os.path.join(index_dir, "coarse.npy")),
+                   np.load(os.path.join(index_dir, "codebooks.npy")))
+
+
+def _write_json(path: str, data: Dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def write_shard(index_dir: str, shard_name: str, quantizer: IVFPQQuantizer,
+                embeddings: np.ndarray, ids: np.ndarray, coords: np.ndarray,
+                store_vectors: bool = True) -> Dict:
+    """Кодирование части базы и запись шарда, сгруппированного по спискам IVF"""
+    lists, codes = quantizer.encode(embeddings)
+    order = np.argsort(lists, kind="stable")
+    offsets = np.zeros(quantizer.nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(lists, minlength=quantizer.nlist), out=offsets[1:])
+
+    final_dir = os.path.join(index_dir, shard_name)
+    tmp_dir = f"{final_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "codes.npy"), codes[order])
+    np.save(os.path.join(tmp_dir, "ids.npy"), np.asarray(ids, dtype=np.int64)[order])
+    np.save(os.path.join(tmp_dir, "coords.npy"), np.asarray(coords, dtype=np.float32)[order])
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    if store_vectors:
+        # Исходные дескрипторы для точного переранжирования кандидатов
+        np.save(os.path.join(tmp_dir, "vectors.npy"), np.asarray(embeddings, dtype=np.float16)[order])
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+    return {"name": shard_name, "size": int(len(ids))}
+
+
+def _encode_chunk_file(args) -> Dict:
+    """Задача воркера: шард из файла с дескрипторами"""
+    index_dir, shard_name, chunk_path, store_vectors = args
+    quantizer = IVFPQQuantizer.load(index_dir)
+    chunk = np.load(chunk_path)
+    return write_shard(
+        index_dir, shard_name, quantizer,
+        chunk["embeddings"], chunk["ids"], chunk["coords"], store_vectors
+    )
+
+
+class _Shard:
+    def __init__(self, path: str):
+        self.codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+        self.coords = np.load(os.path.join(path, "coords.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        vectors_path = os.path.join(path, "vectors.npy")
+        self.vectors = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+
+
+class EmbeddingIndex:
+    """IVF-PQ индекс дескрипторов тайлов в memory-mapped шардах
+
+    Каталог индекса: meta.json (параметры и список шардов), coarse.npy и
+    codebooks.npy (квантователи), shard_NNNNN/ с кодами, id и координатами
+    тайлов, упорядоченными по спискам IVF (и, опционально, дескрипторами
+    во float16 для точного переранжирования). Новые данные добавляются
+    новыми шардами без перезаписи существующих.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.meta: Dict = {}
+        self.quantizer: Optional[IVFPQQuantizer] = None
+        self.shards: List[_Shard] = []
+        self._code_offsets = None
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.index_dir, "meta.json")
+
+    def __len__(self):
+        return sum(shard["size"] for shard in self.meta.get("shards", []))
+
+    @classmethod
+    def create(cls, index_dir: str, training_sample: np.ndarray, nlist: int = 1024,
+               m: int = 64, iterations: int = 20, store_vectors: bool = True) -> "EmbeddingIndex":
+        """Обучение квантователей и создание пустого индекса"""
+        os.makedirs(index_dir, exist_ok=True)
+        quantizer = IVFPQQuantizer.train(training_sample, nlist, m, iterations)
+        quantizer.save(index_dir)
+        index = cls(index_dir)
+        index.meta = {
+            "dim": quantizer.dim, "nlist": nlist, "m": m,
+            "store_vectors": store_vectors, "shards": []
+        }
+        _write_json(index.meta_path, index.meta)
+        index.open()
+        return index
+
+    def open(self) -> "EmbeddingIndex":
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+        self.quantizer = IVFPQQuantizer.load(self.index_dir)
+        self._code_offsets = (np.arange(self.quantizer.m) * PQ_CENTROIDS).astype(np.int64)
+        self.shards = [_Shard(os.path.join(self.index_dir, shard["name"])) for shard in self.meta["shards"]]
+        logger.info(f"Embedding index opened: {len(self)} tiles in {len(self.shards)} shards")
+        return self
+
+    def _next_shard_names(self, count: int) -> List[str]:
+        start = len(self.meta["shards"])
+        return [f"shard_{start + i:05d}" for i in range(count)]
+
+    def _register(self, shards: List[Dict]):
+        self.meta["shards"].extend(shards)
+        _write_json(self.meta_path, self.meta)
+        self.shards.extend(_Shard(os.path.join(self.index_dir, shard["name"])) for shard in shards)
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray, coords: np.ndarray):
+        """Добавление одного шарда в текущем процессе"""
+        name = self._next_shard_names(1)[0]
+        self._register([write_shard(
+            self.index_dir, name, self.quantizer, embeddings, ids, coords, self.meta["store_vectors"]
+        )])
+
+    def add_chunk_files(self, chunk_paths: List[str], workers: Optional[int] = None):
+        """Параллельное кодирование файлов .npz (embeddings, ids, coords) в шарды"""
+        names = self._next_shard_names(len(chunk_paths))
+        tasks = [
+            (self.index_dir, name, path, self.meta["store_vectors"])
+            for name, path in zip(names, chunk_paths)
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shards = list(pool.map(_encode_chunk_file, tasks))
+        self._register(shards)
+        logger.info(f"Added {sum(s['size'] for s in shards)} tiles in {len(shards)} shards")
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = 16,
+               rerank: Optional[int] = None) -> List[Dict]:
+        """Приближенный поиск k ближайших тайлов
+
+        rerank - число лучших по PQ кандидатов, расстояния до которых
+        пересчитываются точно (по умолчанию 10 * k, 0 - без переранжирования).
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        lists = self.quantizer.probe(query, nprobe)
+        tables = self.quantizer.lookup_tables(query, lists)
+
+        candidate_distances = []
+        segments = []  # (номер шарда, первая строка) для каждого блока кандидатов
+        for shard_number, shard in enumerate(self.shards):
+            for table, list_id in zip(tables, lists):
+                start, end = shard.offsets[list_id], shard.offsets[list_id + 1]
+                if start == end:
+                    continue
+                codes = shard.codes[start:end].astype(np.int64) + self._code_offsets
+                candidate_distances.append(table[codes].sum(axis=1))
+                segments.append((shard_number, start))
+
+        if not candidate_distances:
+            return []
+        segment_starts = np.cumsum([0] + [len(d) for d in candidate_distances[:-1]])
+        distances = np.concatenate(candidate_distances)
+
+        can_rerank = self.meta.get("store_vectors") and all(shard.vectors is not None for shard in self.shards)
+        rerank = 10 * k if rerank is None else rerank
+        shortlist = min(max(k, rerank if can_rerank else 0), len(distances))
+        top = np.argpartition(distances, shortlist - 1)[:shortlist]
+
+        # Позиция кандидата -> (шард, строка шарда)
+        segments = np.asarray(segments, dtype=np.int64)
+        segment = np.searchsorted(segment_starts, top, side="right") - 1
+        shard_numbers = segments[segment, 0]
+        rows = segments[segment, 1] + top - segment_starts[segment]
+
+        if can_rerank and shortlist > k:
+            scores = np.empty(len(top), dtype=np.float32)
+            for shard_number in np.unique(shard_numbers):
+                mask = shard_numbers == shard_number
+                shard_rows = rows[mask]
+                order = np.argsort(shard_rows)
+                vectors = np.empty((len(shard_rows), self.quantizer.dim), dtype=np.float32)
+                # Чтение из memmap в порядке возрастания строк
+                vectors[order] = self.shards[shard_number].vectors[shard_rows[order]]
+                difference = vectors - query
+                scores[mask] = np.einsum("ij,ij->i", difference, difference)
+        else:
+            scores = distances[top]
+        best = np.argsort(scores)[:k]
+
+        results = []
+        for i in best:
+            shard = self.shards[shard_numbers[i]]
+            row = rows[i]
+            distance = scores[i]
+            results.append({
+                "id": int(shard.ids[row]),
+                "latitude": float(shard.coords[row, 0]),
+                "longitude": float(shard.coords[row, 1]),
+                "distance": float(max(distance, 0.0))
+            })
+        return results
+
+    def locate(self, query: np.ndarray, k: int = 10, nprobe: int = 16) -> Optional[Dict]:
+        """Оценка координат по ближайшим тайлам"""
+        matches = self.search(query, k, nprobe)
+        if not matches:
+            return None
+        best = matches[0]
+        return {
+            "latitude": best["latitude"],
+            "longitude": best["longitude"],
+            "tile_id": best["id"],
+            "matches": matches
+        }
+
+
+def embed_tiles(model, tiles: Iterable[Tuple[int, str, float, float]], output_dir: str,
+                chunk_size: int = 100000, batch_size: int = 64) -> List[str]:
+    """Вычисление дескрипторов тайлов и запись частями в .npz
+
+    tiles - последовательность (id, путь к изображению, lat, lon),
+    model - CVMModel в режиме descriptor.
+    """
+    from preprocessing import ImagePreprocessor
+
+    preprocessor = ImagePreprocessor()
+    os.makedirs(output_dir, exist_ok=True)
+    chunk_paths = []
+    embeddings, ids, coords, batch = [], [], [], []
+
+    def flush_batch():
+        if batch:
+            embeddings.append(model.embed(np.stack(batch)))
+            batch.clear()
+
+    def flush_chunk():
+        flush_batch()
+        if not ids:
+            return
+        path = os.path.join(output_dir, f"chunk_{len(chunk_paths):05d}.npz")
+        np.savez(path, embeddings=np.concatenate(embeddings), ids=np.asarray(ids), coords=np.asarray(coords))
+        chunk_paths.append(path)
+        embeddings.clear()
+        ids.clear()
+        coords.clear()
+
+    for tile_id, path, lat, lon in tiles:
+        try:
+            batch.append(preprocessor.preprocess_image(path))
+        except Exception as e:
+            logger.warning(f"Skipping tile {tile_id}: {e}")
+            continue
+        ids.append(tile_id)
+        coords.append((lat, lon))
+        if len(batch) == batch_size:
+            flush_batch()
+        if len(ids) == chunk_size:
+            flush_chunk()
+    flush_chunk()
+    return chunk_paths
+
+
+def _training_sample(chunk_paths: List[str], size: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    per_chunk = max(1, size // len(chunk_paths))
+    sample = []
+    for path in chunk_paths:
+        embeddings = np.load(path)["embeddings"]
+        take = min(per_chunk, len(embeddings))
+        sample.append(embeddings[rng.choice(len(embeddings), size=take, replace=False)])
+    return np.concatenate(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the tile embedding index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Train quantizers (if needed) and add chunk files")
+    build.add_argument("--index-dir", required=True)
+    build.add_argument("chunks", nargs="+", help=".npz files with embeddings, ids and coords")
+    build.add_argument("--nlist", type=int, default=1024)
+    build.add_argument("--m", type=int, default=64)
+    build.add_argument("--train-size", type=int, default=100000)
+    build.add_argument("--workers", type=int, default=None)
+
+    query = subparsers.add_parser("query", help="Search the index with a saved query embedding")
+    query.add_argument("--index-dir", required=True)
+    query.add_argument("embedding", help=".npy file with a query embedding")
+    query.add_argument("--k", type=int, default=10)
+    query.add_argument("--nprobe", type=int, default=16)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        if os.path.exists(os.path.join(args.index_dir, "meta.json")):
+            index = EmbeddingIndex(args.index_dir).open()
+        else:
+            sample = _training_sample(args.chunks, args.train_size)
+            index = EmbeddingIndex.create(args.index_dir, sample, args.nlist, args.m)
+        index.add_chunk_files(args.chunks, args.workers)
+    else:
+        index = EmbeddingIndex(args.index_dir).open()
+        started = time.perf_counter()
+        results = index.search(np.load(args.embedding), args.k, args.nprobe)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(json.dumps({"query_ms": elapsed, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
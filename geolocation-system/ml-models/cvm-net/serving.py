@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAVED_MODEL_SIGNATURE = "serving_default"
+
+
+class SavedModelPredictor:
+    """Инференс SavedModel из export_model.py без построения Keras модели
+
+    Граф и веса читаются из локального каталога, сеть не нужна:
+    ни backbone из keras.applications, ни код model.py не загружаются.
+    """
+
+    def __init__(self, export_dir: str):
+        import tensorflow as tf
+
+        self._tf = tf
+        self.export_dir = export_dir
+        self._model = tf.saved_model.load(export_dir)
+        self._fn = self._model.signatures[SAVED_MODEL_SIGNATURE]
+        spec = self._fn.structured_input_signature[1]["images"]
+        self.input_shape = tuple(spec.shape[1:])
+
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        images = np.asarray(images, dtype=np.float32)
+        if images.ndim == 3:
+            images = np.expand_dims(images, axis=0)
+        return self._fn(images=self._tf.constant(images))["coordinates"].numpy()
+
+
+class TFLitePredictor:
+    """Инференс TFLite модели с интерфейсом CVMModel.predict_batch"""
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.input_shape = tuple(self.interpreter.get_input_details()[0]["shape"][1:])
+        self._batch_size = None
+
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        images = np.asarray(images, dtype=np.float32)
+        if images.ndim == 3:
+            images = np.expand_dims(images, axis=0)
+        if images.shape[0] != self._batch_size:
+            # Перераспределение тензоров только при смене размера батча
+            self.interpreter.resize_tensor_input(self.input_index, images.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = images.shape[0]
+        self.interpreter.set_tensor(self.input_index, images)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def load_predictor(saved_model_dir: Optional[str] = None, tflite_path: Optional[str] = None,
+                   weights_path: Optional[str] = None, num_threads: Optional[int] = None,
+                   backbone: Optional[str] = None):
+    """Модель для инференса в порядке приоритета: TFLite, SavedModel, Keras с весами
+
+    Возвращает (predictor, format). Keras модель строится последней и без
+    загрузки ImageNet весов, если есть локальный файл весов; backbone
+    должен совпадать с тем, с которым обучены веса.
+    """
+    if tflite_path:
+        return TFLitePredictor(tflite_path, num_threads=num_threads), "tflite"
+    if saved_model_dir and os.path.exists(os.path.join(saved_model_dir, "saved_model.pb")):
+        return SavedModelPredictor(saved_model_dir), "saved_model"
+
+    from model import DEFAULT_BACKBONE, CVMModel
+
+    backbone = backbone or DEFAULT_BACKBONE
+    if weights_path and os.path.exists(weights_path):
+        model = CVMModel(weights=None, backbone=backbone)
+        model.load_weights(weights_path)
+    else:
+        logger.warning("No exported model or weights found, using ImageNet backbone with untrained head")
+        model = CVMModel(backbone=backbone)
+    return model, "keras"
+
+
+def warmup(predictor, batch_sizes: Sequence[int] = (1,)) -> Dict[int, float]:
+    """Прогревочные прямые проходы: трассировка графа и выделение буферов до первого запроса"""
+    timings = {}
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        predictor.predict_batch(np.zeros((batch_size, *predictor.input_shape), dtype=np.float32))
+        timings[batch_size] = time.perf_counter() - started
+    return timings
@@ -1,10 +1,17 @@
 import os
+import glob
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+from tensorflow.keras.optimizers import Adam
 import logging
-from model import CVMModel
-from preprocessing import ImagePreprocessor, create_tf_dataset
+from model import BACKBONES, DEFAULT_BACKBONE, CVMModel
+from preprocessing import ImagePreprocessor, create_tf_dataset, create_sharded_dataset
+from feature_cache import FeatureCache, create_feature_dataset
+from manifest import MANIFEST_FILES, IndexedView, as_path_array, find_manifest, load_manifest, split_indices
+from distributed import cluster_spec, create_strategy, shard_dataset, worker_data_dir, worker_save_dir
+from profiling import TrainingProfiler, benchmark_compute, benchmark_input_pipeline
+import argparse
 import json
 from datetime import datetime
 
@@ -13,78 +20,61 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CVMTrainer:
-    def __init__(self, model: CVMModel, config: dict):
+    def __init__(self, model: CVMModel, config: dict, strategy: tf.distribute.Strategy = None):
         self.model = model
         self.config = config
         self.history = None
+        self.strategy = strategy or tf.distribute.get_strategy()
+    
+    @property
+    def global_batch_size(self) -> int:
+        """Размер батча на все реплики: batch_size задается на одну реплику"""
+        return self.config['batch_size'] * self.strategy.num_replicas_in_sync
     
     def prepare_data(self, data_dir: str):
-        """Подготовка данных для обучения"""
-        logger.info("Preparing data for training...")
-        
-        # Загрузка путей к изображениям и координат
-        image_paths = []
-        coordinates = []
+        """Подготовка данных для обучения
         
-        # Предполагаем, что данные хранятся в формате:
-        # data_dir/
-        #   images/
-        #     image1.jpg
-        #     image2.jpg
-        #   coordinates.json
+        Ожидается data_dir/images/ и разметка с полями filename, latitude,
+        longitude в одном из форматов: coordinates.parquet, coordinates.jsonl,
+        coordinates.csv (читаются потоково) или coordinates.json.
+        Возвращает пути (PathArray) и массив координат N x 2.
+        """
+        logger.info("Preparing data for training...")
         
         images_dir = os.path.join(data_dir, "images")
-        coords_file = os.path.join(data_dir, "coordinates.json")
-        
         if not os.path.exists(images_dir):
             raise ValueError(f"Images directory not found: {images_dir}")
         
-        if not os.path.exists(coords_file):
-            raise ValueError(f"Coordinates file not found: {coords_file}")
+        manifest_path = find_manifest(data_dir)
+        if manifest_path is None:
+            raise ValueError(f"Coordinates file not found in {data_dir}, expected one of {MANIFEST_FILES}")
         
-        # Загрузка координат
-        with open(coords_file, 'r') as f:
-            coords_data = json.load(f)
+        image_paths, coordinates = load_manifest(images_dir, manifest_path)
         
-        # Подготовка данных
-        for item in coords_data:
-            image_path = os.path.join(images_dir, item['filename'])
-            if os.path.exists(image_path):
-                image_paths.append(image_path)
-                coordinates.append([item['latitude'], item['longitude']])
-        
-        logger.info(f"Loaded {len(image_paths)} images for training")
+        logger.info(f"Loaded {len(image_paths)} images for training from {os.path.basename(manifest_path)}")
         return image_paths, coordinates
     
-    def split_data(self, image_paths: list, coordinates: list, 
-                   train_ratio: float = 0.8, val_ratio: float = 0.1):
-        """Разделение данных на train/val/test"""
-        num_samples = len(image_paths)
-        train_size = int(num_samples * train_ratio)
-        val_size = int(num_samples * val_ratio)
-        
-        # Перемешивание данных
-        indices = np.random.permutation(num_samples)
-        
-        train_indices = indices[:train_size]
-        val_indices = indices[train_size:train_size + val_size]
-        test_indices = indices[train_size + val_size:]
-        
-        # Разделение данных
-        train_data = {
-            'images': [image_paths[i] for i in train_indices],
-            'coordinates': [coordinates[i] for i in train_indices]
-        }
-        
-        val_data = {
-            'images': [image_paths[i] for i in val_indices],
-            'coordinates': [coordinates[i] for i in val_indices]
-        }
-        
-        test_data = {
-            'images': [image_paths[i] for i in test_indices],
-            'coordinates': [coordinates[i] for i in test_indices]
-        }
+    def split_data(self, image_paths, coordinates, 
+                   train_ratio: float = 0.8, val_ratio: float = 0.1, seed: int = None):
+        """Разделение данных на train/val/test
+        
+        Части - представления исходных массивов по перемешанным индексам
+        (IndexedView), данные не копируются. С одинаковым seed разбиение
+        совпадает между запусками.
+        """
+        if seed is None:
+            seed = self.config.get('seed')
+        image_paths = as_path_array(image_paths)
+        coordinates = np.asarray(coordinates, dtype=np.float64)
+        
+        splits = []
+        for indices in split_indices(len(image_paths), train_ratio, val_ratio, seed):
+            splits.append({
+                'images': IndexedView(image_paths, indices),
+                'coordinates': IndexedView(coordinates, indices),
+                'indices': indices
+            })
+        train_data, val_data, test_data = splits
         
         logger.info(f"Data split - Train: {len(train_data['images'])}, "
                    f"Val: {len(val_data['images'])}, Test: {len(test_data['images'])}")
@@ -96,22 +86,47 @@ class CVMTrainer:
         train_dataset = create_tf_dataset(
             train_data['images'], 
             train_data['coordinates'],
-            batch_size=self.config['batch_size']
+            batch_size=self.global_batch_size,
+            shuffle=True
         )
         
         val_dataset = create_tf_dataset(
             val_data['images'], 
             val_data['coordinates'],
-            batch_size=self.config['batch_size']
+            batch_size=self.global_batch_size
         )
         
         test_dataset = create_tf_dataset(
             test_data['images'], 
             test_data['coordinates'],
-            batch_size=self.config['batch_size']
+            batch_size=self.global_batch_size
         )
         
-        return train_dataset, val_dataset, test_dataset
+        return tuple(shard_dataset(dataset) for dataset in (train_dataset, val_dataset, test_dataset))
+    
+    def create_sharded_datasets(self, shards_dir: str):
+        """TensorFlow datasets из предобработанных шардов (dataset_builder.py)"""
+        cache = self.config.get('dataset_cache')
+        snapshot_dir = self.config.get('dataset_snapshot_dir')
+        if cache and cache != 'memory':
+            cache = worker_data_dir(cache)
+            os.makedirs(cache, exist_ok=True)
+        if snapshot_dir:
+            snapshot_dir = worker_data_dir(snapshot_dir)
+        datasets = []
+        for split in ('train', 'val', 'test'):
+            dataset = create_sharded_dataset(
+                shards_dir,
+                split,
+                batch_size=self.global_batch_size,
+                shuffle=split == 'train',
+                cache=cache if cache == 'memory' or not cache else os.path.join(cache, split),
+                snapshot_dir=os.path.join(snapshot_dir, split) if snapshot_dir else None
+            )
+            # У val и test шардов часто меньше, чем рабочих
+            num_files = len(glob.glob(os.path.join(shards_dir, f"{split}-*.tfrecord")))
+            datasets.append(shard_dataset(dataset, by_files=True, num_files=num_files))
+        return tuple(datasets)
     
     def setup_callbacks(self, save_dir: str):
         """Настройка callbacks для обучения"""
@@ -140,12 +155,36 @@ class CVMTrainer:
         
         return callbacks
     
-    def train(self, train_dataset, val_dataset, save_dir: str):
+    def create_profiler(self, keras_model, train_dataset, save_dir: str) -> TrainingProfiler:
+        """Профайлер обучения; с benchmark_pipeline - с отдельными замерами ввода и вычислений"""
+        benchmarks = {}
+        compute_step = None
+        if self.config.get('benchmark_pipeline'):
+            logger.info("Benchmarking input pipeline and compute separately...")
+            benchmarks['input_pipeline'] = benchmark_input_pipeline(train_dataset)
+            benchmarks['compute'] = benchmark_compute(keras_model, train_dataset)
+            compute_step = benchmarks['compute']['seconds_per_step']
+            logger.info(
+                f"Input pipeline: {benchmarks['input_pipeline']['samples_per_second']:.1f} samples/s, "
+                f"compute: {benchmarks['compute']['samples_per_second']:.1f} samples/s"
+            )
+        return TrainingProfiler(
+            self.global_batch_size,
+            save_dir,
+            compute_step_seconds=compute_step,
+            trace_steps=self.config.get('profile_steps'),
+            trace_dir=self.config.get('profile_dir'),
+            benchmarks=benchmarks
+        )
+    
+    def train(self, train_dataset, val_dataset, save_dir: str, extra_callbacks: list = None):
         """Обучение модели"""
         logger.info("Starting model training...")
         
         # Настройка callbacks
         callbacks = self.setup_callbacks(save_dir)
+        callbacks.append(self.create_profiler(self.model.model, train_dataset, save_dir))
+        callbacks.extend(extra_callbacks or [])
         
         # Обучение
         self.history = self.model.model.fit(
@@ -153,7 +192,7 @@ class CVMTrainer:
             validation_data=val_dataset,
             epochs=self.config['epochs'],
             callbacks=callbacks,
-            verbose=1
+            verbose=self.config.get('verbose', 1)
         )
         
         # Сохранение истории обучения
@@ -164,6 +203,60 @@ class CVMTrainer:
         logger.info("Training completed successfully")
         return self.history
     
+    def train_cached(self, train_data: dict, val_data: dict, save_dir: str, extra_callbacks: list = None):
+        """Обучение головы на закэшированных признаках замороженного backbone
+        
+        Backbone прогоняется по данным один раз (повторно - только если
+        изменились веса backbone, предобработка или состав датасета),
+        эпохи обучения fc1, fc2 и coordinates идут по готовым признакам.
+        """
+        logger.info("Starting head training on cached backbone features...")
+        
+        cache = FeatureCache(
+            self.config.get('feature_cache_dir', os.path.join(save_dir, 'feature_cache')),
+            self.model,
+            batch_size=self.config['batch_size'],
+            manifest_path=find_manifest(self.config['data_dir']) if self.config.get('data_dir') else None
+        )
+        train_features = cache.load_or_build('train', train_data['images'], train_data['coordinates'])
+        val_features = cache.load_or_build('val', val_data['images'], val_data['coordinates'])
+        
+        train_dataset = create_feature_dataset(*train_features, batch_size=self.global_batch_size, shuffle=True)
+        val_dataset = create_feature_dataset(*val_features, batch_size=self.global_batch_size)
+        
+        # Слои головы общие с полной моделью, веса обновляются в ней же
+        with self.strategy.scope():
+            head = self.model.head_model()
+            head.compile(
+                optimizer=Adam(learning_rate=self.config['learning_rate']),
+                loss='mse',
+                metrics=['mae', 'mse']
+            )
+        callbacks = [
+            callback for callback in self.setup_callbacks(save_dir)
+            if not isinstance(callback, ModelCheckpoint)
+        ]
+        callbacks.append(self.create_profiler(head, train_dataset, save_dir))
+        callbacks.extend(extra_callbacks or [])
+        
+        self.history = head.fit(
+            train_dataset,
+            validation_data=val_dataset,
+            epochs=self.config['epochs'],
+            callbacks=callbacks,
+            verbose=self.config.get('verbose', 1)
+        )
+        
+        # Веса полной модели в том же формате, что и ModelCheckpoint
+        self.model.save_weights(os.path.join(save_dir, 'best_model.h5'))
+        
+        history_path = os.path.join(save_dir, 'training_history.json')
+        with open(history_path, 'w') as f:
+            json.dump(self.history.history, f, indent=2)
+        
+        logger.info("Head training completed successfully")
+        return self.history
+    
     def evaluate(self, test_dataset):
         """Оценка модели на тестовых данных"""
         logger.info("Evaluating model on test data...")
@@ -186,42 +279,98 @@ class CVMTrainer:
         
         logger.info(f"Configuration saved to {config_path}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train CVM-Net")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--save-dir", default="models")
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size per replica")
+    parser.add_argument("--learning-rate", type=float, default=0.001, help="Learning rate for one replica")
+    parser.add_argument("--backbone", default=DEFAULT_BACKBONE, choices=sorted(BACKBONES))
+    parser.add_argument("--feature-cache", action=argparse.BooleanOptionalAction, default=False,
+                        help="Train only the head on cached backbone features (default: the full model end to end)")
+    parser.add_argument("--dataset-cache", default=None,
+                        help="Cache decoded shards: a directory for on-disk cache files, or 'memory' "
+                             "(only for datasets that fit in RAM); default: no cache")
+    parser.add_argument("--dataset-snapshot-dir", default=None, help="tf.data snapshot directory for the shards")
+    parser.add_argument("--profile-steps", type=int, nargs=2, metavar=("START", "STOP"),
+                        help="Record a TensorFlow profiler trace for global steps [START, STOP)")
+    parser.add_argument("--profile-dir", help="Trace directory (default: <save-dir>/profile)")
+    parser.add_argument("--benchmark-pipeline", action="store_true",
+                        help="Time the input pipeline and the train step separately before training")
+    return parser.parse_args()
+
 def main():
     """Основная функция обучения"""
+    args = parse_args()
+    
+    # Конфигурация кластера берется из TF_CONFIG (distributed.py)
+    strategy = create_strategy()
+    num_replicas = strategy.num_replicas_in_sync
+    multi_worker = cluster_spec()['num_workers'] > 1
+    
     # Конфигурация обучения
     config = {
-        'batch_size': 32,
-        'epochs': 100,
-        'learning_rate': 0.001,
+        'backbone': args.backbone,
+        'batch_size': args.batch_size,
+        'epochs': args.epochs,
+        # Линейное масштабирование learning rate по числу реплик
+        'learning_rate': args.learning_rate * num_replicas,
         'patience': 15,
-        'data_dir': 'data',
-        'save_dir': 'models'
+        'data_dir': args.data_dir,
+        'save_dir': worker_save_dir(args.save_dir),
+        # Тот же seed, что и в dataset_builder.py, дает то же разбиение
+        'seed': 42,
+        # --feature-cache: backbone заморожен, обучается голова на закэшированных
+        # признаках (кэш локален для процесса, при нескольких рабочих отключен)
+        'cache_features': args.feature_cache and not multi_worker,
+        'feature_cache_dir': os.path.join(args.save_dir, 'feature_cache'),
+        # Шарды dataset_builder.py; если есть, обучение читает их вместо JPEG
+        'shards_dir': os.path.join(args.data_dir, 'shards'),
+        # Кэш декодированных шардов: каталог на диске, 'memory' или без кэша
+        'dataset_cache': args.dataset_cache,
+        'dataset_snapshot_dir': args.dataset_snapshot_dir,
+        # Профилирование: training_profile.json пишется всегда,
+        # трассы профайлера - только для заданного диапазона шагов
+        'profile_steps': args.profile_steps,
+        'profile_dir': args.profile_dir,
+        'benchmark_pipeline': args.benchmark_pipeline
     }
     
     # Создание директорий
     os.makedirs(config['save_dir'], exist_ok=True)
     
     # Создание модели
-    model = CVMModel()
-    model.compile_model(learning_rate=config['learning_rate'])
+    with strategy.scope():
+        model = CVMModel(backbone=config['backbone'])
+        model.compile_model(learning_rate=config['learning_rate'])
     
     # Создание тренера
-    trainer = CVMTrainer(model, config)
-    
+    trainer = CVMTrainer(model, config, strategy)
+    logger.info(
+        f"Replicas: {num_replicas}, global batch: {trainer.global_batch_size}, "
+        f"learning rate: {config['learning_rate']}"
+    )
     try:
         # Подготовка данных
         image_paths, coordinates = trainer.prepare_data(config['data_dir'])
         
         # Разделение данных
-        train_data, val_data, test_data = trainer.split_data(image_paths, coordinates)
+        train_data, val_data, test_data = trainer.split_data(image_paths, coordinates, seed=config['seed'])
         
         # Создание datasets
-        train_dataset, val_dataset, test_dataset = trainer.create_datasets(
-            train_data, val_data, test_data
-        )
+        if os.path.exists(os.path.join(config['shards_dir'], 'manifest.json')):
+            train_dataset, val_dataset, test_dataset = trainer.create_sharded_datasets(config['shards_dir'])
+        else:
+            train_dataset, val_dataset, test_dataset = trainer.create_datasets(
+                train_data, val_data, test_data
+            )
         
         # Обучение
-        history = trainer.train(train_dataset, val_dataset, config['save_dir'])
+        if config['cache_features']:
+            history = trainer.train_cached(train_data, val_data, config['save_dir'])
+        else:
+            history = trainer.train(train_dataset, val_dataset, config['save_dir'])
         
         # Оценка
         test_results = trainer.evaluate(test_dataset)
@@ -0,0 +1,29 @@
+import os
+import sys
+import importlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _app_modules():
+    return {name: module for name, module in sys.modules.items() if name == "app" or name.startswith("app.")}
+
+
+def load_modules(directory: str, *names: str):
+    """Модули сервиса из каталога directory (относительно корня проекта)
+
+    У сервисов общий пакет app, поэтому после импорта он убирается из
+    sys.modules: тесты разных сервисов не видят модули друг друга.
+    """
+    path = os.path.join(ROOT, directory)
+    saved = _app_modules()
+    for name in saved:
+        del sys.modules[name]
+    sys.path.insert(0, path)
+    try:
+        return [importlib.import_module(name) for name in names]
+    finally:
+        sys.path.remove(path)
+        for name in _app_modules():
+            del sys.modules[name]
+        sys.modules.update(saved)
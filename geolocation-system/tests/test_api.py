@@ -134,6 +134,49 @@ class TestGeolocationAPI:
             data = response.json()
             assert "full_address" in data
     
+    def test_results_catalog(self):
+        """Тест загрузки и выборки результатов из каталога"""
+        # Сначала логинимся
+        self.test_auth_login()
+        
+        results = [
+            {
+                "user_id": 1,
+                "building_ref": "building_0_test.jpg",
+                "latitude": 55.7558,
+                "longitude": 37.6176,
+                "confidence": 0.9
+            }
+        ]
+        
+        headers = {"Authorization": f"Bearer {self.token}"}
+        response = self.session.post(
+            f"{BASE_URL}/api/results/batch",
+            json=results,
+            headers=headers
+        )
+        
+        # Проверяем, что запрос прошел
+        assert response.status_code in [200, 500, 503]
+        
+        if response.status_code == 200:
+            assert response.json()["ingested"] == 1
+            
+            params = {
+                "user_id": 1,
+                "min_lat": 55.7,
+                "min_lon": 37.5,
+                "max_lat": 55.8,
+                "max_lon": 37.7,
+                "limit": 10
+            }
+            response = self.session.get(f"{BASE_URL}/api/results", params=params, headers=headers)
+            assert response.status_code == 200
+            
+            data = response.json()
+            assert "items" in data
+            assert "next_cursor" in data
+    
     def test_export_xlsx(self):
         """Тест экспорта в XLSX"""
         # Сначала логинимся
@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from conftest import load_modules
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("prometheus_client")
+batching, = load_modules("backend/neural-service", "app.batching")
+
+
+def _run(predict_fn, items):
+    async def run():
+        batcher = batching.MicroBatcher(predict_fn, max_batch_size=len(items), max_wait_ms=50)
+        batcher.start()
+        try:
+            return await asyncio.wait_for(
+                asyncio.gather(*(batcher.submit(item) for item in items), return_exceptions=True), 5
+            )
+        finally:
+            await batcher.stop()
+    return asyncio.run(run())
+
+
+def test_batch_results_follow_inputs():
+    items = [np.full(2, i, dtype=np.float32) for i in range(4)]
+    results = _run(lambda inputs: inputs * 2, items)
+    assert [result.tolist() for result in results] == [[2 * i, 2 * i] for i in range(4)]
+
+
+def test_short_output_fails_every_request():
+    items = [np.full(2, i, dtype=np.float32) for i in range(4)]
+    results = _run(lambda inputs: inputs[:2], items)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert "2 outputs for 4 inputs" in str(results[0])
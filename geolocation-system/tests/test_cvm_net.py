@@ -0,0 +1,134 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from conftest import load_modules
+
+manifest, = load_modules("ml-models/cvm-net", "manifest")
+
+
+def _dataset(size: int):
+    image_paths = np.array([f"images/{i}.jpg" for i in range(size)])
+    coordinates = np.array([(55.0 + i, 37.0 + i) for i in range(size)], dtype=np.float64)
+    return image_paths, coordinates
+
+
+def test_eval_calibration_split_disjoint():
+    """Оценочная и калибровочная выборки из разных изображений"""
+    image_paths, coordinates = _dataset(10)
+    (eval_paths, eval_coords), (calib_paths, calib_coords) = manifest.eval_calibration_split(
+        image_paths, coordinates, eval_samples=4
+    )
+    assert len(eval_paths) == 4
+    assert len(calib_paths) == 6
+    assert not set(eval_paths) & set(calib_paths)
+    # Пути и координаты переставлены одинаково
+    for paths, coords in ((eval_paths, eval_coords), (calib_paths, calib_coords)):
+        for path, (lat, lon) in zip(paths, coords):
+            i = int(path.split("/")[1].split(".")[0])
+            assert (lat, lon) == (55.0 + i, 37.0 + i)
+
+
+def test_eval_calibration_split_small_dataset():
+    """Без лишних изображений калибровка идет на оценочной выборке"""
+    image_paths, coordinates = _dataset(3)
+    (eval_paths, _), (calib_paths, _) = manifest.eval_calibration_split(image_paths, coordinates, eval_samples=64)
+    assert len(eval_paths) == 3
+    assert list(calib_paths) == list(eval_paths)
+
+
+def test_eval_calibration_split_deterministic():
+    image_paths, coordinates = _dataset(20)
+    first = manifest.eval_calibration_split(image_paths, coordinates, eval_samples=5)
+    second = manifest.eval_calibration_split(list(image_paths), coordinates.tolist(), eval_samples=5)
+    assert list(first[0][0]) == list(second[0][0])
+
+
+def _preprocessing():
+    cv2 = pytest.importorskip("cv2")
+    pytest.importorskip("PIL")
+    preprocessing, = load_modules("ml-models/cvm-net", "preprocessing")
+    return cv2, preprocessing
+
+
+def test_data_generator_keeps_list_api_and_order(tmp_path):
+    """get_augmented_data возвращает списки, порядок по умолчанию не перемешивается"""
+    cv2, preprocessing = _preprocessing()
+    paths = []
+    for i in range(3):
+        path = str(tmp_path / f"{i}.jpg")
+        cv2.imwrite(path, np.full((8, 8, 3), i * 80, dtype=np.uint8))
+        paths.append(path)
+    coordinates = [(55.0 + i, 37.0 + i) for i in range(3)]
+    preprocessor = preprocessing.ImagePreprocessor(target_size=(8, 8))
+    generator = preprocessing.DataGenerator(paths, coordinates, batch_size=2,
+                                            preprocessor=preprocessor, num_workers=2)
+    try:
+        assert list(generator.indices) == [0, 1, 2]
+        images, augmented_coordinates = generator.get_augmented_data(augmentation_factor=2)
+        assert isinstance(images, list) and isinstance(augmented_coordinates, list)
+        assert augmented_coordinates == [coordinates[0]] * 2 + [coordinates[1]] * 2 + [coordinates[2]] * 2
+        lazy = list(generator.iter_augmented_data(augmentation_factor=2))
+        assert [c for _, c in lazy] == augmented_coordinates
+        assert all(np.array_equal(a, b) for a, b in zip(images, (image for image, _ in lazy)))
+    finally:
+        generator.close()
+
+
+def test_augmentation_factor_capped_at_available_variants(tmp_path):
+    """Больше копий, чем вариантов аугментации, не бывает - как в исходном get_augmented_data"""
+    cv2, preprocessing = _preprocessing()
+    paths = []
+    for i in range(2):
+        path = str(tmp_path / f"{i}.jpg")
+        cv2.imwrite(path, np.full((8, 8, 3), i * 80, dtype=np.uint8))
+        paths.append(path)
+    coordinates = [(55.0, 37.0), (56.0, 38.0)]
+    preprocessor = preprocessing.ImagePreprocessor(target_size=(8, 8))
+    variants = preprocessing.AUGMENTATION_VARIANTS
+    generator = preprocessing.DataGenerator(paths, coordinates, batch_size=3, preprocessor=preprocessor,
+                                            augment=True, augmentation_factor=variants + 2, num_workers=2)
+    try:
+        images, _ = generator.get_augmented_data(augmentation_factor=variants + 2)
+        assert len(images) == 2 * variants
+        assert generator.augmentation_factor == variants
+        assert generator.num_items == 2 * variants
+        batches = [len(generator[i][0]) for i in range(len(generator))]
+        assert sum(batches) == 2 * variants
+    finally:
+        generator.close()
+
+
+def test_load_manifest_stores_compact_relative_names(tmp_path):
+    """Имена файлов - UTF-8 байты без каталога, полный путь собирается при обращении"""
+    images_dir = tmp_path / "images"
+    (images_dir / "sub").mkdir(parents=True)
+    names = ["a.jpg", "sub/б.jpg", "c.jpg"]
+    for name in names[:2]:
+        (images_dir / name).write_bytes(b"")
+    manifest_path = tmp_path / "coordinates.json"
+    manifest_path.write_text(json.dumps([
+        {"filename": name, "latitude": 55.0 + i, "longitude": 37.0} for i, name in enumerate(names)
+    ]))
+
+    image_paths, coordinates = manifest.load_manifest(str(images_dir), str(manifest_path))
+    assert isinstance(image_paths, manifest.PathArray)
+    assert image_paths.names.dtype.kind == "S"
+    assert list(image_paths.names) == [b"a.jpg", "sub/б.jpg".encode("utf-8")]
+    expected = [os.path.join(str(images_dir), name) for name in names[:2]]
+    assert list(image_paths) == expected
+    assert image_paths[1] == expected[1]
+    assert coordinates.tolist() == [[55.0, 37.0], [56.0, 37.0]]
+
+    view = manifest.IndexedView(image_paths, np.array([1, 0]))
+    assert view[0] == expected[1]
+    assert np.asarray(view).tolist() == expected[::-1]
+    prefix, encoded = manifest.encoded_paths(view)
+    assert prefix == str(images_dir) + os.sep
+    assert encoded.tolist() == [names[1].encode("utf-8"), b"a.jpg"]
+
+    (eval_paths, _), (calib_paths, _) = manifest.eval_calibration_split(image_paths, coordinates, eval_samples=1)
+    assert isinstance(eval_paths, manifest.PathArray)
+    assert sorted(list(eval_paths) + list(calib_paths)) == sorted(expected)
@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import load_modules
+
+pytest.importorskip("celery")
+pytest.importorskip("minio")
+jobs, = load_modules("backend/export-service", "app.jobs")
+
+
+def test_inline_records_are_capped(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_RECORDS", 2)
+    assert jobs.job_spec("csv", records=[{"a": 1}, {"a": 2}])["records"] == [{"a": 1}, {"a": 2}]
+    with pytest.raises(ValueError, match="At most 2 inline records"):
+        jobs.job_spec("csv", records=[{"a": 1}, {"a": 2}, {"a": 3}])
+
+
+def test_identical_specs_share_job_id():
+    now = 1700000000.0
+    first = jobs.job_spec("parquet", filters={"user_id": 1, "date_from": None, "min_lat": 55.0}, now=now)
+    second = jobs.job_spec("parquet", filters={"min_lat": 55.0, "user_id": 1}, now=now + 1)
+    assert first == second
+    assert jobs.job_id_for(first) == jobs.job_id_for(second)
+    assert jobs.job_id_for(first) != jobs.job_id_for(
+        jobs.job_spec("csv", filters={"min_lat": 55.0, "user_id": 1}, now=now)
+    )
+    assert jobs.job_id_for(first) != jobs.job_id_for(
+        jobs.job_spec("parquet", filters={"min_lat": 55.0, "user_id": 1}, page_size=500, now=now)
+    )
+
+
+def test_filter_specs_dedupe_within_window():
+    now = 1700000000.0 - 1700000000.0 % jobs.FILTER_DEDUP_WINDOW
+    spec = jobs.job_spec("csv", filters={"user_id": 1}, now=now)
+    assert jobs.job_spec("csv", filters={"user_id": 1}, now=now + jobs.FILTER_DEDUP_WINDOW - 1) == spec
+    later = jobs.job_spec("csv", filters={"user_id": 1}, now=now + jobs.FILTER_DEDUP_WINDOW)
+    assert jobs.job_id_for(later) != jobs.job_id_for(spec)
+    # Записи и ключи не меняются со временем - окно к ним не применяется
+    assert "window" not in jobs.job_spec("zip", keys=["a.jpg"], now=now)
+
+
+def test_job_store_deduplicates_until_failed():
+    fakeredis = pytest.importorskip("fakeredis")
+    store = jobs.JobStore(fakeredis.FakeRedis(decode_responses=True))
+    spec = jobs.job_spec("zip", keys=["a.jpg", "b.jpg"])
+
+    job_id, created = store.submit(spec, user_id=1)
+    assert created
+    assert store.submit(spec, user_id=2) == (job_id, False)
+    assert store.get(job_id)["spec"] == spec
+    assert sorted(store.subscribers(job_id)) == [1, 2]
+
+    store.update(job_id, status="failed", error="boom")
+    assert store.submit(spec) == (job_id, True)
+    assert store.get(job_id)["status"] == "queued"
+
+
+def test_dedup_keeps_ttl_and_requeues_missing_artifact():
+    fakeredis = pytest.importorskip("fakeredis")
+    stored = set()
+    client = fakeredis.FakeRedis(decode_responses=True)
+    store = jobs.JobStore(client, ttl=100, artifact_exists=lambda job_id, format: job_id in stored)
+    spec = jobs.job_spec("zip", keys=["a.jpg"])
+    job_id, _ = store.submit(spec, user_id=1)
+    key = f"export:job:{job_id}"
+
+    client.expire(key, 40)
+    assert store.submit(spec, user_id=2) == (job_id, False)
+    assert 0 < client.ttl(key) <= 40
+    assert 0 < client.ttl(f"{key}:subscribers") <= 40
+
+    store.update(job_id, status="done", size=10)
+    stored.add(job_id)
+    assert store.submit(spec) == (job_id, False)
+    assert client.ttl(key) <= 40
+
+    # Файл удален lifecycle-правилом MinIO: задание выполняется заново
+    stored.clear()
+    assert store.submit(spec) == (job_id, True)
+    assert store.get(job_id)["status"] == "queued"
+    assert 40 < client.ttl(key) <= 100
@@ -0,0 +1,143 @@
+import io
+import asyncio
+import json
+
+import pytest
+
+from conftest import load_modules
+
+pq = pytest.importorskip("pyarrow.parquet")
+writers, service = load_modules("backend/export-service", "app.writers", "app.service")
+
+
+async def _records(records):
+    for record in records:
+        yield record
+
+
+def _collect(stream) -> bytes:
+    async def collect():
+        return b"".join([chunk async for chunk in stream])
+    return asyncio.run(collect())
+
+
+def _parquet(records, **kwargs):
+    return pq.read_table(io.BytesIO(_collect(writers.stream_parquet(_records(records), **kwargs))))
+
+
+def test_parquet_row_groups():
+    records = [{"id": i, "value": i / 2, "name": f"n{i}"} for i in range(10)]
+    parquet_file = pq.ParquetFile(io.BytesIO(_collect(writers.stream_parquet(_records(records), row_group_size=3))))
+    assert parquet_file.metadata.num_row_groups == 4
+    assert parquet_file.read().to_pylist() == records
+
+
+def test_parquet_promotes_without_loss():
+    # Целые после дробных, что угодно в строковой колонке, пустая первая группа
+    records = [
+        {"ratio": 1.5, "label": "a", "empty": None},
+        {"ratio": 2.5, "label": "b", "empty": None},
+        {"ratio": 3, "label": 4, "empty": 0.5},
+    ]
+    table = _parquet(records, row_group_size=2)
+    assert [str(t) for t in table.schema.types] == ["double", "string", "string"]
+    assert table.column("ratio").to_pylist() == [1.5, 2.5, 3.0]
+    assert table.column("label").to_pylist() == ["a", "b", "4"]
+    assert table.column("empty").to_pylist() == [None, None, "0.5"]
+
+
+def test_parquet_mixed_first_group_as_strings():
+    table = _parquet([{"a": 1}, {"a": "x"}], row_group_size=10)
+    assert table.column("a").to_pylist() == ["1", "x"]
+
+
+def test_parquet_refuses_to_narrow():
+    # 0.5 в колонке, выведенной целой, - ошибка, а не записанный 0
+    with pytest.raises(ValueError, match="'a'"):
+        _parquet([{"a": 1}, {"a": 2}, {"a": 0.5}], row_group_size=2)
+
+
+def test_parquet_catalog_schema():
+    records = [{"id": "ab", "user_id": None, "latitude": 55, "longitude": 37.5, "bbox": [1, 2, 3, 4]}]
+    stream = service.RECORD_FORMATS["parquet"][2](_records(records), columns=service.RESULT_COLUMNS)
+    table = pq.read_table(io.BytesIO(_collect(stream)))
+    assert table.schema.names == service.RESULT_COLUMNS
+    assert str(table.schema.field("user_id").type) == "int64"
+    assert str(table.schema.field("latitude").type) == "double"
+    assert table.to_pylist()[0]["latitude"] == 55.0
+    assert table.to_pylist()[0]["bbox"] == "[1, 2, 3, 4]"
+
+
+def test_parquet_empty():
+    assert _parquet([]).num_rows == 0
+
+
+def test_geojson_non_finite_floats_are_null():
+    records = [
+        {"id": "a", "latitude": 55.0, "longitude": 37.0, "confidence": float("nan"),
+         "scores": [1.0, float("inf")], "meta": {"distance": float("-inf")}},
+        {"id": "b", "latitude": float("nan"), "longitude": 37.0},
+    ]
+    collection = json.loads(_collect(writers.stream_geojson(_records(records))))
+    first, second = collection["features"]
+    assert first["geometry"]["coordinates"] == [37.0, 55.0]
+    assert first["properties"] == {"id": "a", "confidence": None, "scores": [1.0, None], "meta.distance": None}
+    assert second["geometry"] is None
+
+    lines = _collect(writers.stream_geojson_lines(_records(records))).decode().splitlines()
+    assert [json.loads(line)["properties"]["id"] for line in lines] == ["a", "b"]
+    assert "NaN" not in lines[0] and "Infinity" not in lines[0]
+
+
+def test_xlsx_readable_with_sheet_rollover(monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(writers, "XLSX_MAX_ROWS", 3)
+    monkeypatch.setattr(writers, "ROWS_PER_CHUNK", 2)
+    records = [{"id": i, "coordinates": {"latitude": 55.0 + i, "longitude": 37.0}, "note": f"<{i}> & co"}
+               for i in range(5)]
+    data = _collect(writers.stream_xlsx(_records(records), sheet_name="Coordinates"))
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+    assert workbook.sheetnames == ["Coordinates", "Coordinates 2", "Coordinates 3"]
+    rows = []
+    for sheet in workbook.worksheets:
+        header, *values = sheet.iter_rows(values_only=True)
+        assert header == ("id", "coordinates.latitude", "coordinates.longitude", "note")
+        assert len(values) <= 2  # заголовок + 2 строки = XLSX_MAX_ROWS
+        rows.extend(values)
+    assert rows == [(i, 55.0 + i, 37.0, f"<{i}> & co") for i in range(5)]
+
+
+def test_zip_valid_with_stored_images():
+    import zipfile
+
+    async def chunks():
+        yield b"part-1,"
+        yield b"part-2"
+
+    async def entries():
+        yield "a.jpg", b"\xff\xd8\xff" + b"\x00" * 1000
+        yield "b.PNG", b"\x89PNG\r\n\x1a\n" + b"\x00" * 1000
+        yield "notes.txt", b"text " * 200
+        yield "stream.csv", chunks()
+
+    archive = zipfile.ZipFile(io.BytesIO(_collect(writers.stream_zip(entries()))))
+    assert archive.testzip() is None
+    types = {info.filename: info.compress_type for info in archive.infolist()}
+    assert types == {"a.jpg": zipfile.ZIP_STORED, "b.PNG": zipfile.ZIP_STORED,
+                     "notes.txt": zipfile.ZIP_DEFLATED, "stream.csv": zipfile.ZIP_DEFLATED}
+    assert archive.read("stream.csv") == b"part-1,part-2"
+
+
+def test_geojson_valid_feature_collection(monkeypatch):
+    monkeypatch.setattr(writers, "ROWS_PER_CHUNK", 2)
+    records = [{"id": i, "latitude": 55.0 + i, "longitude": 37.0, "address": "Москва"} for i in range(5)]
+    collection = json.loads(_collect(writers.stream_geojson(_records(records))))
+    assert collection["type"] == "FeatureCollection"
+    assert [feature["geometry"]["coordinates"] for feature in collection["features"]] == [
+        [37.0, 55.0 + i] for i in range(5)
+    ]
+    assert collection["features"][0]["properties"] == {"id": 0, "address": "Москва"}
+    assert json.loads(_collect(writers.stream_geojson(_records([])))) == {
+        "type": "FeatureCollection", "features": []
+    }
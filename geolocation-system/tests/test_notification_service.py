@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from conftest import load_modules
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+from fastapi.testclient import TestClient
+from redis.asyncio.client import Pipeline
+
+main, = load_modules("backend/notification-service", "app.main")
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(main, "HISTORY_LIMIT", 5)
+    service = main.NotificationService(fakeredis.aioredis.FakeRedis())
+    monkeypatch.setattr(main, "service", service)
+    return service
+
+
+def _notification(user_id: int, i: int):
+    return main.Notification(user_id=user_id, title=f"t{i}", message="m")
+
+
+def _send(service, count: int, user_id: int = 1):
+    return asyncio.run(service.send_batch([_notification(user_id, i) for i in range(count)]))
+
+
+def _page(service, user_id: int = 1, limit: int = 50, cursor=None):
+    return asyncio.run(service.get_user_notifications(user_id, limit, cursor))
+
+
+def test_history_capped(service):
+    ids = _send(service, 12)
+    keys = service._keys(1)
+
+    async def sizes():
+        client = service.redis_client
+        return await client.zcard(keys[0]), await client.hlen(keys[1]), await client.scard(keys[2])
+
+    assert asyncio.run(sizes()) == (5, 5, 5)
+    page = _page(service)
+    # Остаются последние уведомления, новые первыми
+    assert [n["id"] for n in page["notifications"]] == ids[:-6:-1]
+    assert page["unread"] == 5
+
+
+def test_cursor_paging_without_repeats(service):
+    ids = _send(service, 5)
+    seen, cursor = [], None
+    while True:
+        page = _page(service, limit=2, cursor=cursor)
+        seen.extend(n["id"] for n in page["notifications"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ids[::-1]
+    # Новые уведомления не сдвигают следующую страницу
+    first = _page(service, limit=2)
+    _send(service, 1)
+    assert [n["id"] for n in _page(service, limit=2, cursor=first["next_cursor"])["notifications"]] == ids[2::-1][:2]
+
+
+def test_unread_tracking(service):
+    ids = _send(service, 3)
+    assert asyncio.run(service.mark_notification_read(1, ids[0]))
+    # Повторная отметка не меняет счетчик
+    assert asyncio.run(service.mark_notification_read(1, ids[0]))
+    assert asyncio.run(service.get_unread_count(1)) == 2
+    read = {n["id"]: n["read"] for n in _page(service)["notifications"]}
+    assert read == {ids[0]: True, ids[1]: False, ids[2]: False}
+
+
+def test_mark_read_evicted_is_404(service):
+    evicted = _send(service, 1)[0]
+    _send(service, 5)
+    client = TestClient(main.app)
+    assert client.post(f"/mark-read/1/{evicted}").status_code == 404
+    assert client.post("/mark-read/1/unknown").status_code == 404
+    assert client.get("/unread/1").json() == {"unread": 5}
+
+
+def test_send_is_single_round_trip(service, monkeypatch):
+    # Конвейер с зарегистрированным Script добавил бы SCRIPT EXISTS перед каждой записью
+    executed = []
+    original = Pipeline.execute
+
+    async def execute(pipe, *args, **kwargs):
+        executed.append([command[0][0] for command in pipe.command_stack])
+        return await original(pipe, *args, **kwargs)
+
+    async def load_scripts(pipe):
+        raise AssertionError("SCRIPT EXISTS round-trip")
+
+    asyncio.run(service.load_scripts())
+    monkeypatch.setattr(Pipeline, "execute", execute)
+    monkeypatch.setattr(Pipeline, "load_scripts", load_scripts)
+    assert asyncio.run(service.send_notification(_notification(1, 0)))
+    assert executed == [["EVALSHA"]]
+
+
+def test_script_reloaded_after_flush(service):
+    _send(service, 1)
+    asyncio.run(service.redis_client.script_flush())
+    _send(service, 1)
+    assert _page(service)["unread"] == 2
@@ -0,0 +1,66 @@
+import io
+
+import pytest
+
+from conftest import load_modules
+
+Image = pytest.importorskip("PIL.Image")
+np = pytest.importorskip("numpy")
+phash_index, = load_modules("backend/image-service", "app.phash_index")
+
+
+def _jpeg(width: int, height: int, orientation: int = 1) -> bytes:
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = ((x * 255 // width) ^ (y * 255 // height)).astype(np.uint8)
+    image = Image.fromarray(np.stack([pixels] * 3, axis=-1))
+    exif = Image.Exif()
+    exif[phash_index.EXIF_ORIENTATION] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+def test_find_within_distance_and_persist(tmp_path):
+    log_path = str(tmp_path / "index" / "phash.jsonl")
+    index = phash_index.NearDuplicateIndex(log_path)
+    index.load()
+    index.add(0b1111, "a")
+    index.add(0b1111, "b")
+    index.add(0b1111, "a")  # повтор не пишется в журнал
+    index.add(0b1111 << 8, "far")
+    assert len(index) == 3
+
+    assert index.find(0b0111, max_distance=1) == [{"key": "b", "distance": 1}, {"key": "a", "distance": 1}]
+    assert index.find(0b0111, max_distance=0) == []
+    index.close()
+
+    with open(log_path) as f:
+        assert len(f.readlines()) == 3
+    reloaded = phash_index.NearDuplicateIndex(log_path)
+    reloaded.load()
+    assert len(reloaded) == 3
+    assert [match["key"] for match in reloaded.find(0b1111 << 8, max_distance=0)] == ["far"]
+    reloaded.close()
+
+
+def test_rescaled_copy_matches_with_scaled_boxes():
+    original, half = _jpeg(400, 200), _jpeg(200, 100)
+    assert phash_index.hamming(phash_index.perceptual_hash(original), phash_index.perceptual_hash(half)) <= 6
+    assert phash_index.image_size(half) == (200, 100)
+
+    result = {"buildings": [{"id": 0, "bbox": [40, 20, 360, 180]}], "image_size": [400, 200]}
+    rescaled = phash_index.rescale_result(result, phash_index.image_size(half))
+    assert rescaled["buildings"][0]["bbox"] == [20, 10, 180, 90]
+    assert rescaled["image_size"] == [200, 100]
+    assert result["buildings"][0]["bbox"] == [40, 20, 360, 180]
+
+
+def test_rescale_skips_cropped_or_unknown_size():
+    result = {"buildings": [{"id": 0, "bbox": [40, 20, 360, 180]}], "image_size": [400, 200]}
+    assert phash_index.rescale_result(result, (300, 200)) is None
+    assert phash_index.rescale_result({"buildings": []}, (400, 200)) is None
+    assert phash_index.rescale_result(result, (400, 200))["buildings"] == result["buildings"]
+
+
+def test_image_size_follows_exif_rotation():
+    assert phash_index.image_size(_jpeg(400, 200, orientation=6)) == (200, 400)
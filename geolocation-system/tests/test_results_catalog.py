@@ -0,0 +1,64 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from conftest import load_modules
+
+pytest.importorskip("aiosqlite")
+results_catalog, = load_modules("backend/coordinates-service", "app.results_catalog")
+
+
+def test_ingest_duplicate_ids_last_wins():
+    async def run():
+        catalog = results_catalog.ResultsCatalog("sqlite:///:memory:")
+        await catalog.connect()
+        try:
+            loaded = await catalog.ingest([
+                {"id": "a", "latitude": 55.0, "longitude": 37.0, "confidence": 0.1},
+                {"id": "b", "latitude": 56.0, "longitude": 38.0},
+                {"id": "a", "latitude": 55.5, "longitude": 37.5, "confidence": 0.9},
+            ])
+            page = await catalog.query()
+        finally:
+            await catalog.close()
+        return loaded, page
+
+    loaded, page = asyncio.run(run())
+    assert sorted(loaded) == [("a", 55.5, 37.5), ("b", 56.0, 38.0)]
+    items = {item["id"]: item for item in page["items"]}
+    assert set(items) == {"a", "b"}
+    assert items["a"]["confidence"] == 0.9
+
+
+def _coordinates_app():
+    pytest.importorskip("geopy")
+    pytest.importorskip("minio")
+    # Без MinIO: иначе импорт ждет повторов подключения к minio:9000
+    with mock.patch("minio.Minio.bucket_exists", side_effect=ConnectionError("minio unavailable")):
+        main, = load_modules("backend/coordinates-service", "app.main")
+    return main
+
+
+def test_out_of_range_batch_rejected_before_any_write(tmp_path):
+    main = _coordinates_app()
+    from fastapi.testclient import TestClient
+
+    main.catalog = results_catalog.ResultsCatalog("sqlite:///:memory:")
+    main.spatial_index = type(main.spatial_index)(str(tmp_path))
+    with TestClient(main.app) as client:
+        response = client.post("/results/batch", json=[
+            {"id": "a", "latitude": 55.0, "longitude": 37.0},
+            {"id": "b", "latitude": 120.0, "longitude": 37.0},
+        ])
+        assert response.status_code == 422
+        response = client.post("/results/batch", json=[{"id": "c", "latitude": 55.0, "longitude": 181.0}])
+        assert response.status_code == 422
+
+        assert client.get("/results").json()["items"] == []
+        assert len(main.spatial_index) == 0
+
+        response = client.post("/results/batch", json=[{"id": "a", "latitude": 55.0, "longitude": 37.0}])
+        assert response.status_code == 200
+        assert [item["id"] for item in client.get("/results").json()["items"]] == ["a"]
+        assert len(main.spatial_index) == 1
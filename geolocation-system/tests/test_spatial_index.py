@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from conftest import load_modules
+
+spatial_index, = load_modules("backend/coordinates-service", "app.spatial_index")
+
+
+def _wal_lines(data_dir):
+    with open(os.path.join(data_dir, spatial_index.SpatialIndex.WAL_FILE)) as f:
+        return f.read().splitlines()
+
+
+def test_invalid_point_leaves_index_and_wal_untouched(tmp_path):
+    index = spatial_index.SpatialIndex(str(tmp_path))
+    index.load()
+    index.upsert("a", 55.0, 37.0)
+
+    with pytest.raises(ValueError):
+        index.upsert_many([("b", 56.0, 38.0), ("c", 91.0, 0.0), ("d", 57.0, 39.0)])
+
+    assert len(index) == 1
+    assert len(_wal_lines(str(tmp_path))) == 1
+    index.close()
+
+    reloaded = spatial_index.SpatialIndex(str(tmp_path))
+    reloaded.load()
+    assert [item["ref"] for item in reloaded.nearest(56.0, 38.0, k=10)] == ["a"]
+
+
+def test_snapshot_is_deferred_to_maybe_snapshot(tmp_path):
+    index = spatial_index.SpatialIndex(str(tmp_path), snapshot_every=3)
+    index.load()
+    index.upsert_many([(f"p{i}", 55.0 + i * 0.01, 37.0) for i in range(3)])
+
+    assert index.snapshot_due
+    assert not os.path.isdir(os.path.join(str(tmp_path), index.SNAPSHOT_DIR))
+    assert index.maybe_snapshot()
+    assert not index.snapshot_due
+    assert _wal_lines(str(tmp_path)) == []
+    assert not index.maybe_snapshot()
+
+
+def test_failed_snapshot_write_replays_pending_wal(tmp_path, monkeypatch):
+    data_dir = str(tmp_path)
+    index = spatial_index.SpatialIndex(data_dir)
+    index.load()
+    index.upsert_many([("a", 55.0, 37.0), ("b", 56.0, 38.0)])
+    index.remove("a")
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(index, "_write_snapshot", fail)
+    with pytest.raises(OSError):
+        index.snapshot()
+    index.upsert("c", 57.0, 39.0)
+    index._wal.close()
+
+    reloaded = spatial_index.SpatialIndex(data_dir)
+    reloaded.load()
+    assert sorted(item["ref"] for item in reloaded.nearest(56.0, 38.0, k=10)) == ["b", "c"]
+
+    reloaded.snapshot()
+    assert not os.path.exists(os.path.join(data_dir, reloaded.PENDING_WAL_FILE))
+    reloaded.close()
+    again = spatial_index.SpatialIndex(data_dir)
+    again.load()
+    assert len(again) == 2
@@ -0,0 +1,57 @@
+import pytest
+
+from conftest import load_modules
+
+pytest.importorskip("minio")
+street_view_cache, = load_modules("backend/coordinates-service", "app.street_view_cache")
+
+
+class FlakyMinio:
+    """MinIO, недоступный первые failures вызовов bucket_exists"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.checks = 0
+        self.objects = {}
+
+    def bucket_exists(self, bucket):
+        self.checks += 1
+        if self.checks <= self.failures:
+            raise ConnectionError("minio:9000 unreachable")
+        return True
+
+    def put_object(self, bucket, key, data, length, content_type, metadata):
+        self.objects[key] = data.read()
+        return type("Result", (), {"etag": "etag"})()
+
+
+def test_storage_recovers_after_unavailable_boot(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(street_view_cache.time, "monotonic", lambda: now[0])
+    client = FlakyMinio(failures=2)
+    cache = street_view_cache.StreetViewCache(client, retry_min_seconds=5, retry_max_seconds=60)
+
+    assert not cache.ensure_bucket()
+    cache._store("a.jpg", b"a", None)
+    assert client.checks == 1  # пауза еще не прошла
+
+    now[0] += 5
+    cache._store("b.jpg", b"b", None)
+    assert client.checks == 2 and not client.objects
+
+    now[0] += 5  # пауза удвоилась
+    cache._store("c.jpg", b"c", None)
+    assert client.checks == 2
+    now[0] += 5
+    item = cache._store("d.jpg", b"d", None)
+    assert client.checks == 3
+    assert list(client.objects) == ["d.jpg"] and item.etag == "etag"
+
+    cache._store("e.jpg", b"e", None)
+    assert client.checks == 3
+
+
+def test_no_client_never_retries():
+    cache = street_view_cache.StreetViewCache(None)
+    assert not cache.ensure_bucket()
+    assert cache._load_from_storage("a.jpg") is None